@@ -0,0 +1,359 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Suite de benchmarks del ETL completo con datos sintéticos reproducibles.
+Para cada tamaño de dataset genera un CSV y una API local con páginas JSON,
+ejecuta extract_from_csv, extract_from_api_async, transform_raw_data,
+load_to_final_table y las consultas de metabase/queries/, y guarda en un JSON
+el rendimiento (filas/s), los percentiles de latencia y la memoria pico de
+cada etapa. Si hay una línea base, compara con ella y termina con código 1
+cuando alguna etapa empeora más que el umbral indicado.
+
+Además compara, con la base vacía de datos del benchmark, el CSV cargado con
+extract, transform y load por separado ('csv_etapas') y con el pipeline en
+memoria de pipeline.py ('csv_pipeline'), e imprime la relación entre ambos.
+
+Cada etapa se ejecuta en un proceso hijo para medir su memoria pico por
+separado. Entre repeticiones se borran los registros del benchmark y se
+restauran las marcas de agua de 'transform' y 'load'.
+
+Requiere una base de datos PostgreSQL de pruebas (DATABASE_URL): cualquier otro
+registro pendiente en raw_data también se procesaría durante el benchmark.
+
+Uso (desde la raíz del repositorio):
+    python -m benchmarks.bench_etl --rows 10000 100000 1000000
+    python -m benchmarks.bench_etl --rows 10000 --save-baseline
+    python -m benchmarks.bench_etl --rows 10000 --threshold 0.15
+"""
+
+import argparse
+import glob
+import json
+import multiprocessing
+import os
+import platform
+import random
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+
+from src.utils.database import get_engine
+from src.etl.async_extract import _percentile, extract_from_api_async
+from src.etl.checkpoint import ensure_checkpoint_table, get_watermark, set_watermark
+from src.etl.extract import extract_from_csv
+from src.etl.instrumentation import flush_metrics
+from src.etl.load import load_to_final_table
+from src.etl.manifest import ensure_ingestion_tables
+from src.etl.pipeline import run_csv_pipeline
+from src.etl.staging import staging_table_name
+from src.etl.streaming import current_rss_mb, peak_rss_mb
+from src.etl.transform import transform_raw_data
+
+CSV_SOURCE = 'benchmark_etl_csv'
+API_SOURCE = 'benchmark_etl_api'
+API_PAGE_SIZE = 1000
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+QUERIES_DIR = os.path.join(BENCHMARKS_DIR, '..', 'metabase', 'queries')
+DEFAULT_RESULTS = os.path.join(BENCHMARKS_DIR, 'results.json')
+DEFAULT_BASELINE = os.path.join(BENCHMARKS_DIR, 'baseline.json')
+
+CATEGORIES = ['Electrónica', 'Hogar', 'Ropa', 'Alimentos']
+REGIONS = ['Norte', 'Sur', 'Este', 'Oeste']
+
+def generate_csv(path, num_rows, seed=42, chunksize=1000000):
+    """Generar un CSV de ventas sintético por bloques (reproducible con la semilla)"""
+    rng = np.random.default_rng(seed)
+    fechas = pd.Timestamp('2024-01-01')
+    for start in range(0, num_rows, chunksize):
+        size = min(chunksize, num_rows - start)
+        cantidad = rng.integers(1, 50, size)
+        precio = rng.uniform(5, 500, size).round(2)
+        chunk = pd.DataFrame({
+            'Producto': np.char.add('Producto ', rng.integers(1, 500, size).astype(str)),
+            'Categoria': rng.choice(CATEGORIES, size),
+            'Region': rng.choice(REGIONS, size),
+            'Cantidad': cantidad,
+            'Precio_Unitario': precio,
+            'Total_Venta': (cantidad * precio).round(2),
+            'Fecha': fechas + pd.to_timedelta(rng.integers(0, 365 * 24 * 60, size), unit='m'),
+            'temp_id': rng.integers(0, 10 ** 6, size),
+        })
+        chunk.to_csv(path, mode='w' if start == 0 else 'a', header=start == 0, index=False)
+
+def api_page(page, page_size, total_items, seed=42):
+    """Página de la API sintética (1-indexada); la misma página siempre devuelve los mismos datos"""
+    rng = random.Random(seed * 1000003 + page)
+    count = max(0, min(page_size, total_items - (page - 1) * page_size))
+    return {
+        'page': page,
+        'items': [
+            {
+                'producto': f"Producto {rng.randint(1, 500)}",
+                'categoria': rng.choice(CATEGORIES),
+                'cantidad': rng.randint(1, 50),
+                'precio_unitario': round(rng.uniform(5, 500), 2),
+            }
+            for _ in range(count)
+        ],
+    }
+
+def start_api_server(total_items, seed=42):
+    """Arrancar la API sintética en un puerto libre; devuelve (servidor, url)"""
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            query = parse_qs(urlparse(self.path).query)
+            page = int(query.get('page', ['1'])[0])
+            page_size = int(query.get('page_size', [str(API_PAGE_SIZE)])[0])
+            body = json.dumps(api_page(page, page_size, total_items, seed)).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/ventas"
+
+def run_stage(stage, options):
+    """Ejecutar una etapa en el proceso actual y devolver sus mediciones"""
+    start_rss = current_rss_mb()
+    start = time.perf_counter()
+    if stage == 'extract_csv':
+        rows = extract_from_csv(options['csv_path'], CSV_SOURCE, chunksize=options['chunksize'], force=True)
+    elif stage == 'extract_api':
+        extract_from_api_async(options['api_url'], source_name=API_SOURCE, pagination='page',
+                               page_size=API_PAGE_SIZE, items_key='items')
+        rows = options['api_items']
+    elif stage == 'transform':
+        rows = transform_raw_data(batch_size=options['batch_size'])
+    elif stage == 'load':
+        rows = load_to_final_table(batch_size=options['batch_size'])
+    elif stage == 'csv_etapas':
+        rows = extract_from_csv(options['csv_path'], CSV_SOURCE, chunksize=options['chunksize'], force=True)
+        transform_raw_data(batch_size=options['batch_size'])
+        load_to_final_table(batch_size=options['batch_size'])
+    elif stage == 'csv_pipeline':
+        rows = run_csv_pipeline(options['csv_path'], CSV_SOURCE, chunksize=options['chunksize'], force=True)
+    else:
+        raise ValueError(f"Etapa desconocida: {stage}")
+    elapsed = time.perf_counter() - start
+    flush_metrics()
+    return {
+        'rows': rows,
+        'seconds': elapsed,
+        'peak_memory_mb': peak_rss_mb(),
+        'memory_increase_mb': max(peak_rss_mb() - start_rss, 0.0),
+    }
+
+def run_stage_isolated(stage, options):
+    """Ejecutar una etapa en un proceso hijo para medir su memoria pico por separado"""
+    # Las conexiones del pool no deben compartirse con el hijo
+    get_engine().dispose()
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('fork')) as pool:
+        return pool.submit(run_stage, stage, options).result()
+
+def summarize(runs):
+    """Resumir las repeticiones de una etapa: rendimiento medio y percentiles de latencia"""
+    seconds = sorted(run['seconds'] for run in runs)
+    rows = runs[0]['rows']
+    return {
+        'rows': rows,
+        'repeats': len(runs),
+        'rows_per_second': rows * len(runs) / sum(seconds) if sum(seconds) > 0 else 0,
+        'latency_p50': _percentile(seconds, 50),
+        'latency_p95': _percentile(seconds, 95),
+        'latency_p99': _percentile(seconds, 99),
+        'peak_memory_mb': max(run['peak_memory_mb'] for run in runs),
+        'memory_increase_mb': max(run['memory_increase_mb'] for run in runs),
+    }
+
+def benchmark_queries(repeat):
+    """Medir la latencia de cada consulta de metabase/queries/"""
+    results = {}
+    for path in sorted(glob.glob(os.path.join(QUERIES_DIR, '*.sql'))):
+        name = 'query:' + os.path.splitext(os.path.basename(path))[0]
+        with open(path, encoding='utf-8') as f:
+            query = text(f.read())
+        latencies = []
+        try:
+            with get_engine().connect() as conn:
+                for _ in range(repeat):
+                    start = time.perf_counter()
+                    conn.execute(query).fetchall()
+                    latencies.append(time.perf_counter() - start)
+        except Exception as e:
+            # Las consultas de los dashboards requieren el esquema de cargar_datos_ejemplo.py
+            print(f"  {name}: omitida ({str(e).splitlines()[0]})")
+            continue
+        latencies.sort()
+        results[name] = {
+            'repeats': repeat,
+            'latency_p50': _percentile(latencies, 50),
+            'latency_p95': _percentile(latencies, 95),
+            'latency_p99': _percentile(latencies, 99),
+        }
+        print(f"  {name}: p50 {results[name]['latency_p50'] * 1000:.1f} ms, p95 {results[name]['latency_p95'] * 1000:.1f} ms")
+    return results
+
+def cleanup(watermarks):
+    """Borrar los registros del benchmark y restaurar las marcas de agua"""
+    sources = [CSV_SOURCE, API_SOURCE]
+    with get_engine().begin() as conn:
+        ensure_ingestion_tables(conn)
+        for source in sources:
+            conn.execute(text(f"DROP TABLE IF EXISTS {staging_table_name(source)}"))
+        conn.execute(text("""
+            DELETE FROM final_data WHERE processed_data_id IN (
+                SELECT p.id FROM processed_data p JOIN raw_data r ON r.id = p.raw_data_id
+                WHERE r.source = ANY(:sources)
+            )
+        """), {"sources": sources})
+        conn.execute(text("""
+            DELETE FROM processed_data WHERE raw_data_id IN (SELECT id FROM raw_data WHERE source = ANY(:sources))
+        """), {"sources": sources})
+        conn.execute(text("DELETE FROM raw_data WHERE source = ANY(:sources)"), {"sources": sources})
+        conn.execute(text("DELETE FROM raw_data_row_hashes WHERE source = ANY(:sources)"), {"sources": sources})
+        conn.execute(text("DELETE FROM ingested_files WHERE source = ANY(:sources)"), {"sources": sources})
+        for stage, last_id in watermarks.items():
+            set_watermark(conn, stage, last_id)
+
+def compare(results, baseline, threshold):
+    """
+    Comparar con la línea base; devuelve la lista de regresiones
+
+    Las etapas se comparan por filas/s (más es mejor) y las consultas por la
+    latencia p50 (menos es mejor). Solo se comparan las entradas presentes en
+    ambos archivos.
+    """
+    regressions = []
+    for size, entries in results['results'].items():
+        for name, current in entries.items():
+            previous = baseline.get('results', {}).get(size, {}).get(name)
+            if previous is None:
+                continue
+            if 'rows_per_second' in current:
+                metric, better = 'rows_per_second', 'higher'
+                change = (previous[metric] - current[metric]) / previous[metric] if previous[metric] else 0
+            else:
+                metric, better = 'latency_p50', 'lower'
+                change = (current[metric] - previous[metric]) / previous[metric] if previous[metric] else 0
+            status = 'REGRESIÓN' if change > threshold else 'ok'
+            print(f"  {size:>10} {name:<40} {metric:<16} {previous[metric]:>14.4f} -> {current[metric]:>14.4f} ({-change if better == 'higher' else change:+.1%}) {status}")
+            if change > threshold:
+                regressions.append((size, name, metric, previous[metric], current[metric]))
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description='Suite de benchmarks del ETL con datos sintéticos')
+    parser.add_argument('--rows', type=int, nargs='+', default=[10000, 100000], help='Tamaños de dataset (filas de CSV)')
+    parser.add_argument('--api-rows', type=int, default=None, help='Elementos de la API sintética (por defecto, min(filas, 100000))')
+    parser.add_argument('--repeat', type=int, default=3, help='Repeticiones de cada etapa')
+    parser.add_argument('--query-repeat', type=int, default=10, help='Repeticiones de cada consulta de Metabase')
+    parser.add_argument('--batch-size', type=int, default=10000, help='Registros por lote en transform y load')
+    parser.add_argument('--chunksize', type=int, default=50000, help='Filas por bloque en la extracción del CSV')
+    parser.add_argument('--seed', type=int, default=42, help='Semilla de los datos sintéticos')
+    parser.add_argument('--data-dir', default=os.path.join(tempfile.gettempdir(), 'etl_benchmarks'), help='Directorio de los CSV generados')
+    parser.add_argument('--results', default=DEFAULT_RESULTS, help='Archivo JSON de resultados')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help='Archivo JSON de la línea base')
+    parser.add_argument('--threshold', type=float, default=0.2, help='Empeoramiento máximo tolerado (0.2 = 20%%)')
+    parser.add_argument('--save-baseline', action='store_true', help='Guardar los resultados como nueva línea base')
+    args = parser.parse_args()
+
+    os.makedirs(args.data_dir, exist_ok=True)
+    with get_engine().begin() as conn:
+        ensure_checkpoint_table(conn)
+        watermarks = {stage: get_watermark(conn, stage) for stage in ('transform', 'load')}
+
+    results = {
+        'meta': {
+            'date': datetime.now().isoformat(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'seed': args.seed,
+            'repeat': args.repeat,
+            'batch_size': args.batch_size,
+            'chunksize': args.chunksize,
+        },
+        'results': {},
+    }
+
+    for num_rows in args.rows:
+        csv_path = os.path.join(args.data_dir, f"ventas_{num_rows}_{args.seed}.csv")
+        if not os.path.exists(csv_path):
+            print(f"Generando {csv_path}...")
+            generate_csv(csv_path, num_rows, args.seed)
+        api_items = args.api_rows or min(num_rows, 100000)
+        server, api_url = start_api_server(api_items, args.seed)
+        options = {
+            'csv_path': csv_path, 'api_url': api_url, 'api_items': api_items,
+            'batch_size': args.batch_size, 'chunksize': args.chunksize,
+        }
+
+        print(f"\n=== {num_rows} filas ===")
+        runs = {stage: [] for stage in ('extract_csv', 'extract_api', 'transform', 'load')}
+        comparison = {stage: [] for stage in ('csv_etapas', 'csv_pipeline')}
+        try:
+            for _ in range(args.repeat):
+                for stage in runs:
+                    runs[stage].append(run_stage_isolated(stage, options))
+                cleanup(watermarks)
+                for stage in comparison:
+                    comparison[stage].append(run_stage_isolated(stage, options))
+                    cleanup(watermarks)
+            # Las consultas se miden con los datos del benchmark cargados
+            for stage in runs:
+                run_stage_isolated(stage, options)
+            runs.update(comparison)
+            entries = {stage: summarize(stage_runs) for stage, stage_runs in runs.items()}
+            for stage, summary in entries.items():
+                print(f"  {stage}: {summary['rows_per_second']:,.0f} filas/s, p50 {summary['latency_p50']:.2f}s, "
+                      f"memoria pico {summary['peak_memory_mb']:.0f} MB")
+            staged, pipeline = entries['csv_etapas']['latency_p50'], entries['csv_pipeline']['latency_p50']
+            if pipeline > 0:
+                print(f"  pipeline frente a etapas separadas: {staged / pipeline:.2f}x (p50 {staged:.2f}s -> {pipeline:.2f}s)")
+            entries.update(benchmark_queries(args.query_repeat))
+            results['results'][str(num_rows)] = entries
+        finally:
+            server.shutdown()
+            cleanup(watermarks)
+
+    with open(args.results, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2)
+    print(f"\nResultados guardados en {args.results}")
+
+    if args.save_baseline:
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+        print(f"Línea base guardada en {args.baseline}")
+        return
+
+    if not os.path.exists(args.baseline):
+        print("No hay línea base con la que comparar (usa --save-baseline)")
+        return
+
+    with open(args.baseline, encoding='utf-8') as f:
+        baseline = json.load(f)
+    print(f"\nComparación con {args.baseline} (umbral {args.threshold:.0%}):")
+    regressions = compare(results, baseline, args.threshold)
+    if regressions:
+        print(f"{len(regressions)} regresiones por encima del umbral")
+        sys.exit(1)
+    print("Sin regresiones")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Micro-benchmark de los backends de serialización JSON de src/etl/json_utils.py.
+Mide dumps y loads con cargas representativas de cada etapa del ETL: filas de
+ventas con valores NumPy y NaN (extract), registros procesados (transform) y
+métricas (load).
+
+Uso (desde la raíz del repositorio):
+    python -m benchmarks.bench_json --records 100000
+"""
+
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from src.etl import json_utils
+
+def generate_payloads(num_records, seed=42):
+    """Generar las cargas de cada etapa con la forma de los datos reales"""
+    rng = np.random.default_rng(seed)
+    cantidades = rng.integers(1, 50, num_records)
+    precios = rng.uniform(5, 500, num_records).round(2)
+    precios[rng.random(num_records) < 0.05] = np.nan
+    fechas = pd.date_range('2024-01-01', periods=num_records, freq='min')
+
+    raw = [
+        {
+            'Producto': f"Producto {i % 500}",
+            'Categoria': ['Electrónica', 'Hogar', 'Ropa'][i % 3],
+            'Cantidad': cantidades[i],
+            'Precio_Unitario': precios[i],
+            'Fecha': fechas[i],
+        }
+        for i in range(num_records)
+    ]
+    processed = [
+        {
+            'producto': f"Producto {i % 500}",
+            'categoria': ['Electrónica', 'Hogar', 'Ropa'][i % 3],
+            'cantidad': int(cantidades[i]),
+            'precio_unitario': 0 if np.isnan(precios[i]) else float(precios[i]),
+        }
+        for i in range(num_records)
+    ]
+    metrics = [
+        {'sum': p['cantidad'] + p['precio_unitario'], 'avg': (p['cantidad'] + p['precio_unitario']) / 2,
+         'max': max(p['cantidad'], p['precio_unitario']), 'min': min(p['cantidad'], p['precio_unitario'])}
+        for p in processed
+    ]
+    return {'raw (numpy)': raw, 'processed': processed, 'metrics': metrics}
+
+def best_of(func, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+def main():
+    parser = argparse.ArgumentParser(description='Micro-benchmark de los backends JSON')
+    parser.add_argument('--records', type=int, default=100000, help='Número de registros por carga')
+    parser.add_argument('--repeat', type=int, default=3, help='Repeticiones por medición (se toma la mejor)')
+    args = parser.parse_args()
+
+    payloads = generate_payloads(args.records)
+    original = json_utils.get_backend()
+
+    print(f"{'carga':<14} {'backend':<8} {'dumps (s)':>10} {'loads (s)':>10} {'registros/s':>14}")
+    try:
+        for name, records in payloads.items():
+            for backend in json_utils.BACKENDS:
+                json_utils.set_backend(backend)
+                encoded = [json_utils.dumps(record) for record in records]
+                dumps_time = best_of(lambda: [json_utils.dumps(record) for record in records], args.repeat)
+                loads_time = best_of(lambda: [json_utils.loads(text) for text in encoded], args.repeat)
+                rate = args.records / (dumps_time + loads_time)
+                print(f"{name:<14} {backend:<8} {dumps_time:>10.3f} {loads_time:>10.3f} {rate:>14,.0f}")
+    finally:
+        json_utils.set_backend(original)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Benchmark de calculate_metrics_and_insights frente a su versión vectorizada.
+Genera registros procesados sintéticos y compara el tiempo de ambas
+implementaciones, comprobando que el resultado es idéntico.
+
+Uso (desde la raíz del repositorio):
+    python -m benchmarks.bench_metrics --records 100000
+"""
+
+import argparse
+import random
+import time
+
+from src.etl.load import calculate_metrics_and_insights, calculate_metrics_and_insights_batch
+
+CATEGORIES = ['Electrónica', 'Hogar', 'Ropa', 'Alimentos']
+REGIONS = ['Norte', 'Sur', 'Este', 'Oeste']
+
+def generate_records(num_records, seed=42):
+    """Generar registros con la forma de una fila de ventas procesada"""
+    rng = random.Random(seed)
+    records = []
+    for _ in range(num_records):
+        cantidad = rng.randint(1, 50)
+        precio = round(rng.uniform(5, 500), 2)
+        records.append({
+            'producto': f"Producto {rng.randint(1, 500)}",
+            'categoria': rng.choice(CATEGORIES),
+            'region': rng.choice(REGIONS),
+            'cantidad': cantidad,
+            'precio_unitario': precio,
+            'total_venta': round(cantidad * precio, 2),
+            'descuento': rng.choice([0, 0, 5, 10]),
+        })
+    return records
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark del cálculo de métricas por lotes')
+    parser.add_argument('--records', type=int, default=100000, help='Número de registros a generar')
+    parser.add_argument('--repeat', type=int, default=3, help='Repeticiones por implementación (se toma la mejor)')
+    args = parser.parse_args()
+
+    records = generate_records(args.records)
+
+    scalar_times, batch_times = [], []
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        expected = [calculate_metrics_and_insights(data) for data in records]
+        scalar_times.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        result = calculate_metrics_and_insights_batch(records)
+        batch_times.append(time.perf_counter() - start)
+
+    if result != expected:
+        raise SystemExit("Error: la versión vectorizada no coincide con la versión por registro")
+
+    scalar, batch = min(scalar_times), min(batch_times)
+    print(f"Registros: {args.records}")
+    print(f"Por registro: {scalar:.3f}s ({args.records / scalar:,.0f} registros/s)")
+    print(f"Vectorizado:  {batch:.3f}s ({args.records / batch:,.0f} registros/s)")
+    print(f"Aceleración:  {scalar / batch:.2f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Benchmark de escalado de la transformación en paralelo.
+Inserta registros sintéticos en raw_data y los transforma con distinto número
+de workers, midiendo el rendimiento de cada configuración. Entre ejecuciones
+se borran los registros procesados del benchmark y se rebobina la marca de
+agua de la etapa 'transform'.
+
+Requiere una base de datos PostgreSQL de pruebas (DATABASE_URL): cualquier otro
+registro pendiente en raw_data también se transformaría durante el benchmark.
+
+Uso (desde la raíz del repositorio):
+    python -m benchmarks.bench_parallel_transform --rows 200000 --workers 1 2 4 8 16
+"""
+
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+
+from src.utils.database import get_engine
+from src.etl.checkpoint import ensure_checkpoint_table, get_watermark, set_watermark
+from src.etl.extract import _chunk_to_copy_buffer, _copy_raw_data
+from src.etl.parallel import transform_parallel
+
+SOURCE_NAME = 'benchmark_parallel'
+
+def insert_rows(num_rows, chunksize=50000):
+    """Insertar registros sintéticos de ventas en raw_data con COPY"""
+    rng = np.random.default_rng(42)
+    raw_conn = get_engine().raw_connection()
+    try:
+        cursor = raw_conn.cursor()
+        for start in range(0, num_rows, chunksize):
+            size = min(chunksize, num_rows - start)
+            chunk = pd.DataFrame({
+                'Producto': rng.integers(1, 500, size).astype(str),
+                'Categoria': rng.choice(['Electrónica', 'Hogar', 'Ropa'], size),
+                'Cantidad': rng.integers(1, 50, size),
+                'Precio_Unitario': rng.uniform(5, 500, size).round(2),
+                'temp_id': rng.integers(0, 10 ** 6, size),
+            })
+            _copy_raw_data(cursor, _chunk_to_copy_buffer(chunk, SOURCE_NAME))
+        raw_conn.commit()
+    finally:
+        raw_conn.close()
+
+def reset(first_id):
+    """Borrar lo procesado del benchmark y rebobinar la marca de agua"""
+    with get_engine().begin() as conn:
+        conn.execute(text("""
+            DELETE FROM processed_data WHERE raw_data_id IN (SELECT id FROM raw_data WHERE source = :source)
+        """), {"source": SOURCE_NAME})
+        set_watermark(conn, 'transform', first_id - 1)
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark de escalado de la transformación en paralelo')
+    parser.add_argument('--rows', type=int, default=200000, help='Número de registros sintéticos')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8, 16], help='Números de workers a medir')
+    parser.add_argument('--batch-size', type=int, default=5000, help='Registros por lote reclamado')
+    args = parser.parse_args()
+
+    with get_engine().begin() as conn:
+        ensure_checkpoint_table(conn)
+        original_watermark = get_watermark(conn, 'transform')
+
+    print(f"Insertando {args.rows} registros sintéticos...")
+    insert_rows(args.rows)
+    with get_engine().connect() as conn:
+        first_id = conn.execute(text("SELECT MIN(id) FROM raw_data WHERE source = :source"), {"source": SOURCE_NAME}).scalar()
+
+    try:
+        baseline = None
+        print(f"{'workers':>8} {'segundos':>10} {'filas/s':>12} {'escalado':>9}")
+        for workers in args.workers:
+            reset(first_id)
+            start = time.perf_counter()
+            transform_parallel(workers, args.batch_size)
+            elapsed = time.perf_counter() - start
+            rate = args.rows / elapsed
+            baseline = baseline or rate
+            print(f"{workers:>8} {elapsed:>10.2f} {rate:>12,.0f} {rate / baseline:>8.2f}x")
+    finally:
+        reset(first_id)
+        with get_engine().begin() as conn:
+            conn.execute(text("DELETE FROM raw_data WHERE source = :source"), {"source": SOURCE_NAME})
+            set_watermark(conn, 'transform', original_watermark)
+
+if __name__ == "__main__":
+    main()
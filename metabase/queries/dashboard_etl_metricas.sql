@@ -7,6 +7,8 @@ SELECT
     COUNT(*) AS "Nu00famero de ejecuciones",
     AVG(EXTRACT(EPOCH FROM (end_time - start_time))) AS "Tiempo promedio (segundos)",
     SUM(records_processed) AS "Total registros procesados",
+    AVG(rows_per_second) AS "Filas por segundo (promedio)",
+    MAX(peak_memory_mb) AS "Memoria pico (MB)",
     SUM(CASE WHEN success = true THEN 1 ELSE 0 END) AS "Ejecuciones exitosas",
     SUM(CASE WHEN success = false THEN 1 ELSE 0 END) AS "Ejecuciones fallidas",
     ROUND(100.0 * SUM(CASE WHEN success = true THEN 1 ELSE 0 END) / COUNT(*), 2) AS "Tasa de u00e9xito (%)"
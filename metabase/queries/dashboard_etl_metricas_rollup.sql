@@ -0,0 +1,19 @@
+-- Dashboard de mu00e9tricas ETL (desde el agregado diario)
+-- Misma salida que dashboard_etl_metricas.sql, leyendo rollup_etl_diaria
+-- (src/etl/rollups.py) en lugar de recorrer etl_metrics
+
+SELECT 
+    r.process_name AS "Proceso",
+    r.dia AS "Fecha de ejecuciu00f3n",
+    r.ejecuciones AS "Nu00famero de ejecuciones",
+    r.duracion_total / r.ejecuciones AS "Tiempo promedio (segundos)",
+    r.registros_procesados AS "Total registros procesados",
+    r.filas_por_segundo_total / NULLIF(r.filas_por_segundo_n, 0) AS "Filas por segundo (promedio)",
+    r.memoria_pico_mb AS "Memoria pico (MB)",
+    r.ejecuciones_exitosas AS "Ejecuciones exitosas",
+    r.ejecuciones_fallidas AS "Ejecuciones fallidas",
+    ROUND(100.0 * r.ejecuciones_exitosas / r.ejecuciones, 2) AS "Tasa de u00e9xito (%)"
+FROM 
+    rollup_etl_diaria r
+ORDER BY 
+    "Fecha de ejecuciu00f3n" DESC, r.process_name;
@@ -0,0 +1,16 @@
+-- Mu00e9tricas por categoru00eda (desde el agregado diario)
+-- Misma salida que metricas_por_categoria.sql, leyendo rollup_categoria_diaria
+-- (src/etl/rollups.py) en lugar de recorrer processed_data
+
+SELECT 
+    r.category AS "Categoru00eda",
+    r.total_registros AS "Total registros",
+    r.valor_total AS "Valor total procesado",
+    r.valor_total / NULLIF(r.valores_no_nulos, 0) AS "Valor promedio",
+    r.valor_minimo AS "Valor mu00ednimo",
+    r.valor_maximo AS "Valor mu00e1ximo",
+    r.dia AS "Du00eda"
+FROM 
+    rollup_categoria_diaria r
+ORDER BY 
+    "Du00eda" DESC, "Valor total procesado" DESC;
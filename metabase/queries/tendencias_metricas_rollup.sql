@@ -0,0 +1,16 @@
+-- Tendencias de mu00e9tricas por dimensiu00f3n (desde el agregado diario)
+-- Misma salida que tendencias_metricas.sql, leyendo rollup_metricas_diaria
+-- (src/etl/rollups.py) en lugar de recorrer final_data
+
+SELECT 
+    r.metric_name AS "Mu00e9trica",
+    r.dimension1 AS "Dimensiu00f3n 1",
+    r.dimension2 AS "Dimensiu00f3n 2",
+    r.dia AS "Du00eda",
+    r.valor_total AS "Valor total",
+    r.valor_total / NULLIF(r.valores_no_nulos, 0) AS "Valor promedio",
+    r.total_registros AS "Cantidad de registros"
+FROM 
+    rollup_metricas_diaria r
+ORDER BY 
+    "Du00eda" DESC, "Valor total" DESC;
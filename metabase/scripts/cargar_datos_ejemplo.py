@@ -10,8 +10,12 @@ import psycopg2
 import random
 import datetime
 import argparse
+import io
 import sys
+import time
 from faker import Faker
+import numpy as np
+import pandas as pd
 import os
 
 # Configurar generador de datos falsos
@@ -92,6 +96,20 @@ def create_tables(conn):
     );
     """)
     
+    # Índices por fecha usados al recalcular los agregados diarios de un día
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_processed_data_processed_date ON processed_data(processed_date);")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_final_data_report_date ON final_data(report_date);")
+    
+    # Columnas de rendimiento que registra la instrumentación del ETL (src/etl/instrumentation.py)
+    cursor.execute("""
+    ALTER TABLE etl_metrics
+        ADD COLUMN IF NOT EXISTS rows_in BIGINT,
+        ADD COLUMN IF NOT EXISTS rows_out BIGINT,
+        ADD COLUMN IF NOT EXISTS bytes BIGINT,
+        ADD COLUMN IF NOT EXISTS rows_per_second DOUBLE PRECISION,
+        ADD COLUMN IF NOT EXISTS peak_memory_mb DOUBLE PRECISION;
+    """)
+    
     conn.commit()
     cursor.close()
 
@@ -184,11 +202,115 @@ def generate_etl_metrics(conn, num_processes):
     conn.commit()
     cursor.close()
 
+def skewed_choice(rng, options, size, skew):
+    """
+    Elegir valores de una lista con sesgo configurable
+    
+    Con skew=0 la distribución es uniforme; con valores mayores, la probabilidad
+    del elemento i es proporcional a 1 / (i + 1) ** skew (tipo Zipf).
+    """
+    weights = 1.0 / np.arange(1, len(options) + 1) ** skew
+    return np.asarray(options, dtype=object)[rng.choice(len(options), size=size, p=weights / weights.sum())]
+
+def reserve_ids(cursor, table, n):
+    """
+    Reservar un rango contiguo de n ids de la secuencia de una tabla
+    
+    El bloqueo evita que otras inserciones tomen valores de la secuencia en
+    mitad de la reserva; se libera al confirmar la transacción.
+    """
+    cursor.execute(f"LOCK TABLE {table} IN EXCLUSIVE MODE")
+    cursor.execute("SELECT nextval(pg_get_serial_sequence(%s, 'id'))", (table,))
+    start = cursor.fetchone()[0]
+    cursor.execute("SELECT setval(pg_get_serial_sequence(%s, 'id'), %s)", (table, start + n - 1))
+    return np.arange(start, start + n)
+
+def copy_dataframe(cursor, table, df):
+    """Cargar un DataFrame en una tabla con COPY (columnas = columnas del DataFrame)"""
+    buffer = io.StringIO()
+    df.to_csv(buffer, header=False, index=False, date_format='%Y-%m-%d %H:%M:%S')
+    buffer.seek(0)
+    cursor.copy_expert(f"COPY {table} ({', '.join(df.columns)}) FROM STDIN WITH (FORMAT csv)", buffer)
+
+def generate_bulk_chunk(cursor, rng, n, skew, days, now):
+    """Generar y cargar un bloque de n registros crudos con sus procesados y finales"""
+    # Datos crudos
+    raw_ids = reserve_ids(cursor, 'raw_data', n)
+    timestamps = now - pd.to_timedelta(rng.uniform(0, days * 86400, n), unit='s')
+    valores = rng.uniform(0, 1000, n).round(2).astype(str)
+    regiones = skewed_choice(rng, DIMENSION_VALUES['region'], n, skew)
+    data = '{"valor": ' + pd.Series(valores) + ', "region": "' + pd.Series(regiones) + '"}'
+    copy_dataframe(cursor, 'raw_data', pd.DataFrame({
+        'id': raw_ids,
+        'source': skewed_choice(rng, SOURCES, n, skew),
+        'data': data,
+        'timestamp': timestamps,
+    }))
+    
+    # Datos procesados (uno por registro crudo)
+    processed_ids = reserve_ids(cursor, 'processed_data', n)
+    processed_dates = timestamps + pd.to_timedelta(rng.integers(5, 61, n), unit='m')
+    copy_dataframe(cursor, 'processed_data', pd.DataFrame({
+        'id': processed_ids,
+        'raw_id': raw_ids,
+        'processed_value': rng.uniform(100, 10000, n).round(2),
+        'category': skewed_choice(rng, CATEGORIES, n, skew),
+        'processed_date': processed_dates,
+    }))
+    
+    # Datos finales (entre 1 y 3 métricas por registro procesado, con dos dimensiones distintas)
+    counts = rng.integers(1, 4, n)
+    m = int(counts.sum())
+    dimension_keys = list(DIMENSION_VALUES.keys())
+    dimension_values = np.array([DIMENSION_VALUES[key] for key in dimension_keys], dtype=object)
+    dimension1 = rng.integers(0, len(dimension_keys), m)
+    dimension2 = (dimension1 + rng.integers(1, len(dimension_keys), m)) % len(dimension_keys)
+    report_dates = np.repeat(processed_dates.values, counts) + pd.to_timedelta(rng.integers(5, 61, m), unit='m').values
+    copy_dataframe(cursor, 'final_data', pd.DataFrame({
+        'processed_id': np.repeat(processed_ids, counts),
+        'metric_name': skewed_choice(rng, METRICS, m, skew),
+        'metric_value': rng.uniform(10, 1000, m).round(2),
+        'dimension1': dimension_values[dimension1, rng.integers(0, dimension_values.shape[1], m)],
+        'dimension2': dimension_values[dimension2, rng.integers(0, dimension_values.shape[1], m)],
+        'report_date': report_dates,
+    }))
+    return n + n + m
+
+def generate_bulk_data(conn, num_records, chunk_size=1000000, skew=0.0, days=30, seed=None):
+    """
+    Generar datos masivos para pruebas de volumen
+    
+    Las columnas se generan con sorteos vectorizados de NumPy, los ids se
+    reservan por rangos para enlazar raw_data, processed_data y final_data sin
+    RETURNING, y cada tabla se carga con COPY. Cada bloque se confirma por separado.
+    """
+    rng = np.random.default_rng(seed)
+    now = pd.Timestamp.now()
+    cursor = conn.cursor()
+    start = time.perf_counter()
+    generated = 0
+    rows_written = 0
+    
+    while generated < num_records:
+        n = min(chunk_size, num_records - generated)
+        rows_written += generate_bulk_chunk(cursor, rng, n, skew, days, now)
+        conn.commit()
+        generated += n
+        elapsed = time.perf_counter() - start
+        print(f"  {generated}/{num_records} registros crudos ({rows_written / elapsed:,.0f} filas/s en total)")
+    
+    cursor.close()
+
 def main():
     parser = argparse.ArgumentParser(description='Generar datos de ejemplo para visualizar en Metabase')
     parser.add_argument('--raw', type=int, default=100, help='Número de registros crudos a generar')
     parser.add_argument('--etl', type=int, default=50, help='Número de métricas de ETL a generar')
     parser.add_argument('--reset', action='store_true', help='Eliminar datos existentes antes de insertar')
+    parser.add_argument('--bulk', action='store_true', help='Modo masivo: generación vectorizada y carga con COPY')
+    parser.add_argument('--chunk-size', type=int, default=1000000, help='Registros crudos por bloque en modo masivo')
+    parser.add_argument('--skew', type=float, default=0.0, help='Sesgo de las categorías en modo masivo (0 = uniforme)')
+    parser.add_argument('--days', type=int, default=30, help='Días hacia atrás en los que se reparten las fechas (modo masivo)')
+    parser.add_argument('--seed', type=int, default=None, help='Semilla para reproducir los datos (modo masivo)')
     
     args = parser.parse_args()
     
@@ -205,6 +327,15 @@ def main():
             cursor.execute("DELETE FROM processed_data;")
             cursor.execute("DELETE FROM raw_data;")
             cursor.execute("DELETE FROM etl_metrics;")
+            # Los agregados diarios (src/etl/rollups.py) se regeneran en el siguiente refresco
+            cursor.execute("DROP TABLE IF EXISTS rollup_categoria_diaria, rollup_metricas_diaria, rollup_etl_diaria;")
+            cursor.execute("""
+            DO $$ BEGIN
+                IF to_regclass('etl_checkpoints') IS NOT NULL THEN
+                    DELETE FROM etl_checkpoints WHERE stage LIKE 'rollup:%';
+                END IF;
+            END $$;
+            """)
             conn.commit()
             cursor.close()
         
@@ -213,12 +344,16 @@ def main():
         
         # Generar datos
         print(f"Generando {args.raw} registros de datos crudos...")
-        generate_raw_data(conn, args.raw)
+        if args.bulk:
+            generate_bulk_data(conn, args.raw, args.chunk_size, args.skew, args.days, args.seed)
+        else:
+            generate_raw_data(conn, args.raw)
         
         print(f"Generando {args.etl} métricas de ETL...")
         generate_etl_metrics(conn, args.etl)
         
         print("Datos generados correctamente.")
+        print("Para actualizar los agregados diarios de los dashboards: python -m src.etl.rollups")
         print("Ahora puedes visualizar estos datos en Metabase en http://localhost:3000")
         
         # Cerrar conexión
@@ -7,17 +7,23 @@ Este script utiliza la API REST de Metabase para exportar dashboards, coleccione
 """
 
 import requests
+import gzip
+import hashlib
 import json
 import os
 import datetime
 import argparse
 import sys
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 # Configuraciu00f3n por defecto
 METABASE_URL = "http://localhost:3000"
 OUTPUT_DIR = "../exports"
+WORKERS = 8
 
-def login_to_metabase(url, username, password):
+def login_to_metabase(url, username, password, session=None):
     """Iniciar sesiu00f3n en Metabase y obtener token de sesiu00f3n"""
     login_url = f"{url}/api/session"
     payload = {
@@ -26,159 +32,247 @@ def login_to_metabase(url, username, password):
     }
     
     try:
-        response = requests.post(login_url, json=payload)
+        response = (session or requests).post(login_url, json=payload)
         response.raise_for_status()
         return response.json()["id"]
     except requests.exceptions.RequestException as e:
         print(f"Error al iniciar sesiu00f3n en Metabase: {e}")
         sys.exit(1)
 
-def get_dashboards(url, session_token):
+def get_dashboards(url, session_token, session=None):
     """Obtener todos los dashboards disponibles"""
     dashboards_url = f"{url}/api/dashboard"
     headers = {"X-Metabase-Session": session_token}
     
     try:
-        response = requests.get(dashboards_url, headers=headers)
+        response = (session or requests).get(dashboards_url, headers=headers)
         response.raise_for_status()
         return response.json()
     except requests.exceptions.RequestException as e:
         print(f"Error al obtener dashboards: {e}")
         return []
 
-def export_dashboard(url, session_token, dashboard_id):
+def export_dashboard(url, session_token, dashboard_id, session=None):
     """Exportar un dashboard especu00edfico"""
     dashboard_url = f"{url}/api/dashboard/{dashboard_id}"
     headers = {"X-Metabase-Session": session_token}
     
     try:
-        response = requests.get(dashboard_url, headers=headers)
+        response = (session or requests).get(dashboard_url, headers=headers)
         response.raise_for_status()
         return response.json()
     except requests.exceptions.RequestException as e:
         print(f"Error al exportar dashboard {dashboard_id}: {e}")
         return None
 
-def get_collections(url, session_token):
+def get_collections(url, session_token, session=None):
     """Obtener todas las colecciones disponibles"""
     collections_url = f"{url}/api/collection"
     headers = {"X-Metabase-Session": session_token}
     
     try:
-        response = requests.get(collections_url, headers=headers)
+        response = (session or requests).get(collections_url, headers=headers)
         response.raise_for_status()
         return response.json()
     except requests.exceptions.RequestException as e:
         print(f"Error al obtener colecciones: {e}")
         return []
 
-def export_collection_items(url, session_token, collection_id):
+def export_collection_items(url, session_token, collection_id, session=None):
     """Exportar los elementos de una colecciu00f3n"""
     collection_items_url = f"{url}/api/collection/{collection_id}/items"
     headers = {"X-Metabase-Session": session_token}
     
     try:
-        response = requests.get(collection_items_url, headers=headers)
+        response = (session or requests).get(collection_items_url, headers=headers)
         response.raise_for_status()
         return response.json()
     except requests.exceptions.RequestException as e:
         print(f"Error al exportar elementos de la colecciu00f3n {collection_id}: {e}")
         return None
 
-def get_cards(url, session_token):
+def get_cards(url, session_token, session=None):
     """Obtener todas las tarjetas (preguntas) disponibles"""
     cards_url = f"{url}/api/card"
     headers = {"X-Metabase-Session": session_token}
     
     try:
-        response = requests.get(cards_url, headers=headers)
+        response = (session or requests).get(cards_url, headers=headers)
         response.raise_for_status()
         return response.json()
     except requests.exceptions.RequestException as e:
         print(f"Error al obtener tarjetas: {e}")
         return []
 
-def export_card(url, session_token, card_id):
+def export_card(url, session_token, card_id, session=None):
     """Exportar una tarjeta (pregunta) especu00edfica"""
     card_url = f"{url}/api/card/{card_id}"
     headers = {"X-Metabase-Session": session_token}
     
     try:
-        response = requests.get(card_url, headers=headers)
+        response = (session or requests).get(card_url, headers=headers)
         response.raise_for_status()
         return response.json()
     except requests.exceptions.RequestException as e:
         print(f"Error al exportar tarjeta {card_id}: {e}")
         return None
 
-def create_output_directory(output_dir):
-    """Crear directorio de salida si no existe"""
-    timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-    export_dir = os.path.join(output_dir, f"metabase_export_{timestamp}")
-    
-    os.makedirs(export_dir, exist_ok=True)
-    os.makedirs(os.path.join(export_dir, "dashboards"), exist_ok=True)
-    os.makedirs(os.path.join(export_dir, "collections"), exist_ok=True)
-    os.makedirs(os.path.join(export_dir, "cards"), exist_ok=True)
+def create_session(pool_size=WORKERS, retries=3):
+    """
+    Crear una sesión HTTP compartida con conexiones keep-alive y reintentos
     
-    return export_dir
+    El pool de conexiones se dimensiona para el número de hilos, de modo que
+    las solicitudes concurrentes reutilizan conexiones en lugar de abrir una
+    nueva cada vez. Los errores 429 y 5xx se reintentan con espera exponencial.
+    """
+    session = requests.Session()
+    retry = Retry(total=retries, backoff_factor=0.5, status_forcelist=[429, 500, 502, 503, 504],
+                  allowed_methods=frozenset(['GET']))
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+def create_output_directory(output_dir):
+    """Crear la estructura del respaldo si no existe (objetos y manifiestos)"""
+    os.makedirs(os.path.join(output_dir, "objects"), exist_ok=True)
+    os.makedirs(os.path.join(output_dir, "manifests"), exist_ok=True)
+    return output_dir
 
 def save_json(data, file_path):
     """Guardar datos en formato JSON"""
     with open(file_path, 'w', encoding='utf-8') as f:
         json.dump(data, f, indent=2, ensure_ascii=False)
 
-def export_all(url, session_token, output_dir):
-    """Exportar todos los elementos de Metabase"""
-    export_dir = create_output_directory(output_dir)
+def object_path(output_dir, digest):
+    """Ruta de un objeto del respaldo a partir de su hash"""
+    return os.path.join(output_dir, "objects", digest[:2], f"{digest}.json.gz")
+
+def store_object(output_dir, data):
+    """
+    Guardar un objeto JSON comprimido y direccionado por su contenido
     
-    # Exportar dashboards
-    print("Exportando dashboards...")
-    dashboards = get_dashboards(url, session_token)
-    save_json(dashboards, os.path.join(export_dir, "dashboards_list.json"))
+    El nombre del archivo es el SHA-256 del JSON canónico, por lo que un objeto
+    sin cambios entre respaldos no se vuelve a escribir.
     
-    for dashboard in dashboards:
-        dashboard_id = dashboard["id"]
-        dashboard_name = dashboard["name"]
-        print(f"  - Exportando dashboard: {dashboard_name} (ID: {dashboard_id})")
-        
-        dashboard_data = export_dashboard(url, session_token, dashboard_id)
-        if dashboard_data:
-            file_name = f"{dashboard_id}_{dashboard_name.replace(' ', '_')}.json"
-            save_json(dashboard_data, os.path.join(export_dir, "dashboards", file_name))
-    
-    # Exportar colecciones
-    print("\nExportando colecciones...")
-    collections = get_collections(url, session_token)
-    save_json(collections, os.path.join(export_dir, "collections_list.json"))
-    
-    for collection in collections:
-        collection_id = collection["id"]
-        collection_name = collection["name"]
-        print(f"  - Exportando colecciu00f3n: {collection_name} (ID: {collection_id})")
-        
-        collection_items = export_collection_items(url, session_token, collection_id)
-        if collection_items:
-            file_name = f"{collection_id}_{collection_name.replace(' ', '_')}.json"
-            save_json(collection_items, os.path.join(export_dir, "collections", file_name))
-    
-    # Exportar tarjetas (preguntas)
-    print("\nExportando tarjetas (preguntas)...")
-    cards = get_cards(url, session_token)
-    save_json(cards, os.path.join(export_dir, "cards_list.json"))
-    
-    for card in cards:
-        card_id = card["id"]
-        card_name = card["name"]
-        print(f"  - Exportando tarjeta: {card_name} (ID: {card_id})")
-        
-        card_data = export_card(url, session_token, card_id)
-        if card_data:
-            file_name = f"{card_id}_{card_name.replace(' ', '_')}.json"
-            save_json(card_data, os.path.join(export_dir, "cards", file_name))
+    Returns:
+        str: Hash del objeto
+    """
+    content = json.dumps(data, sort_keys=True, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+    digest = hashlib.sha256(content).hexdigest()
+    path = object_path(output_dir, digest)
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with gzip.open(temp_path, 'wb') as f:
+            f.write(content)
+        os.replace(temp_path, path)
+    return digest
+
+def load_object(output_dir, digest):
+    """Leer un objeto del respaldo a partir de su hash"""
+    with gzip.open(object_path(output_dir, digest), 'rb') as f:
+        return json.loads(f.read().decode('utf-8'))
+
+def load_latest_manifest(output_dir):
+    """Leer el manifiesto del último respaldo (None si no hay ninguno)"""
+    path = os.path.join(output_dir, "manifests", "latest.json")
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+def export_items(url, session_token, output_dir, kind, items, fetch, previous, session, workers):
+    """
+    Exportar en paralelo el detalle de cada elemento de un listado
+    
+    En modo incremental (previous no es None), los elementos cuyo updated_at
+    coincide con el del manifiesto anterior y cuyo objeto sigue guardado no se
+    vuelven a descargar.
+    
+    Returns:
+        tuple: (entradas del manifiesto por id, descargados, reutilizados)
+    """
+    entries = {}
+    pending = []
+    for item in items:
+        item_id = str(item["id"])
+        known = (previous or {}).get(item_id)
+        if (known is not None and item.get("updated_at") is not None
+                and known.get("updated_at") == item.get("updated_at")
+                and os.path.exists(object_path(output_dir, known["hash"]))):
+            entries[item_id] = known
+        else:
+            pending.append(item)
+    reused = len(entries)
+    
+    def export_one(item):
+        data = fetch(url, session_token, item["id"], session=session)
+        if not data:
+            return None
+        print(f"  - Exportando {kind}: {item.get('name')} (ID: {item['id']})")
+        return {
+            "name": item.get("name"),
+            "updated_at": item.get("updated_at"),
+            "hash": store_object(output_dir, data),
+        }
+    
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for item, entry in zip(pending, pool.map(export_one, pending)):
+            if entry is not None:
+                entries[str(item["id"])] = entry
+    return entries, len(pending), reused
+
+def export_all(url, session_token, output_dir, workers=WORKERS, incremental=True, session=None):
+    """
+    Exportar todos los elementos de Metabase
+    
+    Los listados y el detalle de cada dashboard, colección y tarjeta se guardan
+    como objetos comprimidos direccionados por contenido en output_dir/objects,
+    y cada respaldo escribe un manifiesto (output_dir/manifests) con el hash de
+    cada objeto. Los detalles se descargan con un pool de hilos sobre una sesión
+    compartida; en modo incremental solo se descargan los elementos cuyo
+    updated_at cambió desde el último manifiesto.
+    
+    Args:
+        url (str): URL de Metabase
+        session_token (str): Token de sesión
+        output_dir (str): Directorio del respaldo
+        workers (int): Número de solicitudes simultáneas
+        incremental (bool): Reutilizar los elementos sin cambios del último respaldo
+        session (requests.Session, optional): Sesión HTTP (por defecto, create_session)
+    
+    Returns:
+        str: Ruta del manifiesto del respaldo
+    """
+    create_output_directory(output_dir)
+    session = session or create_session(workers)
+    previous = load_latest_manifest(output_dir) if incremental else None
+    timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+    manifest = {"created_at": timestamp, "url": url, "lists": {}, "items": {}}
+    
+    object_types = [
+        ("dashboards", "dashboard", get_dashboards, export_dashboard),
+        ("collections", "colección", get_collections, export_collection_items),
+        ("cards", "tarjeta", get_cards, export_card),
+    ]
+    for key, kind, list_items, fetch in object_types:
+        print(f"\nExportando {key}...")
+        items = list_items(url, session_token, session=session)
+        manifest["lists"][key] = store_object(output_dir, items)
+        previous_items = previous["items"].get(key, {}) if previous else None
+        entries, fetched, reused = export_items(
+            url, session_token, output_dir, kind, items, fetch, previous_items, session, workers
+        )
+        manifest["items"][key] = entries
+        print(f"  {fetched} descargados, {reused} sin cambios")
+    
+    manifest_path = os.path.join(output_dir, "manifests", f"metabase_export_{timestamp}.json")
+    save_json(manifest, manifest_path)
+    save_json(manifest, os.path.join(output_dir, "manifests", "latest.json"))
     
-    print(f"\nExportaciu00f3n completa. Archivos guardados en: {export_dir}")
-    return export_dir
+    print(f"\nExportación completa. Manifiesto guardado en: {manifest_path}")
+    return manifest_path
 
 def main():
     parser = argparse.ArgumentParser(description='Respaldar configuraciu00f3n y dashboards de Metabase')
@@ -186,18 +280,22 @@ def main():
     parser.add_argument('--username', required=True, help='Nombre de usuario de Metabase')
     parser.add_argument('--password', required=True, help='Contraseu00f1a de Metabase')
     parser.add_argument('--output-dir', default=OUTPUT_DIR, help='Directorio de salida para los respaldos')
+    parser.add_argument('--workers', type=int, default=WORKERS, help='Solicitudes simultáneas a la API')
+    parser.add_argument('--completo', action='store_true', help='Descargar todos los elementos aunque no hayan cambiado')
     
     args = parser.parse_args()
     
     try:
         print(f"Iniciando sesiu00f3n en Metabase ({args.url})...")
-        session_token = login_to_metabase(args.url, args.username, args.password)
+        session = create_session(args.workers)
+        session_token = login_to_metabase(args.url, args.username, args.password, session=session)
         
         print("Exportando configuraciu00f3n de Metabase...")
-        export_dir = export_all(args.url, session_token, args.output_dir)
+        manifest_path = export_all(args.url, session_token, args.output_dir, workers=args.workers,
+                                   incremental=not args.completo, session=session)
         
         print("\nRespaldo completado exitosamente.")
-        print(f"Todos los datos han sido exportados a: {export_dir}")
+        print(f"Manifiesto del respaldo: {manifest_path}")
         
     except Exception as e:
         print(f"Error inesperado: {e}")
@@ -1,5 +1,8 @@
 -- Crear tablas para el proyecto
 
+-- raw_data y processed_data se pueden convertir en tablas particionadas por mes
+-- (timestamp / processed_at) con `python -m src.etl.partitions --migrar <tabla>`
+
 CREATE TABLE IF NOT EXISTS raw_data (
     id SERIAL PRIMARY KEY,
     timestamp TIMESTAMP NOT NULL,
@@ -7,6 +10,21 @@ CREATE TABLE IF NOT EXISTS raw_data (
     data JSONB NOT NULL
 );
 
+-- Hash del contenido de cada fila cargada desde CSV: evita duplicados al reingerir
+ALTER TABLE raw_data ADD COLUMN IF NOT EXISTS row_hash CHAR(32);
+
+CREATE INDEX IF NOT EXISTS idx_raw_data_timestamp ON raw_data(timestamp);
+CREATE INDEX IF NOT EXISTS idx_raw_data_source ON raw_data(source);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_raw_data_source_row_hash ON raw_data(source, row_hash) WHERE row_hash IS NOT NULL;
+
+-- Hashes de las filas ya cargadas por fuente: la deduplicación no depende de un
+-- índice único en raw_data, que no es posible si raw_data está particionada
+CREATE TABLE IF NOT EXISTS raw_data_row_hashes (
+    source VARCHAR(100) NOT NULL,
+    row_hash CHAR(32) NOT NULL,
+    PRIMARY KEY (source, row_hash)
+);
+
 CREATE TABLE IF NOT EXISTS processed_data (
     id SERIAL PRIMARY KEY,
     raw_data_id INTEGER REFERENCES raw_data(id),
@@ -14,6 +32,9 @@ CREATE TABLE IF NOT EXISTS processed_data (
     data JSONB NOT NULL
 );
 
+CREATE INDEX IF NOT EXISTS idx_processed_data_processed_at ON processed_data(processed_at);
+CREATE INDEX IF NOT EXISTS idx_processed_data_raw_data_id ON processed_data(raw_data_id);
+
 CREATE TABLE IF NOT EXISTS final_data (
     id SERIAL PRIMARY KEY,
     processed_data_id INTEGER REFERENCES processed_data(id),
@@ -22,8 +43,93 @@ CREATE TABLE IF NOT EXISTS final_data (
     insights TEXT
 );
 
--- Índices para mejorar el rendimiento
-CREATE INDEX IF NOT EXISTS idx_raw_data_timestamp ON raw_data(timestamp);
-CREATE INDEX IF NOT EXISTS idx_raw_data_source ON raw_data(source);
-CREATE INDEX IF NOT EXISTS idx_processed_data_processed_at ON processed_data(processed_at);
 CREATE INDEX IF NOT EXISTS idx_final_data_created_at ON final_data(created_at);
+CREATE INDEX IF NOT EXISTS idx_final_data_processed_data_id ON final_data(processed_data_id);
+
+-- Manifiesto de archivos ingeridos (escrito por src/etl/manifest.py)
+CREATE TABLE IF NOT EXISTS ingested_files (
+    id SERIAL PRIMARY KEY,
+    source VARCHAR(100) NOT NULL,
+    path TEXT NOT NULL,
+    size BIGINT NOT NULL,
+    mtime DOUBLE PRECISION NOT NULL,
+    content_hash CHAR(64) NOT NULL,
+    rows_ingested BIGINT NOT NULL DEFAULT 0,
+    ingested_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE (source, content_hash, path)
+);
+
+CREATE INDEX IF NOT EXISTS idx_ingested_files_source_path ON ingested_files(source, path);
+
+-- Plan de tipos inferido por fuente para leer sus CSV (escrito por src/etl/dtypes.py)
+CREATE TABLE IF NOT EXISTS csv_dtype_plans (
+    source VARCHAR(100) PRIMARY KEY,
+    plan JSONB NOT NULL,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Marcas de agua (high-water marks) por etapa del ETL para la selección incremental
+CREATE TABLE IF NOT EXISTS etl_checkpoints (
+    stage VARCHAR(50) PRIMARY KEY,
+    last_id BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Versión de cada tabla escrita por el ETL; invalida la caché de resultados de
+-- execute_query (ver src/utils/query_cache.py)
+CREATE TABLE IF NOT EXISTS etl_table_versions (
+    table_name VARCHAR(100) PRIMARY KEY,
+    version BIGINT NOT NULL,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Registros que una etapa del ETL no pudo procesar (cuarentena, ver src/etl/checkpoint.py)
+CREATE TABLE IF NOT EXISTS etl_dead_letters (
+    id SERIAL PRIMARY KEY,
+    stage VARCHAR(50) NOT NULL,
+    record_id BIGINT NOT NULL,
+    payload TEXT,
+    error TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 1,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE (stage, record_id)
+);
+
+-- Métricas de ejecución del ETL (escritas por src/etl/instrumentation.py)
+CREATE TABLE IF NOT EXISTS etl_metrics (
+    id SERIAL PRIMARY KEY,
+    process_name VARCHAR(50) NOT NULL,
+    start_time TIMESTAMP NOT NULL,
+    end_time TIMESTAMP NOT NULL,
+    records_processed INTEGER NOT NULL,
+    success BOOLEAN NOT NULL,
+    error_message TEXT,
+    execution_date DATE NOT NULL,
+    rows_in BIGINT,
+    rows_out BIGINT,
+    bytes BIGINT,
+    rows_per_second DOUBLE PRECISION,
+    peak_memory_mb DOUBLE PRECISION
+);
+
+CREATE INDEX IF NOT EXISTS idx_etl_metrics_execution_date ON etl_metrics(execution_date);
+
+-- Agregado diario de etl_metrics para los dashboards de Metabase (mantenido
+-- por src/etl/rollups.py). Los agregados de processed_data y final_data usan
+-- las columnas de metabase/scripts/cargar_datos_ejemplo.py y rollups.py solo
+-- crea sus tablas en las bases que las tienen.
+CREATE TABLE IF NOT EXISTS rollup_etl_diaria (
+    dia DATE NOT NULL,
+    process_name VARCHAR(50),
+    ejecuciones BIGINT NOT NULL,
+    duracion_total DOUBLE PRECISION,
+    registros_procesados BIGINT,
+    filas_por_segundo_total DOUBLE PRECISION,
+    filas_por_segundo_n BIGINT NOT NULL,
+    memoria_pico_mb DOUBLE PRECISION,
+    ejecuciones_exitosas BIGINT NOT NULL,
+    ejecuciones_fallidas BIGINT NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_rollup_etl_diaria_dia ON rollup_etl_diaria(dia);
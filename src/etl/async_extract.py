@@ -0,0 +1,257 @@
+import asyncio
+import itertools
+import math
+import time
+from datetime import datetime
+from sqlalchemy import text
+from ..utils.database import get_engine
+from ..utils.query_cache import bump_table_versions
+from . import json_utils
+from .checkpoint import lock_writes
+from .instrumentation import instrumented, record_error, record_progress
+
+DEFAULT_CONCURRENCY = 8
+DEFAULT_PAGE_SIZE = 100
+DEFAULT_BATCH_SIZE = 500
+
+# Nombres de parámetros por estilo de paginación: (posición, tamaño de página)
+PAGINATION_PARAMS = {
+    'page': ('page', 'per_page'),
+    'offset': ('offset', 'limit'),
+    'cursor': ('cursor', 'limit'),
+}
+
+# Códigos HTTP que se reintentan
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+@instrumented('extract')
+def extract_from_api_async(api_url, params=None, source_name="api", pagination=None,
+                           page_size=DEFAULT_PAGE_SIZE, max_pages=None, items_key=None,
+                           next_cursor_key="next_cursor", param_names=None,
+                           concurrency=DEFAULT_CONCURRENCY, batch_size=DEFAULT_BATCH_SIZE,
+                           retries=3, backoff=0.5, timeout=30, sink=None):
+    """
+    Extrae datos de una API de forma concurrente y los guarda en la tabla raw_data
+
+    Las solicitudes comparten una sesión HTTP con conexiones keep-alive y se
+    limitan a `concurrency` simultáneas. Cada respuesta se guarda como un
+    registro de raw_data; los registros se acumulan y se insertan por lotes.
+
+    Si una solicitud falla tras sus reintentos, se cancelan las demás, se
+    espera a que terminen las inserciones en curso y se devuelve el número de
+    registros ya confirmados. Los registros de una API no tienen hash de fila:
+    volver a extraerla inserta de nuevo esos registros.
+
+    Paginación:
+        - None: una única solicitud
+        - 'page': page=1, 2, ... hasta una página vacía o incompleta
+        - 'offset': offset=0, page_size, ... con el mismo criterio de parada
+        - 'cursor': sigue el cursor de la respuesta (next_cursor_key) hasta que sea nulo;
+          es secuencial por naturaleza
+
+    Args:
+        api_url (str): URL de la API
+        params (dict): Parámetros fijos para cada solicitud
+        source_name (str): Nombre de la fuente de datos
+        pagination (str, optional): Estilo de paginación ('page', 'offset' o 'cursor')
+        page_size (int): Número de elementos por página
+        max_pages (int, optional): Límite de páginas a solicitar
+        items_key (str, optional): Clave de la respuesta que contiene la lista de elementos;
+            si es None, la respuesta debe ser la propia lista
+        next_cursor_key (str): Clave de la respuesta con el siguiente cursor
+        param_names (tuple, optional): Sustituye los nombres de PAGINATION_PARAMS
+        concurrency (int): Número máximo de solicitudes simultáneas
+        batch_size (int): Número de respuestas por inserción
+        retries (int): Reintentos por solicitud ante errores de red, 429 o 5xx
+        backoff (float): Espera base en segundos entre reintentos (exponencial)
+        timeout (float): Tiempo máximo por solicitud en segundos
+        sink (callable, optional): Función sink(records) que guarda un lote; por defecto
+            inserta en raw_data
+
+    Returns:
+        int: Número de registros extraídos (en caso de error, los ya confirmados)
+    """
+    committed = {'records': 0}
+    try:
+        stats = asyncio.run(_extract(
+            api_url, params or {}, source_name, pagination, page_size, max_pages, items_key,
+            next_cursor_key, param_names or PAGINATION_PARAMS.get(pagination), concurrency,
+            batch_size, retries, backoff, timeout, sink or _insert_raw_records, committed
+        ))
+    except Exception as e:
+        print(f"Error al extraer datos de la API: {e}")
+        if committed['records']:
+            print(f"{committed['records']} registros ya confirmados en raw_data")
+        record_error(e)
+        return committed['records']
+
+    print(
+        f"{stats['records']} registros extraídos con {stats['requests']} solicitudes en "
+        f"{stats['elapsed']:.2f}s ({stats['requests_per_second']:,.1f} solicitudes/s, "
+        f"p50 {stats['latency_p50'] * 1000:.0f} ms, p99 {stats['latency_p99'] * 1000:.0f} ms)"
+    )
+    return stats['records']
+
+async def _extract(api_url, params, source_name, pagination, page_size, max_pages, items_key,
+                   next_cursor_key, param_names, concurrency, batch_size, retries, backoff,
+                   timeout, sink, committed):
+    """
+    Ejecuta la extracción y devuelve sus estadísticas
+
+    committed['records'] lleva la cuenta de los registros confirmados por el
+    sink, también si la extracción termina con una excepción.
+    """
+    import aiohttp
+
+    loop = asyncio.get_running_loop()
+    buffer = []
+    pending_writes = []
+    latencies = []
+    totals = {'requests': 0}
+
+    def store(payload):
+        data = json_utils.dumps(payload)
+        record_progress(rows_in=1, bytes=len(data))
+        buffer.append({
+            'timestamp': datetime.now().isoformat(),
+            'source': source_name,
+            'data': data
+        })
+        if len(buffer) >= batch_size:
+            batch = buffer[:]
+            buffer.clear()
+            pending_writes.append(asyncio.ensure_future(write(batch)))
+
+    async def write(batch):
+        await loop.run_in_executor(None, sink, batch)
+        committed['records'] += len(batch)
+
+    async def fetch(session, request_params):
+        for attempt in range(retries + 1):
+            start = time.perf_counter()
+            try:
+                async with session.get(api_url, params=request_params) as response:
+                    if response.status in RETRY_STATUSES and attempt < retries:
+                        raise aiohttp.ClientResponseError(
+                            response.request_info, response.history, status=response.status
+                        )
+                    response.raise_for_status()
+                    payload = await response.json(content_type=None, loads=json_utils.loads)
+                latencies.append(time.perf_counter() - start)
+                totals['requests'] += 1
+                return payload
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                status = getattr(e, 'status', None)
+                if attempt >= retries or (status is not None and status not in RETRY_STATUSES):
+                    raise
+                await asyncio.sleep(backoff * 2 ** attempt)
+
+    def items_of(payload):
+        items = payload.get(items_key) if items_key else payload
+        return items if isinstance(items, list) else None
+
+    async def fetch_all():
+        connector = aiohttp.TCPConnector(limit=concurrency)
+        session_timeout = aiohttp.ClientTimeout(total=timeout)
+        async with aiohttp.ClientSession(connector=connector, timeout=session_timeout) as session:
+            if pagination is None:
+                store(await fetch(session, params))
+
+            elif pagination == 'cursor':
+                cursor_param, size_param = param_names
+                cursor = None
+                for page in itertools.count():
+                    if max_pages is not None and page >= max_pages:
+                        break
+                    request_params = dict(params, **{size_param: page_size})
+                    if cursor is not None:
+                        request_params[cursor_param] = cursor
+                    payload = await fetch(session, request_params)
+                    store(payload)
+                    cursor = payload.get(next_cursor_key) if isinstance(payload, dict) else None
+                    if not cursor:
+                        break
+
+            elif pagination in ('page', 'offset'):
+                position_param, size_param = param_names
+                pages = itertools.count()
+                # Primera página vacía o incompleta; las posteriores se descartan
+                last_page = [max_pages - 1 if max_pages is not None else float('inf')]
+                # Las páginas se guardan en orden: una página posterior a la
+                # última que llega antes que ella espera aquí y se descarta
+                arrived = {}
+                next_page = [0]
+
+                async def worker():
+                    for page in pages:
+                        if page > last_page[0]:
+                            return
+                        position = page + 1 if pagination == 'page' else page * page_size
+                        payload = await fetch(session, dict(params, **{position_param: position, size_param: page_size}))
+                        items = items_of(payload)
+                        if items is None:
+                            raise ValueError(f"La respuesta no contiene una lista de elementos (items_key={items_key!r})")
+                        if len(items) < page_size:
+                            last_page[0] = min(last_page[0], page)
+                        arrived[page] = payload if items else None
+                        while next_page[0] in arrived and next_page[0] <= last_page[0]:
+                            ready = arrived.pop(next_page[0])
+                            if ready is not None:
+                                store(ready)
+                            next_page[0] += 1
+
+                workers = [asyncio.ensure_future(worker()) for _ in range(concurrency)]
+                try:
+                    await asyncio.gather(*workers)
+                finally:
+                    # Si un trabajador falla, los demás se cancelan en lugar de seguir pidiendo páginas
+                    for task in workers:
+                        task.cancel()
+                    await asyncio.gather(*workers, return_exceptions=True)
+
+            else:
+                raise ValueError(f"Estilo de paginación no soportado: {pagination}")
+
+    start = time.perf_counter()
+    try:
+        await fetch_all()
+    except BaseException:
+        # Las inserciones ya enviadas terminan (o fallan) antes de informar del error
+        await asyncio.gather(*pending_writes, return_exceptions=True)
+        raise
+
+    if buffer:
+        pending_writes.append(asyncio.ensure_future(write(buffer[:])))
+        buffer.clear()
+    results = await asyncio.gather(*pending_writes, return_exceptions=True)
+    errors = [result for result in results if isinstance(result, BaseException)]
+    if errors:
+        raise errors[0]
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        'records': committed['records'],
+        'requests': totals['requests'],
+        'elapsed': elapsed,
+        'requests_per_second': totals['requests'] / elapsed if elapsed > 0 else 0,
+        'latency_p50': _percentile(latencies, 50),
+        'latency_p99': _percentile(latencies, 99),
+    }
+
+def _percentile(sorted_values, percentile):
+    """Percentil por el método del rango más cercano sobre una lista ordenada"""
+    if not sorted_values:
+        return 0.0
+    rank = math.ceil(percentile / 100 * len(sorted_values))
+    return sorted_values[min(max(rank, 1), len(sorted_values)) - 1]
+
+def _insert_raw_records(records):
+    """Inserta un lote de registros en raw_data"""
+    with get_engine().begin() as conn:
+        lock_writes(conn, ['raw_data'])
+        conn.execute(
+            text("INSERT INTO raw_data (timestamp, source, data) VALUES (:timestamp, :source, :data)"),
+            records
+        )
+        bump_table_versions(conn, ['raw_data'])
@@ -0,0 +1,409 @@
+import argparse
+import os
+import time
+from sqlalchemy import text
+from sqlalchemy.exc import DataError, DBAPIError, IntegrityError, InterfaceError, OperationalError
+from ..utils.database import get_engine
+from . import json_utils
+from .partitions import pending_since
+
+# Tamaño de página por defecto para la selección incremental; cada lote se
+# confirma por separado junto con la marca de agua de su etapa
+DEFAULT_BATCH_SIZE = int(os.getenv("ETL_BATCH_SIZE", "10000"))
+
+# Reintentos de un lote ante errores transitorios y espera inicial (se duplica
+# en cada intento hasta RETRY_BACKOFF_MAX segundos)
+BATCH_RETRIES = int(os.getenv("ETL_BATCH_RETRIES", "3"))
+RETRY_BACKOFF_SECONDS = float(os.getenv("ETL_RETRY_BACKOFF_SECONDS", "1"))
+RETRY_BACKOFF_MAX = 30
+
+# Errores tras los que tiene sentido repetir el lote (conexión perdida,
+# deadlock, serialización, statement_timeout...)
+TRANSIENT_ERRORS = (OperationalError, InterfaceError, ConnectionError, TimeoutError)
+
+# Porcentaje máximo de registros de un lote que se pueden poner en cuarentena:
+# por encima, el fallo no es de los datos sino de la etapa (una restricción
+# nueva, un cambio de esquema...) y la etapa se detiene sin avanzar su marca.
+# No se aplica a lotes de menos de QUARANTINE_MIN_ROWS registros.
+QUARANTINE_MAX_RATIO = float(os.getenv("ETL_QUARANTINE_MAX_RATIO", "0.5"))
+QUARANTINE_MIN_ROWS = 10
+
+class RecordError(ValueError):
+    """Error de los datos de un registro concreto (el registro se pone en cuarentena)"""
+
+class QuarantineLimitError(RuntimeError):
+    """Demasiados registros de un lote en cuarentena (ver QUARANTINE_MAX_RATIO)"""
+
+# Errores de los datos de un registro: valores que no caben en su columna,
+# restricciones que no cumplen o registros que el handler rechaza con
+# RecordError. El resto (ProgrammingError, InternalError, errores de Python...)
+# son fallos de la etapa: se propagan y la marca de agua no avanza.
+DATA_ERRORS = (DataError, IntegrityError, RecordError)
+
+# Consulta para inicializar la marca de agua de cada etapa a partir de lo ya
+# procesado: el mayor id por debajo del cual todo está procesado (el primer
+# pendiente menos uno) y, si no hay pendientes, el mayor id procesado. No se
+# usa el máximo directamente porque un registro transformado de forma
+# individual (raw_data_id=N) dejaría sin procesar los pendientes anteriores
+STAGE_BOOTSTRAP = {
+    'transform': """
+        SELECT COALESCE(
+            (SELECT r.id - 1 FROM raw_data r
+             WHERE NOT EXISTS (SELECT 1 FROM processed_data p WHERE p.raw_data_id = r.id)
+             ORDER BY r.id LIMIT 1),
+            (SELECT MAX(raw_data_id) FROM processed_data),
+            0
+        )
+    """,
+    'load': """
+        SELECT COALESCE(
+            (SELECT p.id - 1 FROM processed_data p
+             WHERE NOT EXISTS (SELECT 1 FROM final_data f WHERE f.processed_data_id = p.id)
+             ORDER BY p.id LIMIT 1),
+            (SELECT MAX(processed_data_id) FROM final_data),
+            0
+        )
+    """,
+}
+
+# Tabla cuyos ids recorre cada etapa con marca de agua
+WATERMARK_TABLES = {
+    'transform': 'raw_data',
+    'transform_chunks': 'raw_data_chunks',
+    'load': 'processed_data',
+    'export_processed': 'processed_data',
+    'export_final': 'final_data',
+}
+
+# Las tablas que se leen por marca de agua reciben ids de una secuencia, y una
+# transacción que reservó un id menor puede confirmarse después de que la
+# etapa haya leído y avanzado su marca por encima. Para evitarlo, quien escribe
+# en una de estas tablas toma un bloqueo compartido al empezar su transacción
+# (antes de reservar ids) y quien lee por marca de agua toma el bloqueo
+# exclusivo antes de leer: la lectura espera a que terminen las escrituras en
+# curso y las nuevas esperan a que se confirme el lote. Los bloqueos se toman
+# siempre en este orden para que dos transacciones no se bloqueen mutuamente.
+WRITE_LOCK_ORDER = ('raw_data', 'raw_data_chunks', 'processed_data', 'final_data', 'etl_metrics')
+
+def lock_writes(conn, tables):
+    """
+    Toma el bloqueo compartido de escritura de las tablas (hasta el final de la transacción)
+
+    Args:
+        conn: Conexión de SQLAlchemy o cursor de psycopg2
+        tables (list): Tablas de WRITE_LOCK_ORDER en las que se va a escribir
+    """
+    for table in sorted(set(tables), key=WRITE_LOCK_ORDER.index):
+        params = {"key": f"etl_writes:{table}"}
+        if hasattr(conn, 'exec_driver_sql'):
+            conn.exec_driver_sql("SELECT pg_advisory_xact_lock_shared(hashtext(%(key)s))", params)
+        else:
+            conn.execute("SELECT pg_advisory_xact_lock_shared(hashtext(%(key)s))", params)
+
+def wait_for_writes(conn, table):
+    """
+    Espera a que terminen las escrituras en curso en una tabla y bloquea las nuevas hasta el final de la transacción
+
+    Se llama antes de leer registros por encima de una marca de agua (ver
+    WRITE_LOCK_ORDER). No hace nada si table es None.
+    """
+    if table is not None:
+        conn.execute(text("SELECT pg_advisory_xact_lock(hashtext(:key))"), {"key": f"etl_writes:{table}"})
+
+def ensure_checkpoint_table(conn):
+    """Crea la tabla etl_checkpoints si no existe"""
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS etl_checkpoints (
+            stage VARCHAR(50) PRIMARY KEY,
+            last_id BIGINT NOT NULL DEFAULT 0,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """))
+
+def ensure_dead_letter_table(conn):
+    """Crea la tabla etl_dead_letters (registros en cuarentena) si no existe"""
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS etl_dead_letters (
+            id SERIAL PRIMARY KEY,
+            stage VARCHAR(50) NOT NULL,
+            record_id BIGINT NOT NULL,
+            payload TEXT,
+            error TEXT NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 1,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE (stage, record_id)
+        )
+    """))
+
+def get_watermark(conn, stage):
+    """
+    Obtiene la marca de agua (último id procesado) de una etapa
+
+    Si la etapa todavía no tiene marca, se inicializa a partir de los datos ya
+    procesados para no volver a recorrer el histórico.
+
+    Args:
+        conn: Conexión activa de SQLAlchemy
+        stage (str): Nombre de la etapa ('transform', 'load', ...)
+
+    Returns:
+        int: Último id procesado por la etapa
+    """
+    row = conn.execute(
+        text("SELECT last_id FROM etl_checkpoints WHERE stage = :stage"),
+        {"stage": stage}
+    ).fetchone()
+    if row is not None:
+        return row[0]
+
+    last_id = 0
+    if stage in STAGE_BOOTSTRAP:
+        last_id = conn.execute(text(STAGE_BOOTSTRAP[stage])).scalar() or 0
+    set_watermark(conn, stage, last_id)
+    return last_id
+
+def set_watermark(conn, stage, last_id):
+    """Guarda la marca de agua de una etapa"""
+    conn.execute(
+        text("""
+            INSERT INTO etl_checkpoints (stage, last_id, updated_at)
+            VALUES (:stage, :last_id, CURRENT_TIMESTAMP)
+            ON CONFLICT (stage) DO UPDATE
+            SET last_id = EXCLUDED.last_id, updated_at = EXCLUDED.updated_at
+        """),
+        {"stage": stage, "last_id": last_id}
+    )
+
+def iter_pending_batches(stage, query, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Recorre los registros pendientes de una etapa con paginación por clave
+
+    La consulta debe aceptar los parámetros :last_id y :limit, filtrar con
+    id > :last_id y ordenar por id. Cada lote se entrega dentro de su propia
+    transacción; cuando el consumidor termina con el lote, la marca de agua se
+    avanza en esa misma transacción, de modo que el lote y su marca se
+    confirman juntos. Cada lote se lee sin escrituras en curso en la tabla de
+    la etapa (ver wait_for_writes).
+
+    Args:
+        stage (str): Nombre de la etapa
+        query: Consulta text() de SQLAlchemy
+        batch_size (int): Número máximo de registros por lote
+
+    Yields:
+        tuple: (conn, rows) con la conexión de la transacción y las filas del lote
+    """
+    with get_engine().begin() as conn:
+        ensure_checkpoint_table(conn)
+        last_id = get_watermark(conn, stage)
+
+    while True:
+        with get_engine().begin() as conn:
+            wait_for_writes(conn, WATERMARK_TABLES.get(stage))
+            rows = conn.execute(query, {"last_id": last_id, "limit": batch_size}).fetchall()
+            if not rows:
+                return
+            yield conn, rows
+            last_id = rows[-1][0]
+            set_watermark(conn, stage, last_id)
+
+def process_pending_batches(stage, query, handler, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Procesa los registros pendientes de una etapa confirmando cada lote por separado
+
+    Como iter_pending_batches, pero además:
+
+    - Si un lote falla por un error transitorio (ver TRANSIENT_ERRORS), se
+      repite hasta BATCH_RETRIES veces con espera exponencial.
+    - Si falla por un error de los datos (ver DATA_ERRORS), el lote se divide
+      en mitades dentro de la misma transacción (con savepoints) hasta aislar
+      los registros que fallan por sí solos, que se guardan en
+      etl_dead_letters; el resto del lote se confirma normalmente.
+    - Cualquier otro error, o un lote con demasiados registros en cuarentena
+      (ver QUARANTINE_MAX_RATIO), detiene la etapa sin avanzar la marca.
+
+    Cada lote se confirma con su marca de agua, de modo que una ejecución
+    interrumpida se reanuda desde el último lote confirmado, y se lee cuando no
+    hay escrituras en curso en la tabla de la etapa (ver wait_for_writes), por
+    lo que la marca nunca salta filas que se confirman tarde. Si la tabla de la
+    etapa está particionada, la consulta recibe en :since el inicio de la
+    partición más antigua con registros pendientes (ver
+    partitions.pending_since) para descartar las anteriores; si no, None.
+
+    Args:
+        stage (str): Nombre de la etapa
+        query: Consulta text() con :last_id, :since y :limit que devuelve (id, data, ...) ordenado por id
+        handler (callable): Función handler(conn, rows) que escribe un lote y devuelve el número de registros
+        batch_size (int): Número máximo de registros por lote
+
+    Yields:
+        int: Registros escritos en cada lote confirmado
+    """
+    with get_engine().begin() as conn:
+        ensure_checkpoint_table(conn)
+        ensure_dead_letter_table(conn)
+        last_id = get_watermark(conn, stage)
+        since = pending_since(conn, stage, last_id)
+
+    while True:
+        count, last_id = with_retries(stage, _process_next_batch, stage, query, handler, batch_size, last_id, since)
+        if last_id is None:
+            return
+        yield count
+
+def _process_next_batch(stage, query, handler, batch_size, last_id, since):
+    """Lee, escribe y confirma el siguiente lote; devuelve (registros, nueva marca) o (0, None)"""
+    with get_engine().begin() as conn:
+        wait_for_writes(conn, WATERMARK_TABLES.get(stage))
+        rows = conn.execute(query, {"last_id": last_id, "since": since, "limit": batch_size}).fetchall()
+        if not rows:
+            return 0, None
+        count = handle_batch(conn, stage, handler, rows)
+        set_watermark(conn, stage, rows[-1][0])
+    return count, rows[-1][0]
+
+def with_retries(stage, function, *args):
+    """
+    Ejecuta function(*args) repitiéndola ante errores transitorios con espera exponencial
+
+    Los errores no transitorios, y los transitorios tras BATCH_RETRIES
+    reintentos, se propagan.
+    """
+    for attempt in range(BATCH_RETRIES + 1):
+        try:
+            return function(*args)
+        except Exception as e:
+            if not is_transient(e) or attempt == BATCH_RETRIES:
+                raise
+            delay = min(RETRY_BACKOFF_SECONDS * 2 ** attempt, RETRY_BACKOFF_MAX)
+            print(f"Etapa {stage}: error transitorio ({e}); reintento {attempt + 1}/{BATCH_RETRIES} en {delay:.1f}s")
+            time.sleep(delay)
+
+def is_transient(error):
+    """Indica si un error se debe a la conexión o a la concurrencia y no a los datos"""
+    if isinstance(error, DBAPIError) and error.connection_invalidated:
+        return True
+    return isinstance(error, TRANSIENT_ERRORS)
+
+def is_data_error(error):
+    """Indica si un error se debe a los datos de los registros (y no a la etapa o a la conexión)"""
+    return isinstance(error, DATA_ERRORS) and not is_transient(error)
+
+def handle_batch(conn, stage, handler, rows):
+    """
+    Escribe un lote con handle_rows y detiene la etapa si hay demasiados registros en cuarentena
+
+    Si se superan QUARANTINE_MAX_RATIO registros del lote en cuarentena se lanza
+    QuarantineLimitError: la transacción se deshace (también las entradas de
+    etl_dead_letters) y la marca de agua no avanza.
+
+    Returns:
+        int: Registros escritos (sin contar los puestos en cuarentena)
+    """
+    quarantined = []
+    count = handle_rows(conn, stage, handler, rows, quarantined)
+    if len(rows) >= QUARANTINE_MIN_ROWS and len(quarantined) > QUARANTINE_MAX_RATIO * len(rows):
+        raise QuarantineLimitError(
+            f"Etapa {stage}: {len(quarantined)} de {len(rows)} registros del lote en cuarentena "
+            f"(máximo {QUARANTINE_MAX_RATIO:.0%}); último error: {quarantined[-1]}"
+        )
+    return count
+
+def handle_rows(conn, stage, handler, rows, quarantined=None):
+    """
+    Escribe un lote con handler aislando en cuarentena los registros que fallan
+
+    El lote se escribe dentro de un savepoint. Si falla por un error de los
+    datos (ver DATA_ERRORS), se deshace el savepoint y se escribe cada mitad
+    por separado, de forma recursiva; un registro que falla por sí solo se
+    guarda en etl_dead_letters. El resto de errores se propagan: los
+    transitorios para que se repita la transacción completa y los demás para
+    detener la etapa.
+
+    Args:
+        quarantined (list, optional): Lista en la que se añade el error de cada registro puesto en cuarentena
+
+    Returns:
+        int: Registros escritos (sin contar los puestos en cuarentena)
+    """
+    try:
+        with conn.begin_nested():
+            return handler(conn, rows)
+    except Exception as e:
+        if not is_data_error(e):
+            raise
+        if len(rows) == 1:
+            quarantine(conn, stage, rows[0], e)
+            if quarantined is not None:
+                quarantined.append(f"{type(e).__name__}: {e}")
+            return 0
+        middle = len(rows) // 2
+        return (handle_rows(conn, stage, handler, rows[:middle], quarantined)
+                + handle_rows(conn, stage, handler, rows[middle:], quarantined))
+
+def record_payload(row):
+    """
+    JSON de una fila (id, data, ...) como diccionario
+
+    Raises:
+        RecordError: Si el JSON no es un objeto (el registro se pone en cuarentena)
+    """
+    record = json_utils.loads(row[1])
+    if not isinstance(record, dict):
+        raise RecordError(f"El registro {row[0]} no es un objeto JSON: {type(record).__name__}")
+    return record
+
+def quarantine(conn, stage, row, error):
+    """Guarda un registro que no se pudo procesar en etl_dead_letters"""
+    payload = row[1] if len(row) > 1 else None
+    if payload is not None and not isinstance(payload, str):
+        payload = json_utils.dumps(payload)
+    conn.execute(
+        text("""
+            INSERT INTO etl_dead_letters (stage, record_id, payload, error)
+            VALUES (:stage, :record_id, :payload, :error)
+            ON CONFLICT (stage, record_id) DO UPDATE
+            SET payload = EXCLUDED.payload, error = EXCLUDED.error,
+                attempts = etl_dead_letters.attempts + 1, updated_at = CURRENT_TIMESTAMP
+        """),
+        {"stage": stage, "record_id": row[0], "payload": payload, "error": f"{type(error).__name__}: {error}"}
+    )
+    print(f"Etapa {stage}: registro {row[0]} en cuarentena ({type(error).__name__}: {error})")
+
+def release_dead_letters(conn, stage, record_ids):
+    """Elimina de etl_dead_letters los registros que ya se han procesado correctamente"""
+    ensure_dead_letter_table(conn)
+    conn.execute(
+        text("DELETE FROM etl_dead_letters WHERE stage = :stage AND record_id = ANY(:ids)"),
+        {"stage": stage, "ids": list(record_ids)}
+    )
+
+def main():
+    parser = argparse.ArgumentParser(description='Marcas de agua y registros en cuarentena de las etapas del ETL')
+    parser.add_argument('--etapa', default=None, help='Mostrar los registros en cuarentena de esta etapa')
+    parser.add_argument('--limite', type=int, default=20, help='Número máximo de registros en cuarentena a mostrar')
+    args = parser.parse_args()
+
+    with get_engine().begin() as conn:
+        ensure_checkpoint_table(conn)
+        ensure_dead_letter_table(conn)
+        print("Marcas de agua:")
+        for stage, last_id, updated_at in conn.execute(text(
+                "SELECT stage, last_id, updated_at FROM etl_checkpoints ORDER BY stage")):
+            print(f"  {stage:<30} {last_id:>12}  {updated_at}")
+        print("\nRegistros en cuarentena:")
+        for stage, count in conn.execute(text(
+                "SELECT stage, COUNT(*) FROM etl_dead_letters GROUP BY stage ORDER BY stage")):
+            print(f"  {stage:<30} {count:>12}")
+        if args.etapa:
+            print(f"\nÚltimos registros en cuarentena de {args.etapa}:")
+            rows = conn.execute(text("""
+                SELECT record_id, attempts, updated_at, error FROM etl_dead_letters
+                WHERE stage = :stage ORDER BY updated_at DESC LIMIT :limit
+            """), {"stage": args.etapa, "limit": args.limite})
+            for record_id, attempts, updated_at, error in rows:
+                print(f"  {record_id:>12}  intentos={attempts}  {updated_at}  {error}")
+
+if __name__ == '__main__':
+    main()
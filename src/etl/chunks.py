@@ -0,0 +1,237 @@
+import io
+import os
+from sqlalchemy import text
+from . import json_utils
+from .manifest import new_row_positions
+
+# Almacenamiento de los CSV en raw_data: 'rows' (una fila JSONB por registro) o
+# 'chunks' (un registro comprimido por bloque en raw_data_chunks)
+STORAGE_MODES = ('rows', 'chunks')
+RAW_STORAGE = os.getenv("ETL_RAW_STORAGE", "rows")
+
+# Formatos del contenido de un bloque: Parquet con las columnas del CSV, o
+# Parquet con el JSON de cada fila cuando las columnas no se pueden convertir a
+# Arrow (p. ej. una columna con números y texto mezclados)
+CHUNK_FORMAT = 'parquet'
+JSON_CHUNK_FORMAT = 'parquet_json'
+CHUNK_COMPRESSION = 'zstd'
+
+# Columna del bloque con el id reservado en la secuencia de raw_data para cada fila
+ID_COLUMN = '__raw_data_id'
+
+# Etapa (marca de agua) de transform para los bloques y bloques por transacción
+TRANSFORM_STAGE = 'transform_chunks'
+CHUNKS_PER_BATCH = 1
+
+# Tabla de bloques y columnas de processed_data que indican el bloque y la fila
+# de origen. El contenido ya va comprimido, por lo que se guarda sin compresión
+# de TOAST. Las filas de los bloques tienen id de la secuencia de raw_data pero
+# no fila en raw_data: en processed_data se guardan en chunk_row_id (raw_data_id
+# queda nulo y conserva su clave foránea) y en las tablas de staging, cuya clave
+# es ese id, se elimina la clave foránea hacia raw_data
+CHUNKS_DDL = """
+    DO $$
+    DECLARE
+        fk RECORD;
+    BEGIN
+        PERFORM pg_advisory_xact_lock(hashtext('raw_data_chunks'));
+        IF to_regclass('raw_data_chunks') IS NULL THEN
+            CREATE TABLE raw_data_chunks (
+                id SERIAL PRIMARY KEY,
+                timestamp TIMESTAMP NOT NULL,
+                source VARCHAR(100) NOT NULL,
+                row_count INTEGER NOT NULL,
+                first_id BIGINT NOT NULL,
+                last_id BIGINT NOT NULL,
+                min_timestamp TIMESTAMP,
+                max_timestamp TIMESTAMP,
+                format VARCHAR(20) NOT NULL,
+                json_bytes BIGINT NOT NULL,
+                payload BYTEA NOT NULL
+            );
+            ALTER TABLE raw_data_chunks ALTER COLUMN payload SET STORAGE EXTERNAL;
+            CREATE INDEX idx_raw_data_chunks_first_id ON raw_data_chunks(first_id);
+            CREATE INDEX idx_raw_data_chunks_timestamp ON raw_data_chunks(timestamp);
+        END IF;
+        ALTER TABLE processed_data ADD COLUMN IF NOT EXISTS raw_chunk_id INTEGER;
+        ALTER TABLE processed_data ADD COLUMN IF NOT EXISTS chunk_row_id BIGINT;
+        CREATE INDEX IF NOT EXISTS idx_processed_data_chunk_row_id ON processed_data(chunk_row_id);
+        FOR fk IN
+            SELECT conrelid::regclass AS referencing, conname FROM pg_constraint
+            WHERE contype = 'f' AND confrelid = 'raw_data'::regclass
+              AND conrelid::regclass::text LIKE 'staging\\_%'
+        LOOP
+            EXECUTE format('ALTER TABLE %s DROP CONSTRAINT %I', fk.referencing, fk.conname);
+        END LOOP;
+    END $$
+"""
+
+# Bloques pendientes de transformar; la segunda columna describe el bloque en
+# etl_dead_letters si no se puede leer
+PENDING_CHUNKS_QUERY = text("""
+    SELECT c.id, format('%s filas de %s (ids %s-%s)', c.row_count, c.source, c.first_id, c.last_id),
+           c.source, c.format, c.payload
+    FROM raw_data_chunks c
+    WHERE c.id > :last_id
+    ORDER BY c.id
+    LIMIT :limit
+""")
+
+CHUNKS_BY_ROW_ID_QUERY = text("""
+    SELECT c.id, c.source, c.format, c.payload FROM raw_data_chunks c
+    WHERE c.first_id <= :raw_data_id AND c.last_id >= :raw_data_id
+    ORDER BY c.id
+""")
+
+# Filas de bloques que ya tienen registro en processed_data
+PROCESSED_CHUNK_ROWS_QUERY = text("""
+    SELECT chunk_row_id FROM processed_data WHERE chunk_row_id = ANY(:ids)
+""")
+
+def ensure_chunk_table(conn):
+    """
+    Crea raw_data_chunks y las columnas processed_data.raw_chunk_id y chunk_row_id si no existen
+
+    Solo se llama al guardar un CSV por bloques. También elimina las claves
+    foráneas de las tablas de staging hacia raw_data: los ids de las filas de
+    los bloques no existen en raw_data y se rechazarían al transformarlas.
+    """
+    conn.execute(text(CHUNKS_DDL))
+
+def has_chunk_table(conn):
+    """Indica si existe raw_data_chunks (si no, no hay bloques que transformar)"""
+    return conn.execute(text("SELECT to_regclass('raw_data_chunks') IS NOT NULL")).scalar()
+
+def storage_mode(storage=None):
+    """Modo de almacenamiento indicado o, si es None, el de ETL_RAW_STORAGE"""
+    storage = storage or RAW_STORAGE
+    if storage not in STORAGE_MODES:
+        raise ValueError(f"Modo de almacenamiento no soportado: {storage}")
+    return storage
+
+def time_range(chunk, plan):
+    """
+    Fecha mínima y máxima de las columnas de fechas del plan en un bloque (None si no hay)
+
+    Las fechas se leen como texto; solo se convierten aquí, con el formato del
+    plan, y los valores que no lo cumplen se ignoran.
+    """
+    if plan is None:
+        return None, None
+    import pandas as pd
+
+    values = [pd.to_datetime(chunk[column], format=date_format, errors='coerce')
+              for column, date_format in plan['dates'].items() if column in chunk]
+    minimums = [series.min() for series in values if series.notna().any()]
+    maximums = [series.max() for series in values if series.notna().any()]
+    if not minimums:
+        return None, None
+    return min(minimums).to_pydatetime(), max(maximums).to_pydatetime()
+
+def write_chunk(cursor, chunk, payloads, source_name, time_bounds=(None, None)):
+    """
+    Guarda un bloque del CSV como un único registro de raw_data_chunks
+
+    Las filas se deduplican igual que en raw_data: solo se guardan las filas
+    cuyo hash entra nuevo en raw_data_row_hashes (ver
+    manifest.new_row_positions). Cada fila guardada recibe un id de la
+    secuencia de raw_data, de modo que la cuarentena y el staging funcionan
+    igual que con las filas de raw_data; en processed_data ese id se guarda en
+    chunk_row_id.
+
+    Args:
+        cursor: Cursor de psycopg2 (la transacción la confirma quien llama)
+        chunk (pandas.DataFrame): Bloque del CSV leído con dtypes.read_csv
+        payloads (list): JSON de cada fila del bloque
+        source_name (str): Nombre de la fuente de datos
+        time_bounds (tuple): Fecha mínima y máxima de los datos del bloque
+
+    Returns:
+        tuple: (filas nuevas, bytes del bloque comprimido, bytes del JSON de las filas nuevas)
+    """
+    import pandas as pd
+
+    positions = [position for position, _ in new_row_positions(cursor, payloads, source_name)]
+    if not positions:
+        return 0, 0, 0
+
+    cursor.execute(
+        "SELECT nextval(pg_get_serial_sequence('raw_data', 'id')) FROM generate_series(1, %s)",
+        (len(positions),)
+    )
+    ids = [row[0] for row in cursor.fetchall()]
+    new_payloads = [payloads[position] for position in positions]
+    try:
+        chunk_format = CHUNK_FORMAT
+        payload = encode_chunk(chunk.iloc[positions], ids)
+    except (TypeError, ValueError) as e:
+        # pyarrow.ArrowInvalid y ArrowTypeError derivan de ValueError y TypeError
+        print(f"Bloque de {source_name} guardado como JSON: las columnas no se pueden convertir a Arrow ({e})")
+        chunk_format = JSON_CHUNK_FORMAT
+        payload = encode_chunk(pd.DataFrame({'data': new_payloads}), ids)
+
+    json_bytes = sum(len(line.encode('utf-8')) for line in new_payloads)
+    cursor.execute("""
+        INSERT INTO raw_data_chunks (timestamp, source, row_count, first_id, last_id, min_timestamp,
+                                     max_timestamp, format, json_bytes, payload)
+        VALUES (CURRENT_TIMESTAMP, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+    """, (source_name, len(ids), min(ids), max(ids), time_bounds[0], time_bounds[1], chunk_format,
+          json_bytes, payload))
+    return len(ids), len(payload), json_bytes
+
+def encode_chunk(frame, ids):
+    """Serializa un bloque a Parquet comprimido con el id de raw_data de cada fila"""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    table = pa.Table.from_pandas(frame.reset_index(drop=True), preserve_index=False)
+    table = table.append_column(ID_COLUMN, pa.array(ids, pa.int64()))
+    buffer = io.BytesIO()
+    pq.write_table(table, buffer, compression=CHUNK_COMPRESSION)
+    return buffer.getvalue()
+
+def decode_chunk(payload, chunk_format):
+    """
+    Lee un bloque guardado con write_chunk
+
+    Las filas se vuelven a serializar a JSON igual que al cargarlas en raw_data
+    (json_utils.dumps_rows), por lo que transform recibe los mismos registros
+    en los dos modos de almacenamiento.
+
+    Returns:
+        list: Tuplas (id de raw_data, JSON de la fila)
+    """
+    import pyarrow.parquet as pq
+
+    table = pq.read_table(io.BytesIO(bytes(payload)))
+    ids = table.column(ID_COLUMN).to_pylist()
+    if chunk_format == JSON_CHUNK_FORMAT:
+        lines = table.column('data').to_pylist()
+    elif chunk_format == CHUNK_FORMAT:
+        frame = table.select([name for name in table.column_names if name != ID_COLUMN]).to_pandas()
+        lines = json_utils.dumps_rows(frame)
+    else:
+        raise ValueError(f"Formato de bloque no soportado: {chunk_format}")
+    return list(zip(ids, lines))
+
+def find_row(conn, raw_data_id):
+    """
+    Busca una fila guardada en un bloque por su id de raw_data
+
+    Returns:
+        tuple: (id del bloque, (id, JSON de la fila, fuente)) o (None, None)
+    """
+    for chunk_id, source, chunk_format, payload in conn.execute(
+            CHUNKS_BY_ROW_ID_QUERY, {"raw_data_id": raw_data_id}):
+        for row_id, line in decode_chunk(payload, chunk_format):
+            if row_id == raw_data_id:
+                return chunk_id, (row_id, line, source)
+    return None, None
+
+def print_storage_summary(rows, stored_bytes, json_bytes):
+    """Imprime el tamaño de los bloques guardados frente al del JSON de sus filas"""
+    ratio = json_bytes / stored_bytes if stored_bytes else 0
+    print(
+        f"{rows} filas en bloques: {stored_bytes / 1024 ** 2:.1f} MB comprimidos "
+        f"(JSON por fila {json_bytes / 1024 ** 2:.1f} MB, {ratio:.1f}x menos)"
+    )
@@ -0,0 +1,334 @@
+import io
+import os
+import sys
+import threading
+from sqlalchemy import text
+from . import json_utils
+
+# Con ETL_DTYPE_PLANNER_ENABLED=false los CSV se leen con los tipos por defecto de pandas
+DTYPE_PLANNER_ENABLED = os.getenv("ETL_DTYPE_PLANNER_ENABLED", "true").lower() in ("1", "true", "yes")
+
+# Motor de lectura de los CSV completos ('c' o 'pyarrow'); la lectura por
+# bloques siempre usa 'c'
+CSV_ENGINE = os.getenv("ETL_CSV_ENGINE", "c")
+
+# Filas de la muestra con la que se infiere el plan de una fuente
+SAMPLE_ROWS = 10000
+
+# Una columna de texto se lee como categórica si en la muestra tiene como
+# mucho CATEGORY_MAX_UNIQUE valores distintos y estos son como mucho
+# CATEGORY_MAX_RATIO de sus valores no nulos
+CATEGORY_MAX_UNIQUE = 1000
+CATEGORY_MAX_RATIO = 0.5
+
+# Valores que pandas lee como número o booleano en lugar de texto; si una columna
+# de texto del plan los contiene, el motor pyarrow no reproduce la lectura por
+# defecto y se usa el motor 'c'
+NON_TEXT_VALUE = r'\s*[-+]?(\d+\.?\d*|\.\d+)([eE][-+]?\d+)?\s*|(?i:[-+]?inf(inity)?|true|false)'
+
+# Formatos de fecha reconocidos; el patrón exige ceros a la izquierda
+DATE_FORMATS = [
+    ('%Y-%m-%d %H:%M:%S', r'\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}'),
+    ('%Y-%m-%dT%H:%M:%S', r'\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}'),
+    ('%Y-%m-%d', r'\d{4}-\d{2}-\d{2}'),
+    ('%d/%m/%Y', r'\d{2}/\d{2}/\d{4}'),
+]
+
+# Plan de tipos inferido por fuente, para no volver a muestrear cada archivo
+DTYPE_PLANS_DDL = """
+    CREATE TABLE IF NOT EXISTS csv_dtype_plans (
+        source VARCHAR(100) PRIMARY KEY,
+        plan JSONB NOT NULL,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+"""
+
+# Planes conocidos en este proceso: {fuente: plan}
+_plan_cache = {}
+_plan_lock = threading.Lock()
+
+def infer_plan(file_path, sample_rows=SAMPLE_ROWS):
+    """
+    Infiere el plan de tipos de un CSV a partir de sus primeras filas
+
+    - Columnas enteras y decimales: se reducen después de leer cada bloque al
+      tipo más estrecho que conserva todos los valores (ver apply_plan). No se
+      fijan al leer porque un valor fuera de rango se desbordaría en silencio.
+    - Columnas de texto con pocos valores distintos: se leen directamente como
+      categóricas; si en un bloque pandas las habría leído como números, se
+      convierten a ese tipo (ver apply_plan).
+    - Columnas de fechas con muchos valores distintos: se leen como texto (el
+      JSON de cada fila guarda el texto original); el formato detectado solo se
+      usa para calcular el rango de fechas de un bloque. Las fechas con pocos
+      valores distintos (p. ej. un día) se leen como categóricas.
+
+    Args:
+        file_path (str): Ruta al archivo CSV
+        sample_rows (int): Filas a examinar
+
+    Returns:
+        dict: Plan con columns (cabecera), integer, float, category, dates
+        ({columna: formato}) y text (resto de columnas de texto)
+    """
+    import pandas as pd
+
+    sample = pd.read_csv(file_path, nrows=sample_rows)
+    plan = {'columns': [str(column) for column in sample.columns],
+            'integer': [], 'float': [], 'category': [], 'dates': {}, 'text': []}
+    for column in sample.columns:
+        series = sample[column]
+        if pd.api.types.is_bool_dtype(series):
+            continue
+        if pd.api.types.is_integer_dtype(series):
+            plan['integer'].append(str(column))
+            continue
+        if pd.api.types.is_float_dtype(series):
+            plan['float'].append(str(column))
+            continue
+        values = series.dropna()
+        if values.empty or not all(isinstance(value, str) for value in values):
+            continue
+        unique = values.nunique()
+        if unique <= CATEGORY_MAX_UNIQUE and unique <= CATEGORY_MAX_RATIO * len(values):
+            plan['category'].append(str(column))
+            continue
+        date_format = _detect_date_format(values)
+        if date_format is not None:
+            plan['dates'][str(column)] = date_format
+        else:
+            plan['text'].append(str(column))
+    return plan
+
+def _detect_date_format(values):
+    """Formato de DATE_FORMATS que cumplen todos los valores, o None"""
+    import pandas as pd
+
+    for date_format, pattern in DATE_FORMATS:
+        if values.str.fullmatch(pattern).all():
+            try:
+                pd.to_datetime(values, format=date_format)
+            except (ValueError, TypeError):
+                continue
+            return date_format
+    return None
+
+def get_plan(conn, file_path, source_name):
+    """
+    Devuelve el plan de tipos de una fuente, infiriéndolo si hace falta
+
+    El plan se guarda en csv_dtype_plans y se reutiliza para los siguientes
+    archivos de la fuente mientras tengan la misma cabecera; si la cabecera
+    cambia, se vuelve a inferir con el archivo nuevo.
+
+    Args:
+        conn: Conexión activa de SQLAlchemy
+        file_path (str): Ruta al archivo CSV
+        source_name (str): Nombre de la fuente de datos
+
+    Returns:
+        dict: Plan de tipos (ver infer_plan)
+    """
+    import pandas as pd
+
+    header = [str(column) for column in pd.read_csv(file_path, nrows=0).columns]
+    with _plan_lock:
+        plan = _plan_cache.get(source_name)
+    if plan is None:
+        conn.execute(text(DTYPE_PLANS_DDL))
+        stored = conn.execute(
+            text("SELECT plan FROM csv_dtype_plans WHERE source = :source"),
+            {"source": source_name}
+        ).scalar()
+        plan = json_utils.loads(stored) if stored is not None else None
+    if plan is not None and plan['columns'] == header:
+        with _plan_lock:
+            _plan_cache[source_name] = plan
+        return plan
+
+    plan = infer_plan(file_path)
+    conn.execute(
+        text("""
+            INSERT INTO csv_dtype_plans (source, plan, updated_at)
+            VALUES (:source, :plan, CURRENT_TIMESTAMP)
+            ON CONFLICT (source) DO UPDATE
+            SET plan = EXCLUDED.plan, updated_at = EXCLUDED.updated_at
+        """),
+        {"source": source_name, "plan": json_utils.dumps(plan)}
+    )
+    with _plan_lock:
+        _plan_cache[source_name] = plan
+    print(
+        f"Plan de tipos para {source_name}: {len(plan['category'])} categóricas, "
+        f"{len(plan['integer']) + len(plan['float'])} numéricas, {len(plan['dates'])} fechas"
+    )
+    return plan
+
+def read_csv(file_path, plan=None, chunksize=None):
+    """
+    Lee un CSV aplicando un plan de tipos
+
+    Las columnas categóricas del plan se leen como categóricas (sin crear un
+    str por fila) y el resto con los tipos que infiere pandas; el plan se
+    completa después con apply_plan, de modo que el JSON de cada fila es el
+    mismo que sin plan aunque una columna cambie de tipo entre bloques. Las
+    columnas se leen todas (el JSON de cada fila las incluye), por lo que no se
+    usa usecols.
+
+    Con ETL_CSV_ENGINE=pyarrow y un plan, los archivos completos se leen con
+    pyarrow.csv (multihilo), indicando el tipo de las columnas de texto para
+    que no convierta fechas por su cuenta y el JSON de cada fila sea el mismo
+    que con el motor 'c'; las categóricas se leen directamente como
+    diccionario. Si alguna de esas columnas contiene valores que pandas
+    leería como números, se usa el motor 'c'.
+
+    Args:
+        file_path (str): Ruta al archivo CSV
+        plan (dict, optional): Plan de tipos; sin plan se usan los tipos por defecto
+        chunksize (int, optional): Si se indica, devuelve un iterador de bloques
+
+    Returns:
+        pandas.DataFrame o iterador de DataFrames con el plan aplicado
+    """
+    import pandas as pd
+
+    dtype = {column: 'category' for column in plan['category']} if plan is not None else None
+    if chunksize:
+        chunks = pd.read_csv(file_path, chunksize=chunksize, dtype=dtype)
+        return (apply_plan(chunk, plan) for chunk in chunks)
+    if plan is not None and csv_engine() == 'pyarrow':
+        try:
+            return apply_plan(_read_csv_pyarrow(file_path, plan), plan)
+        except Exception as e:
+            # p. ej. un tipo inferido en el primer bloque que no vale para los siguientes
+            print(f"No se pudo leer {file_path} con pyarrow ({e}); se usa el motor 'c'")
+    return apply_plan(pd.read_csv(file_path, dtype=dtype), plan)
+
+def csv_engine():
+    """Motor de lectura configurado, o 'c' si pyarrow no está instalado"""
+    if CSV_ENGINE == 'pyarrow':
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            print("pyarrow no está instalado; se usa el motor de lectura 'c'")
+            return 'c'
+    return CSV_ENGINE
+
+def _read_csv_pyarrow(file_path, plan):
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.csv as pa_csv
+
+    column_types = {column: pa.dictionary(pa.int32(), pa.string()) for column in plan['category']}
+    column_types.update({column: pa.string() for column in list(plan['dates']) + plan.get('text', [])})
+    table = pa_csv.read_csv(
+        file_path,
+        convert_options=pa_csv.ConvertOptions(column_types=column_types, strings_can_be_null=True)
+    )
+    for column in column_types:
+        if column in table.column_names and pc.any(pc.match_substring_regex(
+                pc.cast(table.column(column), pa.string()), f'^(?:{NON_TEXT_VALUE})$')).as_py():
+            raise ValueError(f"la columna {column} tiene valores que no son texto")
+    return table.to_pandas()
+
+def apply_plan(frame, plan):
+    """
+    Completa el plan de tipos en un bloque leído con read_csv
+
+    Las columnas categóricas del plan se dejan como categóricas si pandas las
+    habría leído como texto; si no (un bloque en el que solo hay números, por
+    ejemplo), se convierten al tipo que habría inferido pandas. Los enteros se
+    reducen con pd.to_numeric(downcast=...) y los decimales solo pasan a
+    float32 si todos los valores se conservan exactamente, por lo que el JSON
+    de cada fila no cambia. Las fechas se dejan como texto.
+    """
+    if plan is None:
+        return frame
+    import pandas as pd
+
+    for column in plan['category']:
+        if column in frame and isinstance(frame[column].dtype, pd.CategoricalDtype):
+            frame[column] = _category_or_default(frame[column])
+    for column in plan['integer']:
+        if column in frame and pd.api.types.is_integer_dtype(frame[column]):
+            frame[column] = pd.to_numeric(frame[column], downcast='integer')
+    for column in plan['float']:
+        if column in frame and pd.api.types.is_float_dtype(frame[column]):
+            narrow = frame[column].astype('float32')
+            if (narrow.astype('float64') == frame[column]).sum() == frame[column].count():
+                frame[column] = narrow
+    return frame
+
+def _category_or_default(series):
+    """
+    Columna leída como categórica, o con el tipo que habría inferido pandas si no es texto
+
+    pandas infiere el tipo de una columna a partir de sus valores distintos
+    (y de si tiene nulos), así que basta con volver a leer las categorías: si
+    pandas las lee como texto la columna se deja categórica; si no, cada fila
+    toma el valor leído de su categoría.
+    """
+    import pandas as pd
+
+    categories = pd.DataFrame({'value': series.cat.categories.astype(str)})
+    has_nulls = bool(series.isna().any())
+    if has_nulls:
+        categories.loc[len(categories)] = [None]
+    buffer = io.StringIO()
+    categories.to_csv(buffer, index=False)
+    buffer.seek(0)
+    values = pd.read_csv(buffer)['value']
+    if pd.api.types.infer_dtype(values, skipna=True) in ('string', 'empty'):
+        return series
+    # El código -1 (nulo) toma la última fila, la del valor nulo
+    return pd.Series(values.to_numpy()[series.cat.codes.to_numpy()], index=series.index, name=series.name)
+
+def memory_usage(frame):
+    """Memoria ocupada por un DataFrame en bytes (incluidos los objetos de las columnas de texto)"""
+    return int(frame.memory_usage(deep=True, index=False).sum())
+
+def default_memory_usage(frame, plan):
+    """
+    Estima la memoria que ocuparía un bloque leído con los tipos por defecto
+
+    Las columnas categóricas se cuentan como columnas object (un puntero y un
+    str por fila) y las numéricas reducidas como 64 bits.
+    """
+    if plan is None:
+        return memory_usage(frame)
+    import pandas as pd
+
+    total = 0
+    rows = len(frame)
+    for column in frame.columns:
+        series = frame[column]
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            counts = series.value_counts(sort=False)
+            total += rows * 8 + sum(int(count) * sys.getsizeof(value) for value, count in counts.items())
+            total += int(series.isna().sum()) * sys.getsizeof(float('nan'))
+        elif column in plan['integer'] or column in plan['float']:
+            total += rows * 8
+        else:
+            total += int(series.memory_usage(deep=True, index=False))
+    return total
+
+def report_memory(file_path, planned_bytes, default_bytes, peak_mb=None):
+    """
+    Imprime la memoria ahorrada por el plan de tipos en un archivo
+
+    planned_bytes y default_bytes son la memoria de los DataFrames (la segunda
+    estimada, ver default_memory_usage); peak_mb, si se indica, es el pico de
+    memoria residente medido durante la lectura.
+    """
+    saved = default_bytes - planned_bytes
+    ratio = saved / default_bytes if default_bytes else 0
+    peak = f"; pico de memoria del proceso {peak_mb:.0f} MB" if peak_mb is not None else ""
+    print(
+        f"Memoria de {os.path.basename(file_path)}: {planned_bytes / 1024 ** 2:.1f} MB "
+        f"(con tipos por defecto {default_bytes / 1024 ** 2:.1f} MB, ahorro {saved / 1024 ** 2:.1f} MB, {ratio:.0%})"
+        f"{peak}"
+    )
+
+def clear_plan_cache():
+    """Olvida los planes conocidos en este proceso"""
+    with _plan_lock:
+        _plan_cache.clear()
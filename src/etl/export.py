@@ -0,0 +1,345 @@
+import argparse
+import os
+import time
+from sqlalchemy import text
+from ..utils.database import get_engine
+from . import chunks, json_utils
+from .checkpoint import DEFAULT_BATCH_SIZE, iter_pending_batches
+from .instrumentation import instrumented, record_error, record_progress
+from .partitions import check_migrations
+
+# Directorio base de los datos exportados (data/ en la raíz del proyecto)
+DATA_DIR = os.getenv("ETL_DATA_DIR", os.path.join(os.path.dirname(__file__), '..', '..', 'data'))
+
+# Compresión de los archivos Parquet
+PARQUET_COMPRESSION = 'zstd'
+
+# Columnas de partición: data/<tabla>/fecha=AAAA-MM-DD/source=<fuente>/part-<id>-<id>-0.parquet
+PARTITION_COLUMNS = ['fecha', 'source']
+
+# Consultas incrementales por tabla. Si existe raw_data_chunks (CSV guardados
+# por bloques, ver chunks.py) la fuente de las filas de los bloques se obtiene
+# de raw_data_chunks y su id de processed_data.chunk_row_id. Las filas cuyo
+# registro de origen ya no existe (p. ej. borrado al retirar una partición
+# antigua de raw_data) se exportan igual, con la fuente UNKNOWN_SOURCE; la
+# fecha de partición sale de la propia tabla exportada (o de processed_at)
+EXPORTS = {
+    'processed': {
+        'stage': 'export_processed',
+        'query': """
+            SELECT p.id, {raw_data_id} AS raw_data_id, COALESCE(p.processed_at, r.timestamp) AS processed_at,
+                   {source} AS source, p.data
+            FROM processed_data p
+            LEFT JOIN raw_data r ON r.id = p.raw_data_id
+            {chunk_join}
+            WHERE p.id > :last_id
+            ORDER BY p.id
+            LIMIT :limit
+        """,
+        'columns': ['id', 'raw_data_id', 'processed_at', 'source'],
+        'date_column': 'processed_at',
+        'payloads': ['data'],
+    },
+    'final': {
+        'stage': 'export_final',
+        'query': """
+            SELECT f.id, f.processed_data_id, COALESCE(f.created_at, p.processed_at) AS created_at,
+                   {source} AS source, f.insights, f.metrics
+            FROM final_data f
+            LEFT JOIN processed_data p ON p.id = f.processed_data_id
+            LEFT JOIN raw_data r ON r.id = p.raw_data_id
+            {chunk_join}
+            WHERE f.id > :last_id
+            ORDER BY f.id
+            LIMIT :limit
+        """,
+        'columns': ['id', 'processed_data_id', 'created_at', 'source', 'insights'],
+        'date_column': 'created_at',
+        'payloads': ['metrics'],
+    },
+}
+
+# Fragmentos de las consultas sin y con raw_data_chunks
+QUERY_PARTS = {
+    False: {
+        'raw_data_id': 'p.raw_data_id',
+        'source': "COALESCE(r.source, :unknown_source)",
+        'chunk_join': '',
+    },
+    True: {
+        'raw_data_id': 'COALESCE(p.raw_data_id, p.chunk_row_id)',
+        'source': "COALESCE(r.source, c.source, :unknown_source)",
+        'chunk_join': 'LEFT JOIN raw_data_chunks c ON c.id = p.raw_chunk_id',
+    },
+}
+
+# Fuente de las filas cuyo registro de origen ya no existe
+UNKNOWN_SOURCE = 'desconocida'
+
+def export_query(table, with_chunks):
+    """Consulta incremental de una tabla, con o sin las filas guardadas por bloques"""
+    query = text(EXPORTS[table]['query'].format(**QUERY_PARTS[bool(with_chunks)]))
+    return query.bindparams(unknown_source=UNKNOWN_SOURCE)
+
+@instrumented('export')
+def export_to_parquet(tables=None, batch_size=DEFAULT_BATCH_SIZE, data_dir=None):
+    """
+    Exporta processed_data y final_data a Parquet de forma incremental
+
+    Cada tabla se escribe en data/<tabla>/ particionada por fecha y fuente, con
+    los JSON de data/metrics aplanados en columnas con tipo (data_<campo>,
+    metrics_<campo>). Cada lote genera un archivo por partición con el rango de
+    ids en el nombre, por lo que reexportar un lote sobrescribe sus archivos en
+    lugar de duplicarlos. El avance se guarda en etl_checkpoints.
+
+    Args:
+        tables (list, optional): 'processed' y/o 'final'. Por defecto, ambas.
+        batch_size (int): Número de registros por lote
+        data_dir (str, optional): Directorio base (por defecto DATA_DIR)
+
+    Returns:
+        int: Número de registros exportados
+    """
+    data_dir = data_dir or DATA_DIR
+    total = 0
+    start = time.perf_counter()
+    try:
+        tables = tables or list(EXPORTS)
+        with get_engine().begin() as conn:
+            with_chunks = chunks.has_chunk_table(conn)
+            for table in tables:
+                check_migrations(conn, EXPORTS[table]['stage'])
+        for table in tables:
+            spec = EXPORTS[table]
+            root = os.path.join(data_dir, table)
+            for conn, rows in iter_pending_batches(spec['stage'], export_query(table, with_chunks), batch_size):
+                frame = rows_to_frame(rows, spec)
+                record_progress(rows_in=len(rows))
+                _write_partitioned(frame, root, f"part-{rows[0][0]}-{rows[-1][0]}")
+                total += len(rows)
+    except Exception as e:
+        print(f"Error al exportar a Parquet: {e}")
+        record_error(e)
+        return total
+
+    elapsed = time.perf_counter() - start
+    print(f"{total} registros exportados a Parquet en {elapsed:.2f}s")
+    return total
+
+def rows_to_frame(rows, spec):
+    """Convierte filas de la consulta de exportación en un DataFrame con los JSON aplanados"""
+    import pandas as pd
+
+    frame = pd.DataFrame([row[:len(spec['columns'])] for row in rows], columns=spec['columns'])
+    frame['fecha'] = pd.to_datetime(frame[spec['date_column']]).dt.strftime('%Y-%m-%d')
+    frame['source'] = frame['source'].astype(str)
+    for offset, prefix in enumerate(spec['payloads'], start=len(spec['columns'])):
+        flat = flatten_payloads([row[offset] for row in rows], prefix)
+        frame = pd.concat([frame, flat], axis=1)
+    return frame
+
+def flatten_payloads(payloads, prefix):
+    """
+    Aplana una lista de JSON en columnas con tipo
+
+    Los objetos anidados se convierten en columnas <prefix>_<clave>_<subclave>.
+    Las columnas con valores de tipos mezclados o con listas se guardan como
+    texto (JSON) para que el archivo Parquet tenga un tipo por columna.
+
+    Args:
+        payloads (list): JSON como texto o como dict
+        prefix (str): Prefijo de las columnas
+
+    Returns:
+        pandas.DataFrame: Una fila por payload
+    """
+    import pandas as pd
+
+    frame = pd.json_normalize([json_utils.loads(payload) or {} for payload in payloads], sep='_')
+    frame.columns = [f"{prefix}_{column}" for column in frame.columns]
+    for column in frame.columns:
+        if frame[column].dtype == object:
+            frame[column] = _coerce_object_column(frame[column])
+    return frame
+
+def _coerce_object_column(series):
+    """
+    Da un tipo único a una columna object de pandas
+
+    Las claves que faltan en un JSON llegan como NaN y se guardan como nulos,
+    no como el texto "null".
+    """
+    import pandas as pd
+
+    types = set(map(type, series.dropna()))
+    if not types or types <= {str}:
+        return series
+    if types <= {bool}:
+        return series.astype('boolean')
+    if types <= {int, float}:
+        return pd.to_numeric(series)
+    return series.map(_json_text)
+
+def _json_text(value):
+    """Valor de una columna con tipos mezclados como texto JSON (None si falta)"""
+    import pandas as pd
+
+    if isinstance(value, str):
+        return value
+    if not isinstance(value, (list, dict)) and pd.isna(value):
+        return None
+    return json_utils.dumps(value)
+
+def _write_partitioned(frame, root, basename):
+    """Escribe un DataFrame en un dataset Parquet particionado por fecha y fuente"""
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+
+    table = pa.Table.from_pandas(frame, preserve_index=False)
+    ds.write_dataset(
+        table,
+        root,
+        format='parquet',
+        partitioning=_partitioning(),
+        basename_template=basename + '-{i}.parquet',
+        existing_data_behavior='overwrite_or_ignore',
+        file_options=ds.ParquetFileFormat().make_write_options(compression=PARQUET_COMPRESSION),
+    )
+
+def _partitioning():
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+
+    return ds.partitioning(pa.schema([(column, pa.string()) for column in PARTITION_COLUMNS]), flavor='hive')
+
+def read_parquet(table, columns=None, filters=None, since=None, until=None, sources=None, data_dir=None):
+    """
+    Lee los datos exportados a Parquet leyendo solo los archivos y columnas necesarios
+
+    Los filtros de fecha y fuente descartan particiones completas sin abrir sus
+    archivos; el resto de filtros se evalúan con las estadísticas de cada grupo
+    de filas, por lo que también evitan leer datos que no cumplen la condición.
+
+    Args:
+        table (str): 'processed' o 'final'
+        columns (list, optional): Columnas a leer (por defecto, todas)
+        filters (list, optional): Condiciones (columna, operador, valor) con los
+            operadores =, ==, !=, <, <=, >, >=, in, not in; o una expresión de pyarrow
+        since (str|date, optional): Primera fecha incluida
+        until (str|date, optional): Última fecha incluida
+        sources (list, optional): Fuentes a incluir
+        data_dir (str, optional): Directorio base (por defecto DATA_DIR)
+
+    Returns:
+        pandas.DataFrame: Datos leídos
+    """
+    import pandas as pd
+    import pyarrow.dataset as ds
+
+    root = os.path.join(data_dir or DATA_DIR, table)
+    if not os.path.isdir(root):
+        return pd.DataFrame(columns=columns)
+
+    partition_filter = None
+    if since is not None:
+        partition_filter = _and(partition_filter, ds.field('fecha') >= str(since))
+    if until is not None:
+        partition_filter = _and(partition_filter, ds.field('fecha') <= str(until))
+    if sources is not None:
+        partition_filter = _and(partition_filter, ds.field('source').isin(list(sources)))
+
+    dataset = ds.dataset(root, format='parquet', partitioning=_partitioning())
+    fragments = list(dataset.get_fragments(filter=partition_filter))
+    if not fragments:
+        return pd.DataFrame(columns=columns)
+
+    # Los lotes pueden tener columnas distintas (campos nuevos en el JSON):
+    # se unifican los esquemas de los archivos seleccionados
+    schema = _unify_schemas([fragment.physical_schema for fragment in fragments] + [_partitioning().schema])
+    dataset = ds.dataset(
+        [fragment.path for fragment in fragments],
+        schema=schema,
+        format='parquet',
+        partitioning=_partitioning(),
+        partition_base_dir=root,
+    )
+    row_filter = _and(partition_filter, _filters_to_expression(filters))
+    return dataset.to_table(columns=columns, filter=row_filter).to_pandas()
+
+def _and(left, right):
+    if left is None:
+        return right
+    if right is None:
+        return left
+    return left & right
+
+def _filters_to_expression(filters):
+    """Convierte una lista de condiciones (columna, operador, valor) en una expresión de pyarrow"""
+    import pyarrow.dataset as ds
+
+    if filters is None or isinstance(filters, ds.Expression):
+        return filters
+    expression = None
+    for column, op, value in filters:
+        field = ds.field(column)
+        if op in ('=', '=='):
+            condition = field == value
+        elif op == '!=':
+            condition = field != value
+        elif op == '<':
+            condition = field < value
+        elif op == '<=':
+            condition = field <= value
+        elif op == '>':
+            condition = field > value
+        elif op == '>=':
+            condition = field >= value
+        elif op == 'in':
+            condition = field.isin(list(value))
+        elif op == 'not in':
+            condition = ~field.isin(list(value))
+        else:
+            raise ValueError(f"Operador de filtro no soportado: {op}")
+        expression = _and(expression, condition)
+    return expression
+
+def _unify_schemas(schemas):
+    """
+    Une los esquemas de varios archivos en uno solo
+
+    Si una columna tiene tipos numéricos distintos en distintos archivos se lee
+    como float64; si tiene tipos incompatibles, como texto.
+    """
+    import pyarrow as pa
+
+    fields = {}
+    for schema in schemas:
+        for field in schema:
+            if field.name in ('__index_level_0__',):
+                continue
+            current = fields.get(field.name)
+            if current is None or current == field.type or pa.types.is_null(field.type):
+                fields.setdefault(field.name, field.type)
+            elif pa.types.is_null(current):
+                fields[field.name] = field.type
+            elif _is_numeric(current) and _is_numeric(field.type):
+                fields[field.name] = pa.float64()
+            else:
+                fields[field.name] = pa.string()
+    return pa.schema(list(fields.items()))
+
+def _is_numeric(arrow_type):
+    import pyarrow as pa
+
+    return pa.types.is_integer(arrow_type) or pa.types.is_floating(arrow_type)
+
+def main():
+    parser = argparse.ArgumentParser(description='Exporta processed_data y final_data a Parquet particionado')
+    parser.add_argument('--tabla', action='append', choices=list(EXPORTS), help='Tabla a exportar (se puede repetir)')
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, help='Registros por lote')
+    parser.add_argument('--data-dir', default=None, help='Directorio base de salida')
+    args = parser.parse_args()
+    export_to_parquet(args.tabla, args.batch_size, args.data_dir)
+
+if __name__ == '__main__':
+    main()
@@ -1,48 +1,310 @@
-import pandas as pd
-import json
+import glob
+import io
 import os
+import time
 from datetime import datetime
-from ..utils.database import engine
+from ..utils.database import get_engine
+from ..utils.query_cache import bump_table_versions
+from . import chunks, dtypes, json_utils
+from .checkpoint import lock_writes
+from .instrumentation import instrumented, record_error, record_progress, stage_peak_memory_mb
+from .manifest import (check_file, content_hash, ensure_ingestion_tables, file_fingerprint,
+                       load_manifest, record_file)
 
-def extract_from_csv(file_path, source_name):
+# Tamaño de bloque por defecto para la extracción en modo streaming
+DEFAULT_CHUNK_SIZE = 50000
+
+@instrumented('extract')
+def extract_from_csv(file_path, source_name, chunksize=None, force=False, storage=None):
     """
     Extrae datos desde un archivo CSV y los guarda en la tabla raw_data
     
+    La ingesta es idempotente: los archivos ya ingeridos para la fuente (mismo
+    contenido) se omiten sin leerlos (ver manifest.py), y cada fila lleva un hash
+    de su contenido con índice único, por lo que las filas ya presentes en
+    raw_data se descartan durante la carga. Todos los modos de carga (fila a
+    fila, por bloques, compacto y el pipeline) serializan las filas igual, de
+    modo que el hash de una fila no depende del modo con que se cargó. El
+    hash solo depende del contenido: las filas idénticas dentro de un mismo
+    archivo también se cargan una sola vez.
+    
+    Los tipos de las columnas se toman del plan de la fuente (ver dtypes.py):
+    enteros y decimales reducidos, texto con pocos valores como categórico y
+    fechas convertidas una sola vez, sin que cambie el JSON de cada fila.
+    
+    Con storage='chunks' (o ETL_RAW_STORAGE=chunks) cada bloque se guarda como
+    un único registro Parquet comprimido en raw_data_chunks en lugar de una
+    fila JSONB por registro (ver chunks.py); transform lee los dos formatos.
+    
     Args:
         file_path (str): Ruta al archivo CSV
         source_name (str): Nombre de la fuente de datos
+        chunksize (int, optional): Si se indica, lee el archivo por bloques de este
+            tamaño y los carga con COPY (ver extract_from_csv_streaming)
+        force (bool): Si es True, vuelve a leer el archivo aunque ya esté en el
+            manifiesto (las filas duplicadas se siguen descartando)
+        storage (str, optional): 'rows' o 'chunks'; por defecto ETL_RAW_STORAGE
     
     Returns:
-        int: Número de registros extraídos
+        int: Número de registros nuevos insertados
     """
-    print("Extracting data from CSV file... prueba de volumen")
     try:
-        # Leer el archivo CSV
-        df = pd.read_csv(file_path)
+        storage = chunks.storage_mode(storage)
+        with get_engine().begin() as conn:
+            ensure_ingestion_tables(conn)
+            ingested, fingerprint = check_file(conn, file_path, source_name)
+        if ingested and not force:
+            print(f"{file_path} ya se ingirió para la fuente {source_name}; se omite")
+            return 0
+        plan = _dtype_plan(file_path, source_name)
         
-        # Preparar los datos para inserción
-        records = []
-        for _, row in df.iterrows():
-            record = {
-                'timestamp': datetime.now().isoformat(),
-                'source': source_name,
-                'data': json.dumps(row.to_dict())
-            }
-            records.append(record)
+        if storage == 'chunks':
+            with get_engine().begin() as conn:
+                chunks.ensure_chunk_table(conn)
+            total = _copy_csv_chunks(file_path, source_name, chunksize or DEFAULT_CHUNK_SIZE, plan, storage)
+        elif chunksize:
+            total = _copy_csv_chunks(file_path, source_name, chunksize, plan)
+        else:
+            total = _insert_csv(file_path, source_name, plan)
         
-        # Insertar en la base de datos
-        with engine.connect() as conn:
-            result = conn.execute(
-                "INSERT INTO raw_data (timestamp, source, data) VALUES (%(timestamp)s, %(source)s, %(data)s)",
-                records
+        # El manifiesto se escribe tras confirmar los datos: si falla, la siguiente
+        # ejecución vuelve a leer el archivo y el hash por fila descarta lo ya cargado
+        if fingerprint['content_hash'] is None:
+            fingerprint['content_hash'] = content_hash(fingerprint['path'])
+        with get_engine().begin() as conn:
+            record_file(conn, fingerprint, total)
+        return total
+    
+    except Exception as e:
+        print(f"Error al extraer datos: {e}")
+        record_error(e)
+        return 0
+
+def extract_from_directory(directory, source_name, pattern='*.csv', chunksize=DEFAULT_CHUNK_SIZE, storage=None):
+    """
+    Extrae todos los archivos CSV de un directorio omitiendo los ya ingeridos
+    
+    El manifiesto de la fuente se consulta una sola vez, de modo que volver a
+    procesar un directorio sin cambios solo cuesta un stat por archivo.
+    
+    Args:
+        directory (str): Directorio con los archivos
+        source_name (str): Nombre de la fuente de datos
+        pattern (str): Patrón de los archivos a extraer
+        chunksize (int): Número de filas por bloque
+        storage (str, optional): 'rows' o 'chunks' (ver extract_from_csv)
+    
+    Returns:
+        int: Número de registros nuevos insertados
+    """
+    with get_engine().begin() as conn:
+        ensure_ingestion_tables(conn)
+        manifest = load_manifest(conn, source_name)
+    
+    total = 0
+    skipped = 0
+    for file_path in sorted(glob.glob(os.path.join(directory, pattern))):
+        path = os.path.abspath(file_path)
+        if (path, *file_fingerprint(path)) in manifest:
+            skipped += 1
+            continue
+        total += extract_from_csv(path, source_name, chunksize=chunksize, storage=storage)
+    print(f"{total} registros nuevos; {skipped} archivos sin cambios omitidos")
+    return total
+
+def _dtype_plan(file_path, source_name):
+    """Plan de tipos de la fuente para leer el archivo (None si el planificador está desactivado)"""
+    if not dtypes.DTYPE_PLANNER_ENABLED:
+        return None
+    with get_engine().begin() as conn:
+        return dtypes.get_plan(conn, file_path, source_name)
+
+def _insert_csv(file_path, source_name, plan=None):
+    """Carga un CSV completo en raw_data fila a fila, descartando las filas ya presentes"""
+    print("Extracting data from CSV file... prueba de volumen")
+    # Leer el archivo CSV
+    df = dtypes.read_csv(file_path, plan)
+    record_progress(rows_in=len(df), bytes=os.path.getsize(file_path))
+    if plan is not None:
+        dtypes.report_memory(file_path, dtypes.memory_usage(df), dtypes.default_memory_usage(df, plan),
+                             stage_peak_memory_mb())
+    
+    # Preparar los datos para inserción, con el mismo JSON que los demás modos de
+    # carga (iterrows() convertiría los enteros en float en los bloques numéricos)
+    timestamp = datetime.now().isoformat()
+    records = [
+        {'timestamp': timestamp, 'source': source_name, 'data': data}
+        for data in _chunk_payloads(df)
+    ]
+    
+    # Insertar en la base de datos
+    with get_engine().begin() as conn:
+        lock_writes(conn, ['raw_data'])
+        result = conn.execute(
+            """
+            WITH new_hash AS (
+                INSERT INTO raw_data_row_hashes (source, row_hash)
+                VALUES (%(source)s, md5(%(data)s::jsonb::text))
+                ON CONFLICT DO NOTHING
+                RETURNING row_hash
             )
-        
-        return len(records)
+            INSERT INTO raw_data (timestamp, source, data, row_hash)
+            SELECT %(timestamp)s::timestamp, %(source)s, %(data)s::jsonb, row_hash FROM new_hash
+            """,
+            records
+        )
+        if result.rowcount:
+            bump_table_versions(conn, ['raw_data'])
     
+    return result.rowcount
+
+@instrumented('extract')
+def extract_from_csv_streaming(file_path, source_name, chunksize=DEFAULT_CHUNK_SIZE):
+    """
+    Extrae un archivo CSV por bloques y lo carga en raw_data con COPY FROM STDIN
+    
+    Cada bloque se serializa a JSON en una sola pasada vectorizada, por lo que la
+    memoria queda acotada por el tamaño del bloque y no por el del archivo. Las
+    filas ya presentes en raw_data se descartan durante la carga; el manifiesto
+    de archivos solo se consulta desde extract_from_csv.
+    
+    Args:
+        file_path (str): Ruta al archivo CSV
+        source_name (str): Nombre de la fuente de datos
+        chunksize (int): Número de filas por bloque
+    
+    Returns:
+        int: Número de registros nuevos insertados
+    """
+    try:
+        with get_engine().begin() as conn:
+            ensure_ingestion_tables(conn)
+        return _copy_csv_chunks(file_path, source_name, chunksize, _dtype_plan(file_path, source_name))
     except Exception as e:
         print(f"Error al extraer datos: {e}")
+        record_error(e)
         return 0
 
+def _copy_csv_chunks(file_path, source_name, chunksize, plan=None, storage='rows'):
+    """
+    Carga un CSV por bloques con deduplicación por hash de fila; confirma al final
+
+    Con storage='rows' cada bloque se carga en raw_data con COPY; con
+    storage='chunks' se guarda como un registro de raw_data_chunks.
+    """
+    print(f"Extrayendo {file_path} por bloques de {chunksize} filas...")
+    start = time.perf_counter()
+    total = 0
+    inserted = 0
+    planned_bytes = 0
+    default_bytes = 0
+    stored_bytes = 0
+    json_bytes = 0
+    raw_conn = get_engine().raw_connection()
+    try:
+        cursor = raw_conn.cursor()
+        lock_writes(cursor, ['raw_data_chunks' if storage == 'chunks' else 'raw_data'])
+        for chunk in dtypes.read_csv(file_path, plan, chunksize=chunksize):
+            time_bounds = chunks.time_range(chunk, plan) if storage == 'chunks' else None
+            if plan is not None:
+                planned_bytes += dtypes.memory_usage(chunk)
+                default_bytes += dtypes.default_memory_usage(chunk, plan)
+            if storage == 'chunks':
+                payloads = _chunk_payloads(chunk)
+                record_progress(rows_in=len(chunk), bytes=sum(map(len, payloads)))
+                rows, chunk_bytes, chunk_json_bytes = chunks.write_chunk(cursor, chunk, payloads, source_name, time_bounds)
+                inserted += rows
+                stored_bytes += chunk_bytes
+                json_bytes += chunk_json_bytes
+            else:
+                buffer = _chunk_to_copy_buffer(chunk, source_name)
+                record_progress(rows_in=len(chunk), bytes=len(buffer.getvalue()))
+                inserted += _copy_raw_data_dedup(cursor, buffer)
+            total += len(chunk)
+        if inserted:
+            bump_table_versions(cursor, ['raw_data_chunks' if storage == 'chunks' else 'raw_data'])
+        raw_conn.commit()
+    except Exception:
+        raw_conn.rollback()
+        raise
+    finally:
+        raw_conn.close()
+
+    elapsed = time.perf_counter() - start
+    rate = total / elapsed if elapsed > 0 else 0
+    print(
+        f"{total} registros leídos en {elapsed:.2f}s ({rate:,.0f} filas/s); "
+        f"{inserted} nuevos, {total - inserted} duplicados descartados"
+    )
+    if plan is not None:
+        dtypes.report_memory(file_path, planned_bytes, default_bytes, stage_peak_memory_mb())
+    if storage == 'chunks':
+        chunks.print_storage_summary(inserted, stored_bytes, json_bytes)
+    return inserted
+
+def _chunk_to_copy_buffer(chunk, source_name, timestamp=None):
+    """Convierte un bloque del CSV en un buffer CSV (timestamp, source, data) para COPY"""
+    import pandas as pd
+
+    timestamp = timestamp or datetime.now().isoformat()
+    rows = pd.DataFrame({'timestamp': timestamp, 'source': source_name, 'data': _chunk_payloads(chunk)})
+    buffer = io.StringIO()
+    rows.to_csv(buffer, header=False, index=False)
+    buffer.seek(0)
+    return buffer
+
+def _chunk_payloads(chunk):
+    """JSON de cada fila de un bloque (ver json_utils.dumps_rows)"""
+    return json_utils.dumps_rows(chunk)
+
+def _copy_raw_data(cursor, buffer):
+    """Carga un buffer CSV en raw_data usando COPY FROM STDIN"""
+    cursor.copy_expert(
+        "COPY raw_data (timestamp, source, data) FROM STDIN WITH (FORMAT csv)",
+        buffer
+    )
+
+def _copy_raw_data_dedup(cursor, buffer):
+    """
+    Carga un buffer CSV en raw_data con COPY descartando las filas duplicadas
+    
+    COPY no admite ON CONFLICT: el bloque se copia a una tabla temporal y se
+    inserta desde ella calculando el hash de cada fila en PostgreSQL (sobre la
+    forma canónica del JSONB, independiente del orden de las claves). Solo se
+    insertan las filas cuyo hash entra nuevo en raw_data_row_hashes.
+    
+    Returns:
+        int: Número de filas insertadas
+    """
+    cursor.execute("""
+        CREATE TEMP TABLE IF NOT EXISTS tmp_raw_data_copy (
+            timestamp TIMESTAMP, source VARCHAR(100), data TEXT
+        ) ON COMMIT DELETE ROWS
+    """)
+    cursor.copy_expert(
+        "COPY tmp_raw_data_copy (timestamp, source, data) FROM STDIN WITH (FORMAT csv)",
+        buffer
+    )
+    cursor.execute("""
+        WITH batch AS (
+            SELECT DISTINCT ON (source, row_hash) timestamp, source, data, row_hash
+            FROM (SELECT timestamp, source, data::jsonb AS data, md5(data::jsonb::text) AS row_hash
+                  FROM tmp_raw_data_copy) t
+        ), new_hash AS (
+            INSERT INTO raw_data_row_hashes (source, row_hash)
+            SELECT source, row_hash FROM batch
+            ON CONFLICT DO NOTHING
+            RETURNING source, row_hash
+        )
+        INSERT INTO raw_data (timestamp, source, data, row_hash)
+        SELECT b.timestamp, b.source, b.data, b.row_hash FROM batch b
+        JOIN new_hash n ON n.source = b.source AND n.row_hash = b.row_hash
+    """)
+    inserted = cursor.rowcount
+    cursor.execute("TRUNCATE tmp_raw_data_copy")
+    return inserted
+
+@instrumented('extract')
 def extract_from_api(api_url, params=None, source_name="api"):
     """
     Extrae datos desde una API y los guarda en la tabla raw_data
@@ -66,21 +328,25 @@ def extract_from_api(api_url, params=None, source_name="api"):
         data = response.json()
         
         # Preparar registro para la base de datos
+        record_progress(rows_in=1, bytes=len(response.content))
         record = {
             'timestamp': datetime.now().isoformat(),
             'source': source_name,
-            'data': json.dumps(data)
+            'data': json_utils.dumps(data)
         }
         
         # Insertar en la base de datos
-        with engine.connect() as conn:
+        with get_engine().begin() as conn:
+            lock_writes(conn, ['raw_data'])
             conn.execute(
                 "INSERT INTO raw_data (timestamp, source, data) VALUES (%(timestamp)s, %(source)s, %(data)s)",
                 record
             )
+            bump_table_versions(conn, ['raw_data'])
         
         return 1
     
     except Exception as e:
         print(f"Error al extraer datos de la API: {e}")
+        record_error(e)
         return 0
@@ -0,0 +1,114 @@
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+# Módulos que importa una ejecución incremental del ETL
+DEFAULT_MODULES = ['src.etl.extract', 'src.etl.transform', 'src.etl.load']
+
+# Paquetes pesados que no deberían cargarse solo por importar el ETL
+HEAVY_PACKAGES = ['pandas', 'numpy', 'pyarrow', 'sqlalchemy.orm', 'psycopg2', 'dotenv']
+
+# Raíz del proyecto, desde donde se importa el paquete src
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+
+def measure_imports(modules=None, code=None):
+    """
+    Mide el tiempo de importación de cada módulo en un intérprete nuevo
+
+    Se ejecuta python -X importtime en un subproceso para que los módulos ya
+    cargados en el proceso actual no falseen la medición.
+
+    Args:
+        modules (list, optional): Módulos a importar (por defecto DEFAULT_MODULES)
+        code (str, optional): Código a ejecutar en lugar de importar los módulos
+
+    Returns:
+        tuple: (entradas, segundos) donde cada entrada es un dict con module,
+        self_ms, cumulative_ms y depth, en el orden en que terminó su importación
+    """
+    code = code or f"import {', '.join(modules or DEFAULT_MODULES)}"
+    start = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', code],
+        cwd=PROJECT_ROOT, capture_output=True, text=True
+    )
+    elapsed = time.perf_counter() - start
+    if result.returncode != 0:
+        raise RuntimeError(f"Error al ejecutar {code!r}:\n{result.stderr[-2000:]}")
+
+    entries = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        if not self_us.strip().isdigit():
+            continue  # Cabecera
+        entries.append({
+            'module': name.strip(),
+            'self_ms': int(self_us) / 1000,
+            'cumulative_ms': int(cumulative_us) / 1000,
+            'depth': (len(name) - len(name.lstrip())) // 2,
+        })
+    return entries, elapsed
+
+def summarize_by_package(entries):
+    """
+    Agrupa el tiempo propio de importación por paquete de primer nivel
+
+    Returns:
+        list: Tuplas (paquete, ms, módulos) ordenadas de mayor a menor tiempo
+    """
+    packages = {}
+    for entry in entries:
+        package = entry['module'].split('.')[0]
+        total, count = packages.get(package, (0.0, 0))
+        packages[package] = (total + entry['self_ms'], count + 1)
+    return sorted(((package, total, count) for package, (total, count) in packages.items()),
+                  key=lambda item: item[1], reverse=True)
+
+def heavy_imports(entries):
+    """Paquetes de HEAVY_PACKAGES cargados durante la importación, con su tiempo acumulado"""
+    loaded = {entry['module']: entry['cumulative_ms'] for entry in entries}
+    return {package: loaded[package] for package in HEAVY_PACKAGES if package in loaded}
+
+def print_report(entries, elapsed, top=15):
+    """Imprime el desglose de tiempos de importación"""
+    total_ms = sum(entry['self_ms'] for entry in entries)
+    print(f"Arranque del intérprete y ejecución: {elapsed * 1000:.0f} ms")
+    print(f"Importaciones: {total_ms:.0f} ms en {len(entries)} módulos")
+
+    print("\nPaquetes con mayor tiempo de importación:")
+    for package, package_ms, count in summarize_by_package(entries)[:top]:
+        print(f"  {package:<30} {package_ms:8.1f} ms  ({count} módulos)")
+
+    print("\nMódulos con mayor tiempo acumulado:")
+    for entry in sorted(entries, key=lambda entry: entry['cumulative_ms'], reverse=True)[:top]:
+        print(f"  {entry['module']:<50} {entry['cumulative_ms']:8.1f} ms  (propio {entry['self_ms']:.1f} ms)")
+
+    heavy = heavy_imports(entries)
+    if heavy:
+        print("\nPaquetes pesados importados al arrancar:")
+        for package, package_ms in heavy.items():
+            print(f"  {package:<30} {package_ms:8.1f} ms")
+    else:
+        print(f"\nNo se importa ninguno de: {', '.join(HEAVY_PACKAGES)}")
+
+def main():
+    parser = argparse.ArgumentParser(description='Desglose del tiempo de importación del paquete ETL')
+    parser.add_argument('--modulo', action='append', help='Módulo a importar (se puede repetir)')
+    parser.add_argument('--codigo', default=None, help='Código a medir en lugar de importar módulos')
+    parser.add_argument('--top', type=int, default=15, help='Número de paquetes y módulos a mostrar')
+    parser.add_argument('--max-ms', type=float, default=None,
+                        help='Tiempo máximo de arranque; termina con error si se supera')
+    args = parser.parse_args()
+
+    entries, elapsed = measure_imports(args.modulo, args.codigo)
+    print_report(entries, elapsed, args.top)
+    if args.max_ms is not None and elapsed * 1000 > args.max_ms:
+        print(f"\nEl arranque ({elapsed * 1000:.0f} ms) supera el máximo de {args.max_ms:.0f} ms")
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
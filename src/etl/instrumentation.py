@@ -0,0 +1,313 @@
+import atexit
+import functools
+import os
+import queue
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from sqlalchemy import text
+from ..utils.database import get_engine
+from ..utils.query_cache import bump_table_versions
+from .checkpoint import lock_writes
+from .streaming import current_rss_mb
+
+# Columnas de etl_metrics; las de rendimiento se añaden a instalaciones existentes
+ETL_METRICS_DDL = [
+    """
+    CREATE TABLE IF NOT EXISTS etl_metrics (
+        id SERIAL PRIMARY KEY,
+        process_name VARCHAR(50) NOT NULL,
+        start_time TIMESTAMP NOT NULL,
+        end_time TIMESTAMP NOT NULL,
+        records_processed INTEGER NOT NULL,
+        success BOOLEAN NOT NULL,
+        error_message TEXT,
+        execution_date DATE NOT NULL
+    )
+    """,
+    "ALTER TABLE etl_metrics ADD COLUMN IF NOT EXISTS rows_in BIGINT",
+    "ALTER TABLE etl_metrics ADD COLUMN IF NOT EXISTS rows_out BIGINT",
+    "ALTER TABLE etl_metrics ADD COLUMN IF NOT EXISTS bytes BIGINT",
+    "ALTER TABLE etl_metrics ADD COLUMN IF NOT EXISTS rows_per_second DOUBLE PRECISION",
+    "ALTER TABLE etl_metrics ADD COLUMN IF NOT EXISTS peak_memory_mb DOUBLE PRECISION",
+]
+
+INSERT_METRIC = text("""
+    INSERT INTO etl_metrics (process_name, start_time, end_time, records_processed, success,
+                             error_message, execution_date, rows_in, rows_out, bytes,
+                             rows_per_second, peak_memory_mb)
+    VALUES (:process_name, :start_time, :end_time, :records_processed, :success,
+            :error_message, :execution_date, :rows_in, :rows_out, :bytes,
+            :rows_per_second, :peak_memory_mb)
+""")
+
+# Se puede desactivar con ETL_METRICS_ENABLED=false (p. ej. en benchmarks)
+METRICS_ENABLED = os.getenv("ETL_METRICS_ENABLED", "true").lower() in ("1", "true", "yes")
+
+# Intervalo en segundos con el que se muestrea la memoria residente mientras
+# hay etapas en curso (peak_memory_mb es el máximo de las muestras de la etapa)
+MEMORY_SAMPLE_SECONDS = float(os.getenv("ETL_MEMORY_SAMPLE_SECONDS", "0.05"))
+
+class StageRun:
+    """
+    Contadores de una ejecución de una etapa del ETL
+
+    peak_memory_mb es el pico de memoria residente del proceso durante la
+    ejecución (muestreado cada MEMORY_SAMPLE_SECONDS, más una muestra al
+    empezar y otra al terminar), no el pico de toda la vida del proceso. No
+    incluye la memoria de los procesos hijos (workers de transform).
+    """
+
+    def __init__(self, process_name):
+        self.process_name = process_name
+        self.start_time = datetime.now()
+        self.end_time = None
+        self.rows_in = 0
+        self.rows_out = 0
+        self.bytes = 0
+        self.error = None
+        self.peak_memory_mb = current_rss_mb()
+        self._started = time.perf_counter()
+        self._elapsed = None
+        self._lock = threading.Lock()
+
+    def add(self, rows_in=0, rows_out=0, bytes=0):
+        """Suma progreso a la ejecución (seguro entre hilos)"""
+        with self._lock:
+            self.rows_in += rows_in
+            self.rows_out += rows_out
+            self.bytes += bytes
+
+    def sample_memory(self, rss_mb):
+        """Actualiza el pico de memoria con una muestra de la memoria residente"""
+        with self._lock:
+            self.peak_memory_mb = max(self.peak_memory_mb, rss_mb)
+
+    def finish(self):
+        self.sample_memory(current_rss_mb())
+        self.end_time = datetime.now()
+        self._elapsed = time.perf_counter() - self._started
+
+    @property
+    def elapsed(self):
+        """Segundos transcurridos (hasta finish, o hasta ahora si sigue en curso)"""
+        return self._elapsed if self._elapsed is not None else time.perf_counter() - self._started
+
+    def as_record(self):
+        return {
+            'process_name': self.process_name,
+            'start_time': self.start_time,
+            'end_time': self.end_time,
+            'records_processed': self.rows_out,
+            'success': self.error is None,
+            'error_message': self.error,
+            'execution_date': self.start_time.date(),
+            'rows_in': self.rows_in,
+            'rows_out': self.rows_out,
+            'bytes': self.bytes,
+            'rows_per_second': self.rows_out / self._elapsed if self._elapsed else None,
+            'peak_memory_mb': self.peak_memory_mb,
+        }
+
+_active_runs = []
+_active_lock = threading.Lock()
+
+@contextmanager
+def track_stage(process_name):
+    """
+    Mide una ejecución de una etapa y la registra en etl_metrics
+
+    Las funciones de cada etapa capturan sus propios errores, por lo que deben
+    llamar a record_error antes de devolver; las excepciones que atraviesan el
+    bloque también se registran. La escritura en etl_metrics se hace en un hilo
+    aparte para no frenar el ETL.
+
+    Args:
+        process_name (str): Nombre del proceso ('extract', 'transform', 'load', 'full_etl')
+
+    Yields:
+        StageRun: Contadores de la ejecución
+    """
+    run = StageRun(process_name)
+    with _active_lock:
+        _active_runs.append(run)
+    _memory_sampler().wake()
+    try:
+        yield run
+    except Exception as e:
+        run.error = str(e)
+        raise
+    finally:
+        with _active_lock:
+            _active_runs.remove(run)
+        run.finish()
+        if METRICS_ENABLED:
+            _writer().put(run.as_record())
+
+@contextmanager
+def collect_progress():
+    """
+    Recoge el progreso registrado con record_progress en el bloque, sin registrarlo en etl_metrics
+
+    Lo usan los procesos hijos (workers de transform): sus etapas activas no
+    son las del padre (ver _reset_after_fork), así que el hijo devuelve los
+    contadores y el padre los suma a su etapa con record_progress.
+
+    Yields:
+        StageRun: Contadores del bloque
+    """
+    run = StageRun('progress')
+    with _active_lock:
+        _active_runs.append(run)
+    try:
+        yield run
+    finally:
+        with _active_lock:
+            _active_runs.remove(run)
+
+def instrumented(process_name):
+    """
+    Decorador que registra cada llamada a una función de etapa en etl_metrics
+
+    El valor devuelto por la función (número de registros) se toma como rows_out.
+    Si ya hay una ejecución activa del mismo proceso (p. ej. extract_from_csv
+    delegando en extract_from_csv_streaming), la llamada se suma a esa ejecución.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with _active_lock:
+                nested = any(run.process_name == process_name for run in _active_runs)
+            if nested:
+                return func(*args, **kwargs)
+            with track_stage(process_name) as run:
+                result = func(*args, **kwargs)
+                if isinstance(result, int):
+                    run.rows_out = result
+                return result
+        return wrapper
+    return decorator
+
+def record_progress(rows_in=0, rows_out=0, bytes=0):
+    """Suma progreso a la etapa activa más reciente del proceso, si la hay"""
+    run = _current_run()
+    if run is not None:
+        run.add(rows_in, rows_out, bytes)
+
+def record_error(error):
+    """Marca como fallida la etapa activa más reciente del proceso, si la hay"""
+    run = _current_run()
+    if run is not None:
+        run.error = str(error)
+
+def stage_peak_memory_mb():
+    """Pico de memoria residente en MB de la etapa activa más reciente del proceso, hasta ahora (None si no hay)"""
+    run = _current_run()
+    if run is None:
+        return None
+    run.sample_memory(current_rss_mb())
+    return run.peak_memory_mb
+
+def _current_run():
+    with _active_lock:
+        return _active_runs[-1] if _active_runs else None
+
+def _reset_after_fork():
+    """En un proceso hijo, las etapas activas (y su cerrojo) son copias de las del padre: se descartan"""
+    global _active_lock
+    _active_lock = threading.Lock()
+    _active_runs.clear()
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+def flush_metrics(timeout=10):
+    """Espera a que se escriban las métricas pendientes"""
+    writer = _writer_state.get('writer')
+    if writer is not None and writer.pid == os.getpid():
+        writer.flush(timeout)
+
+class _MetricsWriter:
+    """Hilo que inserta en etl_metrics los registros encolados"""
+
+    def __init__(self):
+        self.pid = os.getpid()
+        self.queue = queue.Queue()
+        self.table_ready = False
+        self.thread = threading.Thread(target=self._run, name='etl-metrics-writer', daemon=True)
+        self.thread.start()
+
+    def put(self, record):
+        self.queue.put(record)
+
+    def flush(self, timeout):
+        done = threading.Event()
+        self.queue.put(done)
+        done.wait(timeout)
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if isinstance(item, threading.Event):
+                item.set()
+                continue
+            try:
+                with get_engine().begin() as conn:
+                    if not self.table_ready:
+                        for statement in ETL_METRICS_DDL:
+                            conn.execute(text(statement))
+                        self.table_ready = True
+                    lock_writes(conn, ['etl_metrics'])
+                    conn.execute(INSERT_METRIC, item)
+                    bump_table_versions(conn, ['etl_metrics'])
+            except Exception as e:
+                # La instrumentación nunca debe interrumpir el ETL
+                print(f"Error al registrar métricas de ETL: {e}")
+
+_writer_state = {}
+_writer_lock = threading.Lock()
+
+class _MemorySampler:
+    """Hilo que muestrea la memoria residente mientras hay etapas en curso"""
+
+    def __init__(self):
+        self.pid = os.getpid()
+        self.wakeup = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def wake(self):
+        self.wakeup.set()
+
+    def _run(self):
+        while True:
+            with _active_lock:
+                runs = list(_active_runs)
+                if not runs:
+                    self.wakeup.clear()
+            if not runs:
+                # Sin etapas en curso el hilo espera sin consumir CPU
+                self.wakeup.wait()
+                continue
+            rss_mb = current_rss_mb()
+            for run in runs:
+                run.sample_memory(rss_mb)
+            time.sleep(MEMORY_SAMPLE_SECONDS)
+
+def _memory_sampler():
+    """Devuelve el muestreador de memoria del proceso actual, creándolo tras un fork si es necesario"""
+    with _writer_lock:
+        sampler = _writer_state.get('sampler')
+        if sampler is None or sampler.pid != os.getpid():
+            sampler = _writer_state['sampler'] = _MemorySampler()
+        return sampler
+
+def _writer():
+    """Devuelve el escritor del proceso actual, creándolo tras un fork si es necesario"""
+    with _writer_lock:
+        writer = _writer_state.get('writer')
+        if writer is None or writer.pid != os.getpid():
+            writer = _writer_state['writer'] = _MetricsWriter()
+        return writer
+
+atexit.register(flush_metrics)
@@ -1,15 +1,141 @@
-import numpy as np
-import pandas as pd
+import json
+import math
+import os
+import sys
 
 def numpy_to_python(obj):
-    """Convierte tipos de NumPy a tipos nativos de Python para serialización JSON"""
+    """
+    Convierte tipos de NumPy a tipos nativos de Python para serialización JSON
+
+    NumPy y pandas no se importan aquí: si no están cargados en el proceso,
+    el objeto no puede ser de uno de sus tipos y se devuelve tal cual.
+    """
+    np = sys.modules.get('numpy')
+    if np is None:
+        return obj
+    pd = sys.modules.get('pandas')
     if isinstance(obj, (np.integer)):
         return int(obj)
     elif isinstance(obj, (np.floating)):
-        return float(obj)
+        return None if np.isnan(obj) else float(obj)
+    elif isinstance(obj, np.bool_):
+        return bool(obj)
     elif isinstance(obj, np.ndarray):
         return obj.tolist()
+    elif isinstance(obj, np.datetime64):
+        import pandas as pd
+        return pd.Timestamp(obj).isoformat()
+    elif pd is None:
+        return obj
     elif isinstance(obj, pd.Series):
         return obj.to_dict()
+    elif obj is pd.NaT or obj is pd.NA:
+        return None
+    elif isinstance(obj, pd.Timestamp):
+        return pd.Timestamp(obj).isoformat()
     else:
         return obj
+
+# Backends de serialización disponibles; orjson es opcional
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+def _orjson_dumps(obj):
+    return orjson.dumps(
+        obj,
+        default=numpy_to_python,
+        option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+    ).decode()
+
+def _stdlib_dumps(obj):
+    try:
+        return json.dumps(obj, default=numpy_to_python, allow_nan=False)
+    except ValueError:
+        # NaN/Infinity no son JSON válido (PostgreSQL los rechaza en JSONB): se escriben como null
+        return json.dumps(_replace_non_finite(obj), default=numpy_to_python, allow_nan=False)
+
+def _replace_non_finite(obj):
+    """Sustituye los floats no finitos por None en estructuras anidadas"""
+    if isinstance(obj, float):
+        return obj if math.isfinite(obj) else None
+    np = sys.modules.get('numpy')
+    if np is not None and isinstance(obj, np.ndarray):
+        return _replace_non_finite(obj.tolist())
+    if isinstance(obj, dict):
+        return {key: _replace_non_finite(value) for key, value in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [_replace_non_finite(value) for value in obj]
+    return obj
+
+BACKENDS = {
+    'stdlib': (_stdlib_dumps, json.loads),
+}
+if orjson is not None:
+    BACKENDS['orjson'] = (_orjson_dumps, orjson.loads)
+
+_backend = {}
+
+def set_backend(name=None):
+    """
+    Selecciona el backend de serialización JSON
+
+    Args:
+        name (str, optional): 'orjson' o 'stdlib'. Si es None, se usa ETL_JSON_BACKEND
+            o, en su defecto, el más rápido disponible.
+
+    Returns:
+        str: Nombre del backend seleccionado
+    """
+    name = name or os.getenv("ETL_JSON_BACKEND") or ('orjson' if 'orjson' in BACKENDS else 'stdlib')
+    if name not in BACKENDS:
+        raise ValueError(f"Backend JSON no disponible: {name} (disponibles: {', '.join(BACKENDS)})")
+    _backend['name'] = name
+    _backend['dumps'], _backend['loads'] = BACKENDS[name]
+    return name
+
+def get_backend():
+    """Devuelve el nombre del backend de serialización JSON activo"""
+    return _backend['name']
+
+def dumps(obj):
+    """
+    Serializa un objeto a texto JSON con el backend activo
+
+    Los escalares y arrays de NumPy, los Timestamp de pandas y los NaN se
+    serializan directamente (NaN como null), sin necesidad de default=.
+    """
+    return _backend['dumps'](obj)
+
+def dumps_rows(frame):
+    """
+    Serializa cada fila de un DataFrame a texto JSON con el backend activo
+
+    Es la serialización de las filas de los CSV en todos los caminos de carga
+    (fila a fila, COPY, bloques y pipeline), de modo que una misma fila
+    produce siempre el mismo JSON y el mismo hash. Los valores se toman por
+    columna con to_dict('records'), como escalares nativos de Python: los
+    enteros no pasan a float (como con iterrows()) y los decimales conservan
+    todos sus dígitos (DataFrame.to_json los redondea a double_precision).
+
+    Args:
+        frame (pandas.DataFrame): Filas a serializar
+
+    Returns:
+        list: JSON de cada fila
+    """
+    return [dumps(record) for record in frame.to_dict('records')]
+
+def loads(value):
+    """
+    Deserializa texto JSON con el backend activo
+
+    psycopg2 ya devuelve las columnas JSONB como objetos de Python; en ese caso
+    el valor se devuelve tal cual.
+    """
+    if isinstance(value, (str, bytes, bytearray)):
+        return _backend['loads'](value)
+    return value
+
+set_backend()
@@ -1,69 +1,117 @@
-import json
+from operator import itemgetter
 from sqlalchemy import text
-from ..utils.database import engine
+from ..utils.database import get_engine
+from ..utils.query_cache import bump_table_versions
+from . import json_utils
+from .instrumentation import instrumented, record_error, record_progress
+from .checkpoint import DEFAULT_BATCH_SIZE, lock_writes, process_pending_batches, record_payload, release_dead_letters
+from .streaming import stream_pending_batches
+from .rollups import refresh_rollups_after_write
 
-def load_to_final_table(processed_data_id=None):
+# Registros pendientes por encima de la marca de agua (paginación por clave).
+# El NOT EXISTS se resuelve con idx_final_data_processed_data_id. Con
+# processed_data particionada, :since descarta las particiones sin registros pendientes.
+PENDING_QUERY = text("""
+    SELECT p.id, p.data FROM processed_data p
+    WHERE p.id > :last_id
+      AND (:since IS NULL OR p.processed_at >= :since)
+      AND NOT EXISTS (SELECT 1 FROM final_data f WHERE f.processed_data_id = p.id)
+    ORDER BY p.id
+    LIMIT :limit
+""")
+
+# Variante sin LIMIT para el modo streaming (cursor del lado del servidor)
+STREAM_QUERY = text("""
+    SELECT p.id, p.data FROM processed_data p
+    WHERE p.id > :last_id
+      AND (:since IS NULL OR p.processed_at >= :since)
+      AND NOT EXISTS (SELECT 1 FROM final_data f WHERE f.processed_data_id = p.id)
+    ORDER BY p.id
+""")
+
+PENDING_BY_ID_QUERY = text("""
+    SELECT p.id, p.data FROM processed_data p
+    WHERE p.id = :processed_data_id
+      AND NOT EXISTS (SELECT 1 FROM final_data f WHERE f.processed_data_id = p.id)
+""")
+
+@instrumented('load')
+def load_to_final_table(processed_data_id=None, batch_size=DEFAULT_BATCH_SIZE, streaming=False, memory_limit_mb=None):
     """
     Carga los datos procesados en la tabla final_data
     
+    Sin processed_data_id, los registros pendientes se seleccionan de forma
+    incremental a partir de la marca de agua de la etapa 'load' (ver checkpoint.py),
+    confirmando cada lote por separado con reintentos y cuarentena de los
+    registros que fallan en etl_dead_letters.
+    Si se cargan registros, se actualizan los días afectados de los agregados
+    diarios de final_data (ver rollups.py).
+    
     Args:
         processed_data_id (int, optional): ID del registro procesado a cargar. Si es None, carga todos los registros no cargados.
+        batch_size (int): Número de registros por lote en el modo incremental
+        streaming (bool): Si es True, lee con un cursor del lado del servidor y escribe
+            cada lote mientras se lee el siguiente (ver streaming.py)
+        memory_limit_mb (float, optional): Techo de memoria residente en MB para el modo streaming
     
     Returns:
-        int: Nu00famero de registros cargados
+        int: Nu00famero de registros cargados (en caso de error, los de los lotes ya confirmados)
     """
+    total = 0
     try:
-        # Construir la consulta SQL
         if processed_data_id:
-            query = text("""
-                SELECT id, data FROM processed_data 
-                WHERE id = :processed_data_id AND id NOT IN (SELECT processed_data_id FROM final_data WHERE processed_data_id IS NOT NULL)
-            """)
-            params = {"processed_data_id": processed_data_id}
+            with get_engine().begin() as conn:
+                results = conn.execute(PENDING_BY_ID_QUERY, {"processed_data_id": processed_data_id}).fetchall()
+                if results:
+                    total = _load_rows(conn, results)
+                    release_dead_letters(conn, 'load', [processed_data_id])
+        elif streaming:
+            total = stream_pending_batches('load', STREAM_QUERY, _load_rows, batch_size, memory_limit_mb)
         else:
-            query = text("""
-                SELECT id, data FROM processed_data 
-                WHERE id NOT IN (SELECT processed_data_id FROM final_data WHERE processed_data_id IS NOT NULL)
-            """)
-            params = {}
-        
-        # Ejecutar la consulta
-        with engine.connect() as conn:
-            results = conn.execute(query, params).fetchall()
-            
-            if not results:
-                print("No hay nuevos datos procesados para cargar")
-                return 0
-            
-            # Preparar cada registro para la tabla final
-            final_records = []
-            for row in results:
-                processed_id = row[0]
-                data = json.loads(row[1])
-                
-                # Calcular mu00e9tricas e insights (ejemplo)
-                metrics, insights = calculate_metrics_and_insights(data)
-                
-                # Preparar registro para inserciu00f3n
-                final_record = {
-                    'processed_data_id': processed_id,
-                    'metrics': json.dumps(metrics),
-                    'insights': insights
-                }
-                final_records.append(final_record)
-            
-            # Insertar registros finales
-            if final_records:
-                conn.execute(
-                    text("INSERT INTO final_data (processed_data_id, metrics, insights) VALUES (:processed_data_id, :metrics, :insights)"),
-                    final_records
-                )
-            
-            return len(final_records)
+            for count in process_pending_batches('load', PENDING_QUERY, _load_rows, batch_size):
+                total += count
     
     except Exception as e:
         print(f"Error al cargar datos finales: {e}")
-        return 0
+        if total:
+            print(f"{total} registros ya confirmados; la próxima ejecución continúa desde el último lote")
+        record_error(e)
+        return total
+    
+    if not total:
+        print("No hay nuevos datos procesados para cargar")
+    else:
+        refresh_rollups_after_write(['final_data'])
+    return total
+
+def _load_rows(conn, results):
+    """Calcula métricas para un lote de filas (id, data) de processed_data y lo inserta en final_data"""
+    # Calcular métricas e insights de todo el lote en una sola pasada
+    processed_ids = [row[0] for row in results]
+    calculated = calculate_metrics_and_insights_batch([record_payload(row) for row in results])
+    
+    # Preparar registros para inserción
+    final_records = [
+        {
+            'processed_data_id': processed_id,
+            'metrics': json_utils.dumps(metrics),
+            'insights': insights
+        }
+        for processed_id, (metrics, insights) in zip(processed_ids, calculated)
+    ]
+    
+    record_progress(rows_in=len(results), bytes=sum(len(record['metrics']) + len(record['insights']) for record in final_records))
+    
+    # Insertar registros finales
+    if final_records:
+        lock_writes(conn, ['final_data'])
+        conn.execute(
+            text("INSERT INTO final_data (processed_data_id, metrics, insights) VALUES (:processed_data_id, :metrics, :insights)"),
+            final_records
+        )
+        bump_table_versions(conn, ['final_data'])
+    
+    return len(final_records)
 
 def calculate_metrics_and_insights(data):
     """
@@ -99,3 +147,144 @@ def calculate_metrics_and_insights(data):
             insights += "una baja variabilidad en los datos."
     
     return metrics, insights
+
+def calculate_metrics_and_insights_batch(records):
+    """
+    Calcula métricas e insights para un lote de registros procesados
+    
+    Versión vectorizada de calculate_metrics_and_insights con el mismo resultado
+    por registro. Los registros se agrupan por conjunto de claves y cada grupo
+    se convierte en una matriz NumPy (una fila por registro, una columna por
+    campo) en la que los valores no numéricos quedan enmascarados; sum, avg,
+    max y min se calculan para todas las filas a la vez.
+    
+    Args:
+        records (list): Lista de diccionarios procesados
+    
+    Returns:
+        list: Tuplas (metrics, insights) en el mismo orden que la entrada
+    """
+    key_sets = list(map(tuple, records))
+    if len(set(key_sets)) <= 1:
+        # Caso habitual: todos los registros del lote tienen las mismas claves
+        return _metrics_for_group(records) if records else []
+    
+    results = [None] * len(records)
+    groups = {}
+    for position, keys in enumerate(key_sets):
+        groups.setdefault(keys, []).append(position)
+    
+    for positions in groups.values():
+        rows = [records[p] for p in positions]
+        for position, result in zip(positions, _metrics_for_group(rows)):
+            results[position] = result
+    
+    return results
+
+def _metrics_for_group(rows):
+    """Calcula métricas e insights para registros que comparten el mismo conjunto de claves"""
+    import numpy as np
+
+    n = len(rows)
+    columns = [list(map(itemgetter(key), rows)) for key in rows[0]]
+    
+    # Seleccionar columnas numéricas con el mismo filtro que la versión por registro
+    numeric_columns, values, masks, float_masks = [], [], [], []
+    for column in columns:
+        types = set(map(type, column))
+        numeric_types = {t for t in types if issubclass(t, (int, float))}
+        if not numeric_types:
+            continue
+        
+        if numeric_types == types:
+            mask = np.ones(n, dtype=bool)
+            column_values = column
+        else:
+            mask = np.fromiter((isinstance(val, (int, float)) for val in column), dtype=bool, count=n)
+            column_values = [val if ok else 0 for val, ok in zip(column, mask)]
+        
+        float_types = {t for t in numeric_types if issubclass(t, float)}
+        if not float_types:
+            is_float = np.zeros(n, dtype=bool)
+        elif float_types == numeric_types:
+            is_float = mask
+        else:
+            is_float = np.fromiter((isinstance(val, float) for val in column), dtype=bool, count=n)
+        
+        numeric_columns.append(column)
+        values.append(np.array(column_values, dtype=np.float64))
+        masks.append(mask)
+        float_masks.append(is_float)
+    
+    if not numeric_columns:
+        return [calculate_metrics_and_insights(data) for data in rows]
+    
+    matrix = np.column_stack(values)
+    mask = np.column_stack(masks)
+    is_float = np.column_stack(float_masks) & mask
+    
+    counts = mask.sum(axis=1)
+    # La suma se acumula columna a columna para respetar el orden de sum()
+    # Los valores no finitos se resuelven más abajo con la versión por registro
+    with np.errstate(over='ignore', invalid='ignore', divide='ignore'):
+        totals = np.zeros(n)
+        for j in range(matrix.shape[1]):
+            totals += np.where(mask[:, j], matrix[:, j], 0.0)
+        avgs = totals / counts
+    # argmax/argmin devuelven la primera aparición, igual que max()/min()
+    max_cols = np.where(mask, matrix, -np.inf).argmax(axis=1)
+    min_cols = np.where(mask, matrix, np.inf).argmin(axis=1)
+    row_idx = np.arange(n)
+    with np.errstate(over='ignore', invalid='ignore'):
+        ranges = matrix[row_idx, max_cols] - matrix[row_idx, min_cols]
+    has_float = is_float.any(axis=1)
+    
+    # Valores no finitos o enteros (o sumas enteras) que no caben exactamente en
+    # float64 se delegan en la versión por registro. 2 ** 53 + 1 se redondea a
+    # 2 ** 53 al convertirlo, por lo que el límite es >= 2 ** 53; la suma de los
+    # valores absolutos acota también las sumas parciales y los rangos enteros
+    int_matrix = mask & ~is_float
+    with np.errstate(over='ignore', invalid='ignore'):
+        int_abs_totals = np.where(int_matrix, np.abs(matrix), 0.0).sum(axis=1)
+    fallback = (
+        (~np.isfinite(matrix) & mask).any(axis=1)
+        | ((np.abs(matrix) >= 2 ** 53) & int_matrix).any(axis=1)
+        | (~has_float & (np.abs(totals) >= 2 ** 53))
+        | (int_abs_totals >= 2 ** 53)
+        | (counts == 0)
+    )
+    
+    # Recuperar los valores originales de max/min para conservar su tipo
+    objects = np.empty(matrix.shape[::-1], dtype=object)
+    for j, column in enumerate(numeric_columns):
+        objects[j] = column
+    max_vals = objects[max_cols, row_idx].tolist()
+    min_vals = objects[min_cols, row_idx].tolist()
+    
+    # sum y rango son enteros cuando no intervienen floats, como en la versión por registro
+    int_ranges = ~(is_float[row_idx, max_cols] | is_float[row_idx, min_cols])
+    totals[fallback] = 0
+    ranges[fallback] = 0
+    with np.errstate(invalid='ignore'):
+        sums = np.where(has_float, totals.astype(object), totals.astype(np.int64).astype(object)).tolist()
+        range_vals = np.where(int_ranges, ranges.astype(np.int64).astype(object), ranges.astype(object)).tolist()
+    variability = np.where(ranges > 100, "alta", "baja").tolist()
+    avg_vals = avgs.tolist()
+    
+    # Generar los insights a partir de los arrays de resultados
+    insights = [
+        f"Los datos muestran un valor promedio de {avg}. "
+        f"El rango de valores es {range_val}, lo que indica una {level} variabilidad en los datos."
+        for avg, range_val, level in zip(avg_vals, range_vals, variability)
+    ]
+    metrics = [
+        {'sum': total, 'avg': avg, 'max': max_val, 'min': min_val}
+        for total, avg, max_val, min_val in zip(sums, avg_vals, max_vals, min_vals)
+    ]
+    results = list(zip(metrics, insights))
+    
+    # Filas sin valores numéricos o que no se pueden calcular exactamente en float64
+    for i in np.flatnonzero(fallback).tolist():
+        results[i] = calculate_metrics_and_insights(rows[i])
+    
+    return results
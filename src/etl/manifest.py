@@ -0,0 +1,172 @@
+import hashlib
+import io
+import os
+from sqlalchemy import text
+
+# Tamaño de lectura al calcular la huella de un archivo
+HASH_BLOCK_SIZE = 1024 * 1024
+
+# Manifiesto de archivos ingeridos y hash por fila de raw_data. El índice único
+# es parcial: solo afecta a las filas con row_hash (las cargadas desde CSV).
+# Las filas se deduplican con raw_data_row_hashes, que sigue funcionando con
+# raw_data particionada (donde un índice único tendría que incluir timestamp);
+# al crearla se rellena con los hashes ya presentes en raw_data.
+INGESTION_DDL = [
+    """
+    CREATE TABLE IF NOT EXISTS ingested_files (
+        id SERIAL PRIMARY KEY,
+        source VARCHAR(100) NOT NULL,
+        path TEXT NOT NULL,
+        size BIGINT NOT NULL,
+        mtime DOUBLE PRECISION NOT NULL,
+        content_hash CHAR(64) NOT NULL,
+        rows_ingested BIGINT NOT NULL DEFAULT 0,
+        ingested_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        UNIQUE (source, content_hash, path)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_ingested_files_source_path ON ingested_files(source, path)",
+    "ALTER TABLE raw_data ADD COLUMN IF NOT EXISTS row_hash CHAR(32)",
+    """
+    CREATE UNIQUE INDEX IF NOT EXISTS idx_raw_data_source_row_hash
+    ON raw_data(source, row_hash) WHERE row_hash IS NOT NULL
+    """,
+    """
+    DO $$
+    BEGIN
+        PERFORM pg_advisory_xact_lock(hashtext('raw_data_row_hashes'));
+        IF to_regclass('raw_data_row_hashes') IS NULL THEN
+            CREATE TABLE raw_data_row_hashes (
+                source VARCHAR(100) NOT NULL,
+                row_hash CHAR(32) NOT NULL,
+                PRIMARY KEY (source, row_hash)
+            );
+            INSERT INTO raw_data_row_hashes (source, row_hash)
+            SELECT DISTINCT source, row_hash FROM raw_data WHERE row_hash IS NOT NULL;
+        END IF;
+    END $$
+    """,
+]
+
+def ensure_ingestion_tables(conn):
+    """Crea el manifiesto de archivos y la columna/índice de hash por fila si no existen"""
+    for statement in INGESTION_DDL:
+        conn.execute(text(statement))
+
+def file_fingerprint(file_path):
+    """Tamaño y fecha de modificación de un archivo (sin leerlo)"""
+    stat = os.stat(file_path)
+    return stat.st_size, stat.st_mtime
+
+def content_hash(file_path):
+    """SHA-256 del contenido de un archivo, leído por bloques"""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def load_manifest(conn, source_name):
+    """
+    Devuelve las huellas de los archivos ya ingeridos de una fuente
+
+    Returns:
+        set: Tuplas (path, size, mtime)
+    """
+    rows = conn.execute(
+        text("SELECT path, size, mtime FROM ingested_files WHERE source = :source"),
+        {"source": source_name}
+    ).fetchall()
+    return {(path, size, mtime) for path, size, mtime in rows}
+
+def check_file(conn, file_path, source_name, manifest=None):
+    """
+    Comprueba si un archivo ya se ha ingerido para una fuente
+
+    Primero se compara ruta, tamaño y fecha de modificación, sin leer el
+    archivo. Si no coinciden, se calcula el hash del contenido: un archivo
+    copiado, renombrado o tocado sin cambios se reconoce por él y se registra
+    con su nueva ruta para que la próxima vez baste con la comparación rápida.
+
+    Args:
+        conn: Conexión activa de SQLAlchemy
+        file_path (str): Ruta al archivo
+        source_name (str): Nombre de la fuente de datos
+        manifest (set, optional): Resultado de load_manifest, para no consultarlo por cada archivo
+
+    Returns:
+        tuple: (ya_ingerido, huella) donde huella es un dict con path, size, mtime y
+        content_hash (None si no hizo falta calcularlo)
+    """
+    path = os.path.abspath(file_path)
+    size, mtime = file_fingerprint(path)
+    fingerprint = {'source': source_name, 'path': path, 'size': size, 'mtime': mtime, 'content_hash': None}
+    if manifest is None:
+        manifest = load_manifest(conn, source_name)
+    if (path, size, mtime) in manifest:
+        return True, fingerprint
+
+    fingerprint['content_hash'] = content_hash(path)
+    seen = conn.execute(
+        text("SELECT 1 FROM ingested_files WHERE source = :source AND content_hash = :content_hash LIMIT 1"),
+        fingerprint
+    ).fetchone()
+    if seen is not None:
+        record_file(conn, fingerprint, 0)
+        return True, fingerprint
+    return False, fingerprint
+
+def record_file(conn, fingerprint, rows_ingested):
+    """Registra (o actualiza) un archivo en el manifiesto"""
+    conn.execute(
+        text("""
+            INSERT INTO ingested_files (source, path, size, mtime, content_hash, rows_ingested)
+            VALUES (:source, :path, :size, :mtime, :content_hash, :rows_ingested)
+            ON CONFLICT (source, content_hash, path) DO UPDATE
+            SET size = EXCLUDED.size, mtime = EXCLUDED.mtime, ingested_at = CURRENT_TIMESTAMP
+        """),
+        dict(fingerprint, rows_ingested=rows_ingested)
+    )
+
+def new_row_positions(cursor, payloads, source_name):
+    """
+    Registra el hash de cada fila en raw_data_row_hashes y devuelve las filas nuevas
+
+    El JSON de cada fila se copia a una tabla temporal (sin WAL) y su hash se
+    calcula en PostgreSQL sobre la forma canónica del JSONB, independiente del
+    orden de las claves. Solo se devuelven las filas cuyo hash entra nuevo
+    (la primera aparición de cada hash dentro del lote); si la transacción se
+    deshace, los hashes también.
+
+    Args:
+        cursor: Cursor de psycopg2 (la transacción la confirma quien llama)
+        payloads (list): JSON de cada fila
+        source_name (str): Nombre de la fuente de datos
+
+    Returns:
+        list: Tuplas (posición en payloads, row_hash) ordenadas por posición
+    """
+    import pandas as pd
+
+    cursor.execute("""
+        CREATE TEMP TABLE IF NOT EXISTS tmp_raw_row_hashes (ord INTEGER, data TEXT) ON COMMIT DELETE ROWS
+    """)
+    buffer = io.StringIO()
+    pd.DataFrame({'ord': range(len(payloads)), 'data': payloads}).to_csv(buffer, header=False, index=False)
+    buffer.seek(0)
+    cursor.copy_expert("COPY tmp_raw_row_hashes (ord, data) FROM STDIN WITH (FORMAT csv)", buffer)
+    cursor.execute("""
+        WITH hashed AS (
+            SELECT ord, md5(data::jsonb::text) AS row_hash FROM tmp_raw_row_hashes
+        ), new_hash AS (
+            INSERT INTO raw_data_row_hashes (source, row_hash)
+            SELECT DISTINCT CAST(%(source)s AS VARCHAR), row_hash FROM hashed
+            ON CONFLICT DO NOTHING
+            RETURNING row_hash
+        )
+        SELECT MIN(h.ord), h.row_hash FROM hashed h JOIN new_hash n ON n.row_hash = h.row_hash
+        GROUP BY h.row_hash ORDER BY 1
+    """, {"source": source_name})
+    new_rows = [(row[0], row[1]) for row in cursor.fetchall()]
+    cursor.execute("TRUNCATE tmp_raw_row_hashes")
+    return new_rows
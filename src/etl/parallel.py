@@ -0,0 +1,133 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from sqlalchemy import text
+from ..utils.database import get_engine
+from .checkpoint import (DEFAULT_BATCH_SIZE, ensure_checkpoint_table, ensure_dead_letter_table, get_watermark,
+                         handle_batch, set_watermark, wait_for_writes, with_retries)
+from .instrumentation import collect_progress, record_progress
+from .partitions import pending_since
+
+# Reclama un lote de registros pendientes; las filas bloqueadas por otro worker
+# y las que están en cuarentena se saltan
+CLAIM_QUERY = text("""
+    SELECT r.id, r.data, r.source FROM raw_data r
+    WHERE r.id > :last_id
+      AND (:since IS NULL OR r.timestamp >= :since)
+      AND NOT EXISTS (SELECT 1 FROM processed_data p WHERE p.raw_data_id = r.id)
+      AND NOT EXISTS (SELECT 1 FROM etl_dead_letters d WHERE d.stage = 'transform' AND d.record_id = r.id)
+    ORDER BY r.id
+    LIMIT :limit
+    FOR UPDATE OF r SKIP LOCKED
+""")
+
+# Tras obtener el bloqueo se vuelve a comprobar con una instantánea nueva: otro worker
+# pudo confirmar esas filas entre la instantánea del SELECT y la toma del bloqueo
+ALREADY_PROCESSED_QUERY = text("""
+    SELECT raw_data_id FROM processed_data WHERE raw_data_id = ANY(:ids)
+""")
+
+# Primer registro sin transformar (ni en cuarentena) entre la marca inicial y el
+# mayor id procesado: una escritura que se confirmó tarde con un id menor
+FIRST_PENDING_QUERY = text("""
+    SELECT MIN(r.id) FROM raw_data r
+    WHERE r.id > :last_id AND r.id <= :max_id
+      AND NOT EXISTS (SELECT 1 FROM processed_data p WHERE p.raw_data_id = r.id)
+      AND NOT EXISTS (SELECT 1 FROM etl_dead_letters d WHERE d.stage = 'transform' AND d.record_id = r.id)
+""")
+
+def transform_parallel(workers=None, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Transforma los registros pendientes de raw_data con varios procesos
+
+    Cada worker reclama lotes disjuntos con SELECT ... FOR UPDATE SKIP LOCKED,
+    los transforma y confirma por su cuenta, hasta que no quedan registros
+    pendientes. Los lotes se reintentan ante errores transitorios y los
+    registros que fallan se ponen en cuarentena (ver checkpoint.py). Al
+    terminar, la marca de agua de la etapa 'transform' se avanza hasta el mayor
+    id procesado, o hasta justo antes del primer registro que siga pendiente
+    (una escritura con un id menor que se confirmó durante la ejecución). El
+    progreso de los workers (registros leídos y bytes) se suma a la etapa del
+    proceso padre.
+
+    Args:
+        workers (int, optional): Número de procesos (por defecto, número de CPUs)
+        batch_size (int): Número de registros por lote reclamado
+
+    Returns:
+        int: Número de registros transformados
+    """
+    workers = workers or os.cpu_count() or 1
+
+    with get_engine().begin() as conn:
+        ensure_checkpoint_table(conn)
+        ensure_dead_letter_table(conn)
+        last_id = get_watermark(conn, 'transform')
+        since = pending_since(conn, 'transform', last_id)
+
+    # Cerrar las conexiones del padre antes del fork; cada worker crea su propio
+    # motor con get_engine()
+    get_engine().dispose()
+
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(_worker_loop, last_id, since, batch_size) for _ in range(workers)]
+        results = [future.result() for future in futures]
+    elapsed = time.perf_counter() - start
+
+    total = sum(count for count, _, _ in results)
+    max_id = max((max_id for _, max_id, _ in results if max_id is not None), default=None)
+    for _, _, progress in results:
+        record_progress(**progress)
+    if max_id is not None:
+        with get_engine().begin() as conn:
+            # Sin escrituras en curso en raw_data, todo registro con id menor ya es visible
+            wait_for_writes(conn, 'raw_data')
+            first_pending = conn.execute(FIRST_PENDING_QUERY, {"last_id": last_id, "max_id": max_id}).scalar()
+            if first_pending is not None:
+                max_id = first_pending - 1
+            set_watermark(conn, 'transform', max(max_id, get_watermark(conn, 'transform')))
+
+    rate = total / elapsed if elapsed > 0 else 0
+    print(f"{total} registros transformados con {workers} workers en {elapsed:.2f}s ({rate:,.0f} filas/s)")
+    return total
+
+def _worker_loop(last_id, since, batch_size):
+    """
+    Reclama y transforma lotes hasta que no quedan pendientes; devuelve (registros, mayor id, progreso)
+
+    Cada worker avanza su propia marca hasta el mayor id reclamado, de modo que
+    cada reclamación empieza donde terminó la anterior en lugar de volver a
+    recorrer las filas ya procesadas en esta ejecución. Las filas anteriores
+    que se saltó por estar bloqueadas pertenecen al lote de otro worker, que
+    las vuelve a reclamar con su propia marca si su lote se reintenta. El
+    progreso (argumentos de record_progress) se devuelve al padre, ya que en
+    el worker no hay etapa activa en la que sumarlo.
+    """
+    # Importación diferida para evitar el ciclo transform -> parallel -> transform
+    from .transform import _transform_rows
+
+    total = 0
+    max_id = None
+    with collect_progress() as progress:
+        while True:
+            count, batch_max_id = with_retries('transform', _claim_batch, _transform_rows, last_id, since, batch_size)
+            if batch_max_id is None:
+                break
+            total += count
+            last_id = batch_max_id
+            max_id = max(batch_max_id, max_id or 0)
+    return total, max_id, {'rows_in': progress.rows_in, 'bytes': progress.bytes}
+
+def _claim_batch(handler, last_id, since, batch_size):
+    """Reclama y transforma un lote; devuelve (registros, mayor id) o (0, None) si no quedan"""
+    with get_engine().begin() as conn:
+        rows = conn.execute(CLAIM_QUERY, {"last_id": last_id, "since": since, "limit": batch_size}).fetchall()
+        if not rows:
+            return 0, None
+
+        ids = [row[0] for row in rows]
+        done = {row[0] for row in conn.execute(ALREADY_PROCESSED_QUERY, {"ids": ids})}
+        pending = [row for row in rows if row[0] not in done]
+        count = handle_batch(conn, 'transform', handler, pending) if pending else 0
+    return count, ids[-1]
@@ -0,0 +1,451 @@
+import argparse
+import os
+import re
+from datetime import datetime
+from sqlalchemy import text
+from ..utils.database import get_engine
+from ..utils.query_cache import bump_table_versions
+
+# Tablas que se pueden particionar por rango mensual y su columna de partición
+PARTITION_KEYS = {
+    'raw_data': 'timestamp',
+    'processed_data': 'processed_at',
+}
+
+# Tabla de la que lee los registros pendientes cada etapa
+STAGE_TABLES = {
+    'transform': 'raw_data',
+    'load': 'processed_data',
+}
+
+# Índices de la tabla particionada (se crean en cada partición). El de
+# (source, row_hash) deja de ser único: un índice único tendría que incluir la
+# columna de partición, y la deduplicación se hace con raw_data_row_hashes
+PARTITION_INDEXES = {
+    'raw_data': [
+        "CREATE INDEX IF NOT EXISTS idx_raw_data_timestamp ON raw_data(timestamp)",
+        "CREATE INDEX IF NOT EXISTS idx_raw_data_source ON raw_data(source)",
+        "CREATE INDEX IF NOT EXISTS idx_raw_data_source_row_hash ON raw_data(source, row_hash) WHERE row_hash IS NOT NULL",
+    ],
+    'processed_data': [
+        "CREATE INDEX IF NOT EXISTS idx_processed_data_processed_at ON processed_data(processed_at)",
+        "CREATE INDEX IF NOT EXISTS idx_processed_data_raw_data_id ON processed_data(raw_data_id)",
+    ],
+}
+
+# Tablas que lee cada etapa con marca de agua (también en sus NOT EXISTS y
+# JOIN). Mientras una de ellas se migra a particionada, sus filas aún no
+# copiadas no son visibles y la etapa avanzaría la marca por encima de ellas
+WATERMARK_READS = {
+    'transform': ('raw_data', 'processed_data'),
+    'transform_chunks': ('processed_data',),
+    'load': ('processed_data',),
+    'export_processed': ('raw_data', 'processed_data'),
+    'export_final': ('raw_data', 'processed_data'),
+}
+
+# Meses futuros para los que se crean particiones por adelantado
+PARTITION_MONTHS_AHEAD = int(os.getenv("ETL_PARTITION_MONTHS_AHEAD", "3"))
+
+# Meses completos que se conservan (sin definir no se aplica retención) y si las
+# particiones antiguas se eliminan o solo se separan de la tabla
+RETENTION_MONTHS = int(os.getenv("ETL_RETENTION_MONTHS")) if os.getenv("ETL_RETENTION_MONTHS") else None
+RETENTION_DROP = os.getenv("ETL_RETENTION_DROP", "false").lower() in ("1", "true", "yes")
+
+# Filas copiadas por transacción al migrar una tabla existente
+MIGRATION_BATCH_SIZE = 50000
+
+PARTITION_BOUND = re.compile(r"FROM \('([^']+)'\) TO \('([^']+)'\)")
+
+def month_start(value):
+    """Primer instante del mes de una fecha"""
+    return datetime(value.year, value.month, 1)
+
+def add_months(value, months):
+    """Primer instante del mes que está `months` meses después (o antes) del de value"""
+    index = value.year * 12 + value.month - 1 + months
+    return datetime(index // 12, index % 12 + 1, 1)
+
+def partition_name(table, start):
+    """Nombre de la partición mensual de una tabla (p. ej. raw_data_p202401)"""
+    return f"{table}_p{start:%Y%m}"
+
+def is_partitioned(conn, table):
+    """Indica si una tabla existe y está particionada"""
+    return conn.execute(
+        text("SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(:table))"),
+        {"table": table}
+    ).scalar()
+
+def list_partitions(conn, table):
+    """
+    Devuelve las particiones de una tabla
+
+    Returns:
+        list: Tuplas (nombre, inicio, fin) ordenadas por inicio; inicio y fin
+        son None en la partición por defecto y en las de límites no mensuales
+    """
+    rows = conn.execute(text("""
+        SELECT c.relname, pg_get_expr(c.relpartbound, c.oid) FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = CAST(:table AS regclass)
+    """), {"table": table}).fetchall()
+    partitions = []
+    for name, bound in rows:
+        match = PARTITION_BOUND.search(bound or '')
+        if match:
+            partitions.append((name, datetime.fromisoformat(match.group(1)), datetime.fromisoformat(match.group(2))))
+        else:
+            partitions.append((name, None, None))
+    return sorted(partitions, key=lambda partition: (partition[1] is None, partition[1] or datetime.min))
+
+def create_partition(conn, table, start):
+    """
+    Crea la partición mensual que empieza en start si no existe
+
+    Si la partición por defecto ya tiene filas de ese mes, se mueven a la
+    partición nueva antes de adjuntarla (PostgreSQL no permite crear una
+    partición cuyas filas estén en la de por defecto).
+
+    Returns:
+        bool: True si se ha creado
+    """
+    name = partition_name(table, start)
+    if conn.execute(text("SELECT to_regclass(:name) IS NOT NULL"), {"name": name}).scalar():
+        return False
+    column = PARTITION_KEYS[table]
+    end = add_months(start, 1)
+    bounds = f"FROM ('{start:%Y-%m-%d %H:%M:%S}') TO ('{end:%Y-%m-%d %H:%M:%S}')"
+    params = {"start": start, "end": end}
+    default = f"{table}_default"
+    has_default_rows = conn.execute(text("SELECT to_regclass(:name) IS NOT NULL"), {"name": default}).scalar() and \
+        conn.execute(text(f'SELECT EXISTS (SELECT 1 FROM {default} WHERE "{column}" >= :start AND "{column}" < :end)'),
+                     params).scalar()
+    if has_default_rows:
+        conn.execute(text(f"CREATE TABLE {name} (LIKE {table} INCLUDING DEFAULTS)"))
+        moved = conn.execute(text(f"""
+            WITH moved AS (
+                DELETE FROM {default} WHERE "{column}" >= :start AND "{column}" < :end RETURNING *
+            )
+            INSERT INTO {name} SELECT * FROM moved
+        """), params).rowcount
+        conn.execute(text(f"ALTER TABLE {table} ATTACH PARTITION {name} FOR VALUES {bounds}"))
+        print(f"Partición {name} creada con {moved} filas movidas desde {default}")
+    else:
+        conn.execute(text(f"CREATE TABLE {name} PARTITION OF {table} FOR VALUES {bounds}"))
+        print(f"Partición {name} creada")
+    return True
+
+def ensure_partitions(conn, table, first_month, last_month):
+    """Crea las particiones mensuales de first_month a last_month (incluidos); devuelve las creadas"""
+    conn.execute(text("SELECT pg_advisory_xact_lock(hashtext(:key))"), {"key": f"partitions:{table}"})
+    created = 0
+    month = month_start(first_month)
+    while month <= last_month:
+        created += create_partition(conn, table, month)
+        month = add_months(month, 1)
+    return created
+
+def ensure_future_partitions(conn, table, months_ahead=PARTITION_MONTHS_AHEAD):
+    """Crea las particiones del mes actual y de los months_ahead siguientes que falten"""
+    current = month_start(datetime.now())
+    return ensure_partitions(conn, table, current, add_months(current, months_ahead))
+
+def apply_retention(conn, table, months, drop=RETENTION_DROP):
+    """
+    Retira las particiones mensuales anteriores a los últimos `months` meses completos
+
+    Las particiones se separan de la tabla con DETACH PARTITION (sin borrar
+    fila a fila) y quedan como tablas independientes para archivarlas o
+    consultarlas; con drop=True se eliminan. Las filas de la partición por
+    defecto no se tocan.
+
+    Args:
+        conn: Conexión activa de SQLAlchemy
+        table (str): Tabla particionada
+        months (int): Meses completos a conservar además del actual
+        drop (bool): Eliminar las particiones en lugar de solo separarlas
+
+    Returns:
+        list: Nombres de las particiones retiradas
+    """
+    conn.execute(text("SELECT pg_advisory_xact_lock(hashtext(:key))"), {"key": f"partitions:{table}"})
+    cutoff = add_months(month_start(datetime.now()), -months)
+    removed = []
+    for name, start, end in list_partitions(conn, table):
+        if end is None or end > cutoff:
+            continue
+        conn.execute(text(f"ALTER TABLE {table} DETACH PARTITION {name}"))
+        if drop:
+            conn.execute(text(f"DROP TABLE {name}"))
+        removed.append(name)
+        print(f"Partición {name} {'eliminada' if drop else 'separada de ' + table} (retención de {months} meses)")
+    if removed:
+        bump_table_versions(conn, [table])
+    return removed
+
+def maintain_partitions(months_ahead=PARTITION_MONTHS_AHEAD, retention_months=RETENTION_MONTHS, drop=RETENTION_DROP):
+    """
+    Crea las particiones futuras y aplica la retención en las tablas particionadas
+
+    Las tablas sin particionar se omiten. Los errores se imprimen sin
+    interrumpir el ETL.
+
+    Returns:
+        dict: {tabla: (particiones creadas, particiones retiradas)}
+    """
+    result = {}
+    for table in PARTITION_KEYS:
+        try:
+            with get_engine().begin() as conn:
+                if not is_partitioned(conn, table):
+                    continue
+                created = ensure_future_partitions(conn, table, months_ahead)
+                removed = apply_retention(conn, table, retention_months, drop) if retention_months is not None else []
+            result[table] = (created, len(removed))
+        except Exception as e:
+            print(f"Error al mantener las particiones de {table}: {e}")
+    return result
+
+def pending_since(conn, stage, last_id):
+    """
+    Límite inferior de la columna de partición para los registros pendientes de una etapa
+
+    Las consultas de registros pendientes filtran por id > :last_id, que no
+    permite descartar particiones. Se busca la partición más antigua que tiene
+    filas por encima de la marca de agua (una consulta por partición sobre su
+    clave primaria) y se devuelve su inicio, para añadir a la consulta un
+    filtro por la columna de partición con el que PostgreSQL ignora las
+    anteriores. El límite nunca es posterior al inicio del mes actual, de modo
+    que las filas que se insertan durante la ejecución no quedan fuera.
+
+    Si se está migrando una tabla que lee la etapa, lanza RuntimeError (ver
+    check_migrations).
+
+    Returns:
+        datetime o None: None si la tabla no está particionada o hay registros
+        pendientes en la partición por defecto (no se puede acotar)
+    """
+    check_migrations(conn, stage)
+    table = STAGE_TABLES.get(stage)
+    if table is None or not is_partitioned(conn, table):
+        return None
+    partitions = list_partitions(conn, table)
+    if any(start is None and _has_rows_after(conn, name, last_id) for name, start, _ in partitions):
+        return None
+    current = month_start(datetime.now())
+    for name, start, _ in partitions:
+        if start is None or start >= current:
+            break
+        if _has_rows_after(conn, name, last_id):
+            return start
+    return current
+
+def migrating_tables(conn, tables):
+    """Tablas cuya migración a particionada no ha terminado (<tabla>_legacy tiene filas sin copiar)"""
+    # Importación diferida para evitar el ciclo checkpoint -> partitions -> checkpoint
+    from .checkpoint import get_watermark
+
+    migrating = []
+    for table in tables:
+        legacy = f"{table}_legacy"
+        if not conn.execute(text("SELECT to_regclass(:name) IS NOT NULL"), {"name": legacy}).scalar():
+            continue
+        last_id = get_watermark(conn, f"partition_migration:{table}")
+        if conn.execute(
+                text(f"SELECT EXISTS (SELECT 1 FROM {legacy} WHERE id > :last_id)"), {"last_id": last_id}).scalar():
+            migrating.append(table)
+    return migrating
+
+def check_migrations(conn, stage, tables=None):
+    """
+    Impide ejecutar una etapa con marca de agua mientras se migra una tabla que lee
+
+    Durante la copia de migrate_to_partitioned las filas que quedan en
+    <tabla>_legacy no son visibles en la tabla nueva, pero tienen ids menores
+    que las que se insertan en ella: si la etapa se ejecutara, su marca de agua
+    pasaría por encima y esas filas no se procesarían nunca.
+
+    Args:
+        conn: Conexión activa de SQLAlchemy
+        stage (str): Nombre de la etapa
+        tables (list, optional): Tablas que lee; por defecto las de WATERMARK_READS
+
+    Raises:
+        RuntimeError: Si alguna de las tablas se está migrando
+    """
+    migrating = migrating_tables(conn, WATERMARK_READS.get(stage, ()) if tables is None else tables)
+    if migrating:
+        raise RuntimeError(
+            f"La etapa {stage} no se puede ejecutar mientras se migra {', '.join(migrating)} a tabla "
+            f"particionada; termine la migración con python -m src.etl.partitions --migrar <tabla>"
+        )
+
+def _has_rows_after(conn, partition, last_id):
+    return conn.execute(
+        text(f"SELECT EXISTS (SELECT 1 FROM {partition} WHERE id > :last_id)"), {"last_id": last_id}
+    ).scalar()
+
+def migrate_to_partitioned(table, batch_size=MIGRATION_BATCH_SIZE, keep_legacy=False,
+                           months_ahead=PARTITION_MONTHS_AHEAD):
+    """
+    Convierte una tabla existente en una tabla particionada por mes
+
+    1. En una transacción: la tabla se renombra a <tabla>_legacy, se crea la
+       tabla particionada con las mismas columnas y la misma secuencia de id
+       (clave primaria (id, columna de partición)), las particiones mensuales
+       que cubren los datos existentes y los meses futuros, y la partición por
+       defecto. Desde ese momento las inserciones nuevas van a la tabla
+       particionada.
+    2. Las filas se copian por lotes de batch_size en orden de id, cada lote en
+       su propia transacción con su marca de agua en etl_checkpoints
+       ('partition_migration:<tabla>'); si se interrumpe, volver a llamarla
+       continúa desde el último lote.
+    3. Se elimina la tabla original, salvo con keep_legacy=True.
+
+    Mientras quedan filas por copiar, transform, load, export y los agregados
+    que leen la tabla se niegan a ejecutarse (ver check_migrations).
+
+    Las claves foráneas que apuntan a la tabla (processed_data.raw_data_id,
+    final_data.processed_data_id, tablas de staging) se eliminan en el paso 1:
+    una tabla particionada no puede tener un índice único solo sobre id.
+
+    Args:
+        table (str): 'raw_data' o 'processed_data'
+        batch_size (int): Filas copiadas por transacción
+        keep_legacy (bool): Conservar la tabla original tras la copia
+        months_ahead (int): Meses futuros para los que crear particiones
+
+    Returns:
+        int: Filas copiadas en esta llamada
+    """
+    # Importación diferida para evitar el ciclo checkpoint -> partitions -> checkpoint
+    from .checkpoint import ensure_checkpoint_table, get_watermark, set_watermark
+
+    if table not in PARTITION_KEYS:
+        raise ValueError(f"Tabla no soportada: {table}")
+    column = PARTITION_KEYS[table]
+    legacy = f"{table}_legacy"
+    stage = f"partition_migration:{table}"
+
+    with get_engine().begin() as conn:
+        conn.execute(text("SELECT pg_advisory_xact_lock(hashtext(:key))"), {"key": f"partitions:{table}"})
+        ensure_checkpoint_table(conn)
+        has_legacy = conn.execute(text("SELECT to_regclass(:name) IS NOT NULL"), {"name": legacy}).scalar()
+        if not is_partitioned(conn, table):
+            if has_legacy:
+                raise RuntimeError(f"{legacy} ya existe y {table} no está particionada")
+            _swap_to_partitioned(conn, table, column, legacy, months_ahead)
+            set_watermark(conn, stage, 0)
+            bump_table_versions(conn, [table])
+            has_legacy = True
+        if not has_legacy:
+            print(f"{table} ya está particionada")
+            ensure_future_partitions(conn, table, months_ahead)
+            return 0
+        last_id = get_watermark(conn, stage)
+
+    copied = 0
+    while True:
+        with get_engine().begin() as conn:
+            ids = conn.execute(text(f"""
+                WITH batch AS (
+                    SELECT * FROM {legacy} WHERE id > :last_id ORDER BY id LIMIT :limit
+                )
+                INSERT INTO {table} SELECT * FROM batch RETURNING id
+            """), {"last_id": last_id, "limit": batch_size}).fetchall()
+            if not ids:
+                break
+            last_id = max(row[0] for row in ids)
+            set_watermark(conn, stage, last_id)
+            bump_table_versions(conn, [table])
+        copied += len(ids)
+        print(f"{table}: {copied} filas copiadas (hasta id {last_id})")
+
+    if not keep_legacy:
+        with get_engine().begin() as conn:
+            conn.execute(text(f"DROP TABLE {legacy}"))
+        print(f"{legacy} eliminada")
+    print(f"Migración de {table} completada: {copied} filas copiadas")
+    return copied
+
+def _swap_to_partitioned(conn, table, column, legacy, months_ahead):
+    """Renombra la tabla original y crea en su lugar la tabla particionada con sus particiones"""
+    nullable = conn.execute(text("""
+        SELECT is_nullable = 'YES' FROM information_schema.columns
+        WHERE table_schema = current_schema() AND table_name = :table AND column_name = :column
+    """), {"table": table, "column": column}).scalar()
+    if nullable and conn.execute(text(f'SELECT EXISTS (SELECT 1 FROM {table} WHERE "{column}" IS NULL)')).scalar():
+        raise RuntimeError(f"{table} tiene filas con {column} nulo; asígnales un valor antes de particionar")
+
+    sequence = conn.execute(text("SELECT pg_get_serial_sequence(:table, 'id')"), {"table": table}).scalar()
+    first, last = conn.execute(text(f'SELECT MIN("{column}"), MAX("{column}") FROM {table}')).fetchone()
+
+    conn.execute(text(f"LOCK TABLE {table} IN ACCESS EXCLUSIVE MODE"))
+    # Las claves foráneas que apuntan a la tabla seguirían apuntando a la
+    # original y rechazarían las filas nuevas; la tabla particionada no puede
+    # tener un índice único solo sobre id, así que se eliminan
+    for referencing, constraint in conn.execute(text("""
+        SELECT conrelid::regclass::text, conname FROM pg_constraint
+        WHERE contype = 'f' AND confrelid = CAST(:table AS regclass)
+    """), {"table": table}).fetchall():
+        conn.execute(text(f'ALTER TABLE {referencing} DROP CONSTRAINT "{constraint}"'))
+        print(f"Clave foránea {constraint} de {referencing} eliminada")
+    conn.execute(text(f"ALTER TABLE {table} RENAME TO {legacy}"))
+    # Los índices conservan su nombre al renombrar la tabla; se renombran para
+    # poder crear los de la tabla particionada con los nombres originales
+    for (index,) in conn.execute(text("""
+        SELECT indexname FROM pg_indexes WHERE schemaname = current_schema() AND tablename = :legacy
+    """), {"legacy": legacy}).fetchall():
+        conn.execute(text(f'ALTER INDEX "{index}" RENAME TO "{index[:56]}_legacy"'))
+
+    conn.execute(text(f'CREATE TABLE {table} (LIKE {legacy} INCLUDING DEFAULTS) PARTITION BY RANGE ("{column}")'))
+    conn.execute(text(f'ALTER TABLE {table} ADD PRIMARY KEY (id, "{column}")'))
+    if sequence:
+        # La secuencia pasa a la tabla nueva para que no se elimine con la original
+        conn.execute(text(f"ALTER SEQUENCE {sequence} OWNED BY {table}.id"))
+    for statement in PARTITION_INDEXES[table]:
+        conn.execute(text(statement))
+
+    current = month_start(datetime.now())
+    first_month = min(month_start(first), current) if first is not None else current
+    last_month = add_months(max(month_start(last), current) if last is not None else current, months_ahead)
+    created = ensure_partitions(conn, table, first_month, last_month)
+    conn.execute(text(f"CREATE TABLE {table}_default PARTITION OF {table} DEFAULT"))
+    print(f"{table} particionada por {column}: {created} particiones mensuales y {table}_default")
+
+def print_partitions(conn, table):
+    """Imprime las particiones de una tabla con su rango, filas estimadas y tamaño"""
+    if not is_partitioned(conn, table):
+        print(f"{table}: sin particionar")
+        return
+    print(f"{table}:")
+    for name, start, end in list_partitions(conn, table):
+        rows, size = conn.execute(text("""
+            SELECT c.reltuples::bigint, pg_size_pretty(pg_total_relation_size(c.oid))
+            FROM pg_class c WHERE c.oid = CAST(:name AS regclass)
+        """), {"name": name}).fetchone()
+        bounds = f"{start:%Y-%m-%d} .. {end:%Y-%m-%d}" if start is not None else 'por defecto'
+        print(f"  {name:<32} {bounds:<24} {max(rows, 0):>12} filas  {size:>10}")
+
+def main():
+    parser = argparse.ArgumentParser(description='Particionado mensual y retención de raw_data y processed_data')
+    parser.add_argument('--migrar', choices=list(PARTITION_KEYS), help='Convertir esta tabla en particionada')
+    parser.add_argument('--batch-size', type=int, default=MIGRATION_BATCH_SIZE, help='Filas copiadas por transacción')
+    parser.add_argument('--conservar-original', action='store_true', help='No eliminar <tabla>_legacy tras migrar')
+    parser.add_argument('--meses-futuros', type=int, default=PARTITION_MONTHS_AHEAD,
+                        help='Meses futuros para los que crear particiones')
+    parser.add_argument('--retencion', type=int, default=RETENTION_MONTHS, metavar='MESES',
+                        help='Retirar las particiones anteriores a los últimos MESES meses completos')
+    parser.add_argument('--eliminar', action='store_true', help='Eliminar las particiones retiradas en lugar de separarlas')
+    args = parser.parse_args()
+
+    if args.migrar:
+        migrate_to_partitioned(args.migrar, args.batch_size, args.conservar_original, args.meses_futuros)
+    maintain_partitions(args.meses_futuros, args.retencion, args.eliminar or RETENTION_DROP)
+    with get_engine().begin() as conn:
+        for table in PARTITION_KEYS:
+            print_partitions(conn, table)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,265 @@
+import io
+import queue
+import threading
+import time
+from datetime import datetime
+from ..utils.database import get_engine
+from ..utils.query_cache import bump_table_versions
+from . import json_utils
+from .checkpoint import lock_writes
+from .extract import DEFAULT_CHUNK_SIZE
+from .transform import clean_and_transform_batch
+from .load import calculate_metrics_and_insights_batch
+from .instrumentation import instrumented, record_error, record_progress
+from .manifest import check_file, content_hash, ensure_ingestion_tables, new_row_positions, record_file
+from .rollups import refresh_rollups_after_write
+from .staging import STAGING_ENABLED, clear_schema_cache, staging_table_name, write_staging_rows
+
+# Lotes que pueden esperar entre dos etapas antes de bloquear a la anterior
+DEFAULT_QUEUE_SIZE = 2
+
+# Marca de fin de flujo entre etapas
+_END = object()
+
+def run_csv_pipeline(file_path, source_name, chunksize=DEFAULT_CHUNK_SIZE, queue_size=DEFAULT_QUEUE_SIZE, force=False):
+    """
+    Ejecuta extract, transform y load de un archivo CSV en un único flujo en memoria
+
+    Igual que extract_from_csv, consulta el manifiesto de archivos ingeridos
+    (los archivos ya ingeridos se omiten) y registra el archivo cuando todos
+    sus lotes se han confirmado.
+
+    Args:
+        file_path (str): Ruta al archivo CSV
+        source_name (str): Nombre de la fuente de datos
+        chunksize (int): Número de filas por lote
+        queue_size (int): Lotes en espera permitidos entre etapas
+        force (bool): Si es True, vuelve a leer el archivo aunque ya esté en el
+            manifiesto (las filas duplicadas se siguen descartando)
+
+    Returns:
+        int: Número de registros nuevos procesados
+    """
+    import pandas as pd
+
+    with get_engine().begin() as conn:
+        ensure_ingestion_tables(conn)
+        ingested, fingerprint = check_file(conn, file_path, source_name)
+    if ingested and not force:
+        print(f"{file_path} ya se ingirió para la fuente {source_name}; se omite")
+        return 0
+    return run_pipeline(pd.read_csv(file_path, chunksize=chunksize), source_name, queue_size, fingerprint)
+
+@instrumented('full_etl')
+def run_pipeline(batches, source_name, queue_size=DEFAULT_QUEUE_SIZE, fingerprint=None):
+    """
+    Encadena extract, transform y load en memoria mediante colas acotadas
+
+    Cada lote (un DataFrame) pasa por tres hilos: lectura, cálculo
+    (clean_and_transform_batch y calculate_metrics_and_insights_batch) y
+    escritura. Las colas entre hilos tienen tamaño queue_size, por lo que una
+    etapa lenta frena a las anteriores en lugar de acumular lotes en memoria.
+    El escritor reserva los ids de raw_data y processed_data con nextval, de modo
+    que las tres tablas se cargan con COPY sin necesidad de RETURNING, y confirma
+    cada lote en una transacción. Las filas se deduplican por hash como en
+    extract (ver manifest.new_row_positions): solo se cargan en las tres
+    tablas las filas que no estaban ya en raw_data.
+
+    El resultado es el mismo que el de extract, transform y load por separado:
+    las filas procesadas se calculan a partir del JSON guardado en raw_data, con
+    ETL_STAGING_ENABLED=true se escriben también en staging y, al terminar, se
+    actualizan los agregados diarios (como en load_to_final_table).
+
+    Args:
+        batches (iterable): Lotes de datos como DataFrames
+        source_name (str): Nombre de la fuente de datos
+        queue_size (int): Lotes en espera permitidos entre etapas
+        fingerprint (dict, optional): Huella del archivo de origen (ver
+            manifest.check_file); se registra en el manifiesto si todos los
+            lotes se confirman
+
+    Returns:
+        int: Número de registros nuevos procesados
+    """
+    with get_engine().begin() as conn:
+        ensure_ingestion_tables(conn)
+
+    computed = queue.Queue(maxsize=queue_size)
+    to_write = queue.Queue(maxsize=queue_size)
+    errors = []
+    stage_times = {'read': 0.0, 'compute': 0.0, 'write': 0.0}
+    total = [0]
+    duplicates = [0]
+
+    def reader():
+        try:
+            iterator = iter(batches)
+            while not errors:
+                start = time.perf_counter()
+                chunk = next(iterator, None)
+                stage_times['read'] += time.perf_counter() - start
+                if chunk is None:
+                    break
+                computed.put(chunk)
+        except Exception as e:
+            errors.append(e)
+        finally:
+            computed.put(_END)
+
+    def compute():
+        try:
+            while True:
+                chunk = computed.get()
+                if chunk is _END:
+                    break
+                if errors:
+                    continue
+                start = time.perf_counter()
+                batch = _compute_batch(chunk)
+                stage_times['compute'] += time.perf_counter() - start
+                to_write.put(batch)
+        except Exception as e:
+            errors.append(e)
+            # Vaciar la cola para no bloquear al lector
+            while computed.get() is not _END:
+                pass
+        finally:
+            to_write.put(_END)
+
+    def write():
+        try:
+            while True:
+                batch = to_write.get()
+                if batch is _END:
+                    break
+                if errors:
+                    continue
+                start = time.perf_counter()
+                try:
+                    with get_engine().begin() as conn:
+                        written = _write_batch(conn, batch, source_name)
+                except Exception:
+                    # Los cambios de esquema de staging se deshacen con el lote
+                    clear_schema_cache()
+                    raise
+                stage_times['write'] += time.perf_counter() - start
+                total[0] += written
+                duplicates[0] += len(batch['raw']) - written
+                record_progress(rows_in=len(batch['raw']), bytes=sum(map(len, batch['raw'])))
+        except Exception as e:
+            errors.append(e)
+            while to_write.get() is not _END:
+                pass
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=target, daemon=True) for target in (reader, compute, write)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    if errors:
+        print(f"Error en el pipeline: {errors[0]}")
+        record_error(errors[0])
+        print(f"{total[0]} registros confirmados antes del error")
+        return total[0]
+
+    if fingerprint is not None:
+        if fingerprint['content_hash'] is None:
+            fingerprint['content_hash'] = content_hash(fingerprint['path'])
+        with get_engine().begin() as conn:
+            record_file(conn, fingerprint, total[0])
+
+    if total[0]:
+        refresh_rollups_after_write(['processed_data', 'final_data'])
+
+    rate = total[0] / elapsed if elapsed > 0 else 0
+    print(
+        f"{total[0]} registros nuevos procesados en {elapsed:.2f}s ({rate:,.0f} filas/s), "
+        f"{duplicates[0]} duplicados descartados; "
+        f"lectura {stage_times['read']:.2f}s, cálculo {stage_times['compute']:.2f}s, "
+        f"escritura {stage_times['write']:.2f}s"
+    )
+    return total[0]
+
+def _compute_batch(chunk):
+    """
+    Serializa, transforma y calcula métricas para un lote sin pasar por la base de datos
+
+    Transform parte del JSON de cada fila (el que se guarda en raw_data), no de
+    los valores del DataFrame, para que processed_data sea igual que si la fila
+    se transformara después desde raw_data (p. ej. NaN pasa a null).
+    """
+    raw_payloads = json_utils.dumps_rows(chunk)
+    processed = clean_and_transform_batch([json_utils.loads(payload) for payload in raw_payloads])
+    calculated = calculate_metrics_and_insights_batch(processed)
+    return {
+        'raw': raw_payloads,
+        'records': processed,
+        'processed': [json_utils.dumps(data) for data in processed],
+        'metrics': [json_utils.dumps(metrics) for metrics, _ in calculated],
+        'insights': [insights for _, insights in calculated],
+    }
+
+def _write_batch(conn, batch, source_name):
+    """
+    Reserva ids y carga las filas nuevas del lote en raw_data, processed_data y final_data con COPY
+
+    Con ETL_STAGING_ENABLED=true, las filas procesadas se escriben también en la
+    tabla de staging de la fuente, en la misma transacción.
+
+    Returns:
+        int: Número de filas nuevas cargadas (las duplicadas se descartan)
+    """
+    import pandas as pd
+
+    # COPY necesita el cursor de psycopg2, que comparte la transacción de conn
+    cursor = conn.connection.cursor()
+    lock_writes(cursor, ['raw_data', 'processed_data', 'final_data'])
+    new_rows = new_row_positions(cursor, batch['raw'], source_name)
+    if not new_rows:
+        return 0
+    positions = [position for position, _ in new_rows]
+    n = len(positions)
+    raw_ids = _reserve_ids(cursor, 'raw_data', n)
+    processed_ids = _reserve_ids(cursor, 'processed_data', n)
+    timestamp = datetime.now().isoformat()
+
+    def select(key):
+        return [batch[key][position] for position in positions]
+
+    _copy_frame(cursor, 'raw_data', pd.DataFrame({
+        'id': raw_ids, 'timestamp': timestamp, 'source': source_name, 'data': select('raw'),
+        'row_hash': [row_hash for _, row_hash in new_rows]
+    }))
+    _copy_frame(cursor, 'processed_data', pd.DataFrame({
+        'id': processed_ids, 'raw_data_id': raw_ids, 'data': select('processed')
+    }))
+    _copy_frame(cursor, 'final_data', pd.DataFrame({
+        'processed_data_id': processed_ids, 'metrics': select('metrics'), 'insights': select('insights')
+    }))
+    written = ['raw_data', 'processed_data', 'final_data']
+    if STAGING_ENABLED:
+        write_staging_rows(conn, [source_name] * n, raw_ids, select('records'))
+        written.append(staging_table_name(source_name))
+    bump_table_versions(conn, written)
+    return n
+
+def _reserve_ids(cursor, table, n):
+    """Reserva n valores de la secuencia del id de una tabla"""
+    cursor.execute(
+        "SELECT nextval(pg_get_serial_sequence(%s, 'id')) FROM generate_series(1, %s)",
+        (table, n)
+    )
+    return [row[0] for row in cursor.fetchall()]
+
+def _copy_frame(cursor, table, frame):
+    """Carga un DataFrame en una tabla con COPY FROM STDIN (columnas = columnas del DataFrame)"""
+    buffer = io.StringIO()
+    frame.to_csv(buffer, header=False, index=False)
+    buffer.seek(0)
+    cursor.copy_expert(
+        f"COPY {table} ({', '.join(frame.columns)}) FROM STDIN WITH (FORMAT csv)",
+        buffer
+    )
@@ -0,0 +1,139 @@
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+
+# Modos de perfilado disponibles
+PROFILE_MODES = ('cprofile', 'sampling')
+
+# Intervalo por defecto entre muestras del perfilador por muestreo (segundos)
+DEFAULT_SAMPLING_INTERVAL = 0.005
+
+# Funciones que se muestran en el resumen de texto
+TOP_FUNCTIONS = 40
+
+class SamplingProfiler:
+    """
+    Perfilador por muestreo basado en sys._current_frames
+
+    Un hilo toma cada `interval` segundos la pila de todos los demás hilos y
+    cuenta cuántas veces aparece cada pila. Su coste no depende del número de
+    llamadas, por lo que se puede usar en ejecuciones reales, y a diferencia de
+    cProfile también ve los hilos de escritura del ETL.
+    """
+
+    def __init__(self, interval=DEFAULT_SAMPLING_INTERVAL):
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='etl-sampling-profiler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                stack.append(names.get(thread_id, str(thread_id)))
+                self.stacks[tuple(reversed(stack))] += 1
+            self.samples += 1
+
+    def write_folded(self, path):
+        """Escribe las pilas en formato colapsado (flamegraph.pl, speedscope)"""
+        with open(path, 'w', encoding='utf-8') as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{';'.join(stack)} {count}\n")
+
+    def write_summary(self, path, top=TOP_FUNCTIONS):
+        """Escribe las funciones con más muestras, propias y acumuladas"""
+        own = Counter()
+        total = Counter()
+        for stack, count in self.stacks.items():
+            own[stack[-1]] += count
+            for function in set(stack[1:]):
+                total[function] += count
+        samples = sum(self.stacks.values()) or 1
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(f"{self.samples} muestras cada {self.interval * 1000:.1f} ms\n\n")
+            f.write("Tiempo propio:\n")
+            for function, count in own.most_common(top):
+                f.write(f"  {count / samples:7.1%}  {function}\n")
+            f.write("\nTiempo acumulado:\n")
+            for function, count in total.most_common(top):
+                f.write(f"  {count / samples:7.1%}  {function}\n")
+
+@contextmanager
+def profile_run(output_dir, mode='cprofile', interval=DEFAULT_SAMPLING_INTERVAL, name='etl'):
+    """
+    Perfila el bloque y escribe el resultado en output_dir
+
+    Con mode='cprofile' se escriben <nombre>.prof (para pstats o snakeviz) y un
+    resumen de texto ordenado por tiempo acumulado; con mode='sampling', las
+    pilas colapsadas (<nombre>.folded) y un resumen de las funciones con más
+    muestras. cProfile solo mide el hilo principal y no los procesos de
+    --workers.
+
+    Args:
+        output_dir (str): Directorio de salida
+        mode (str): 'cprofile' o 'sampling'
+        interval (float): Intervalo entre muestras en modo 'sampling'
+        name (str): Prefijo de los archivos
+
+    Yields:
+        str: Prefijo de ruta de los archivos de salida (sin extensión)
+    """
+    if mode not in PROFILE_MODES:
+        raise ValueError(f"Modo de perfilado no soportado: {mode}")
+    os.makedirs(output_dir, exist_ok=True)
+    prefix = os.path.join(output_dir, f"{name}_{datetime.now().strftime('%Y%m%d_%H%M%S')}")
+
+    if mode == 'cprofile':
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+    else:
+        profiler = SamplingProfiler(interval)
+        profiler.start()
+
+    start = time.perf_counter()
+    try:
+        yield prefix
+    finally:
+        elapsed = time.perf_counter() - start
+        if mode == 'cprofile':
+            profiler.disable()
+            _write_cprofile(profiler, prefix)
+            print(f"Perfil cProfile ({elapsed:.2f}s): {prefix}.prof, {prefix}_top.txt")
+        else:
+            profiler.stop()
+            profiler.write_folded(f"{prefix}.folded")
+            profiler.write_summary(f"{prefix}_top.txt")
+            print(f"Perfil por muestreo ({elapsed:.2f}s, {profiler.samples} muestras): "
+                  f"{prefix}.folded, {prefix}_top.txt")
+
+def _write_cprofile(profiler, prefix):
+    import pstats
+
+    profiler.dump_stats(f"{prefix}.prof")
+    with open(f"{prefix}_top.txt", 'w', encoding='utf-8') as f:
+        stats = pstats.Stats(profiler, stream=f)
+        stats.sort_stats('cumulative').print_stats(TOP_FUNCTIONS)
+        stats.sort_stats('tottime').print_stats(TOP_FUNCTIONS)
@@ -0,0 +1,315 @@
+import argparse
+import os
+from datetime import date, timedelta
+from sqlalchemy import text
+from ..utils.database import get_engine
+from ..utils.query_cache import bump_table_versions
+from .checkpoint import ensure_checkpoint_table, get_watermark, set_watermark, wait_for_writes
+from .partitions import check_migrations
+
+# Las etapas que escriben en sus tablas base los actualizan al terminar (ver
+# refresh_rollups_after_write); se puede desactivar con ETL_ROLLUPS_ENABLED=false
+ROLLUPS_ENABLED = os.getenv("ETL_ROLLUPS_ENABLED", "true").lower() in ("1", "true", "yes")
+
+# Definición de cada agregado: tabla base, columnas que necesita, columna de
+# fecha, consulta de agregación y DDL de su tabla. {where} se sustituye por el
+# filtro de días; el filtro es un rango sobre la columna de fecha para poder
+# usar sus índices. Las filas con la columna de fecha nula no se agregan (dia
+# es NOT NULL).
+#
+# Los agregados guardan sumas y conteos (no promedios) para que los dashboards
+# obtengan exactamente los mismos valores que al agregar las tablas base:
+# AVG(x) = suma / conteo de valores no nulos. La tabla de cada agregado solo se
+# crea si su tabla base tiene las columnas necesarias (ver available_rollups).
+ROLLUPS = {
+    'rollup_categoria_diaria': {
+        'source': 'processed_data',
+        'required_columns': ['category', 'processed_value', 'processed_date'],
+        'date_column': 'processed_date',
+        'day_expression': "DATE_TRUNC('day', processed_date)",
+        'aggregate': """
+            SELECT DATE_TRUNC('day', processed_date), category, COUNT(id),
+                   SUM(processed_value), COUNT(processed_value),
+                   MIN(processed_value), MAX(processed_value)
+            FROM processed_data
+            {where}
+            GROUP BY category, DATE_TRUNC('day', processed_date)
+        """,
+        'ddl': [
+            """
+            CREATE TABLE IF NOT EXISTS rollup_categoria_diaria (
+                dia TIMESTAMP NOT NULL,
+                category VARCHAR(50),
+                total_registros BIGINT NOT NULL,
+                valor_total NUMERIC,
+                valores_no_nulos BIGINT NOT NULL,
+                valor_minimo NUMERIC,
+                valor_maximo NUMERIC
+            )
+            """,
+            "CREATE INDEX IF NOT EXISTS idx_rollup_categoria_diaria_dia ON rollup_categoria_diaria(dia)",
+        ],
+    },
+    'rollup_metricas_diaria': {
+        'source': 'final_data',
+        'required_columns': ['metric_name', 'metric_value', 'dimension1', 'dimension2', 'report_date'],
+        'date_column': 'report_date',
+        'day_expression': "DATE_TRUNC('day', report_date)",
+        'aggregate': """
+            SELECT DATE_TRUNC('day', report_date), metric_name, dimension1, dimension2,
+                   SUM(metric_value), COUNT(metric_value), COUNT(*)
+            FROM final_data
+            {where}
+            GROUP BY metric_name, dimension1, dimension2, DATE_TRUNC('day', report_date)
+        """,
+        'ddl': [
+            """
+            CREATE TABLE IF NOT EXISTS rollup_metricas_diaria (
+                dia TIMESTAMP NOT NULL,
+                metric_name VARCHAR(50),
+                dimension1 VARCHAR(50),
+                dimension2 VARCHAR(50),
+                valor_total NUMERIC,
+                valores_no_nulos BIGINT NOT NULL,
+                total_registros BIGINT NOT NULL
+            )
+            """,
+            "CREATE INDEX IF NOT EXISTS idx_rollup_metricas_diaria_dia ON rollup_metricas_diaria(dia)",
+        ],
+    },
+    'rollup_etl_diaria': {
+        'source': 'etl_metrics',
+        'required_columns': ['process_name', 'execution_date', 'rows_per_second', 'peak_memory_mb'],
+        'date_column': 'execution_date',
+        'day_expression': "execution_date",
+        'aggregate': """
+            SELECT execution_date, process_name, COUNT(*),
+                   SUM(EXTRACT(EPOCH FROM (end_time - start_time))), SUM(records_processed),
+                   SUM(rows_per_second), COUNT(rows_per_second), MAX(peak_memory_mb),
+                   SUM(CASE WHEN success = true THEN 1 ELSE 0 END),
+                   SUM(CASE WHEN success = false THEN 1 ELSE 0 END)
+            FROM etl_metrics
+            {where}
+            GROUP BY process_name, execution_date
+        """,
+        'ddl': [
+            """
+            CREATE TABLE IF NOT EXISTS rollup_etl_diaria (
+                dia DATE NOT NULL,
+                process_name VARCHAR(50),
+                ejecuciones BIGINT NOT NULL,
+                duracion_total DOUBLE PRECISION,
+                registros_procesados BIGINT,
+                filas_por_segundo_total DOUBLE PRECISION,
+                filas_por_segundo_n BIGINT NOT NULL,
+                memoria_pico_mb DOUBLE PRECISION,
+                ejecuciones_exitosas BIGINT NOT NULL,
+                ejecuciones_fallidas BIGINT NOT NULL
+            )
+            """,
+            "CREATE INDEX IF NOT EXISTS idx_rollup_etl_diaria_dia ON rollup_etl_diaria(dia)",
+        ],
+    },
+}
+
+def ensure_rollup_tables(conn, names):
+    """Crea las tablas de los agregados indicados si no existen"""
+    for name in names:
+        for statement in ROLLUPS[name]['ddl']:
+            conn.execute(text(statement))
+
+def available_rollups(conn):
+    """
+    Devuelve los agregados cuyas tablas base tienen las columnas necesarias
+
+    Las columnas de processed_data y final_data que usan los agregados de los
+    dashboards (category, metric_name, ...) son las que crea
+    metabase/scripts/cargar_datos_ejemplo.py; en una base con solo el esquema
+    del ETL (sql/schema.sql) esos agregados se omiten y sus tablas no se crean.
+    """
+    rows = conn.execute(text("""
+        SELECT table_name, column_name FROM information_schema.columns
+        WHERE table_schema = current_schema() AND table_name = ANY(:tables)
+    """), {"tables": sorted({spec['source'] for spec in ROLLUPS.values()})}).fetchall()
+    columns = {(table, column) for table, column in rows}
+    return [
+        name for name, spec in ROLLUPS.items()
+        if all((spec['source'], column) in columns for column in spec['required_columns'])
+    ]
+
+def rebuild_days(conn, name, days):
+    """
+    Recalcula los días indicados de un agregado a partir de su tabla base
+
+    Args:
+        conn: Conexión activa de SQLAlchemy
+        name (str): Nombre de la tabla de agregados
+        days (list): Días (date o datetime truncado al día) a recalcular
+
+    Returns:
+        int: Número de filas escritas en el agregado
+    """
+    spec = ROLLUPS[name]
+    where = f"WHERE {spec['date_column']} >= :dia AND {spec['date_column']} < :dia + INTERVAL '1 day'"
+    insert = text(f"INSERT INTO {name} {spec['aggregate'].format(where=where)}")
+    written = 0
+    for day in sorted(days):
+        conn.execute(text(f"DELETE FROM {name} WHERE dia = :dia"), {"dia": day})
+        written += conn.execute(insert, {"dia": day}).rowcount
+    if days:
+        bump_table_versions(conn, [name])
+    return written
+
+def rebuild_rollup(conn, name, since=None, until=None):
+    """
+    Reconstruye un agregado completo o un rango de días [since, until]
+
+    Args:
+        conn: Conexión activa de SQLAlchemy
+        name (str): Nombre de la tabla de agregados
+        since (date, optional): Primer día a reconstruir
+        until (date, optional): Último día a reconstruir
+
+    Returns:
+        int: Número de filas escritas en el agregado
+    """
+    spec = ROLLUPS[name]
+    if since is None and until is None:
+        conn.execute(text(f"DELETE FROM {name}"))
+        bump_table_versions(conn, [name])
+        # Las filas sin fecha no pertenecen a ningún día: se excluyen igual que
+        # en refresh_rollups, que solo recalcula días concretos
+        where = f"WHERE {spec['date_column']} IS NOT NULL"
+        return conn.execute(text(f"INSERT INTO {name} {spec['aggregate'].format(where=where)}")).rowcount
+
+    bounds = conn.execute(text(
+        f"SELECT MIN({spec['day_expression']})::date, MAX({spec['day_expression']})::date FROM {spec['source']}"
+    )).fetchone()
+    since = since or bounds[0]
+    until = until or bounds[1]
+    if since is None or until is None:
+        return 0
+    return rebuild_days(conn, name, [since + timedelta(days=i) for i in range((until - since).days + 1)])
+
+def refresh_rollups(names=None, sources=None):
+    """
+    Actualiza de forma incremental los agregados diarios
+
+    Cada agregado guarda en etl_checkpoints el último id de su tabla base que ya
+    tiene en cuenta. Solo se recalculan los días de las filas nuevas (id mayor
+    que la marca, leídas sin escrituras en curso en la tabla base; ver
+    checkpoint.wait_for_writes), y cada día se recalcula completo desde la tabla base, por lo
+    que el resultado coincide con el de agregar las tablas base. Las filas
+    modificadas o borradas después de agregarse solo se reflejan con
+    rebuild_rollup.
+
+    Args:
+        names (list, optional): Agregados a actualizar. Por defecto, todos los disponibles.
+        sources (list, optional): Si se indica, solo se actualizan los agregados
+            de estas tablas base
+
+    Returns:
+        dict: Número de días recalculados por agregado
+    """
+    refreshed = {}
+    with get_engine().begin() as conn:
+        ensure_checkpoint_table(conn)
+        names = names or available_rollups(conn)
+        if sources is not None:
+            names = [name for name in names if ROLLUPS[name]['source'] in sources]
+        ensure_rollup_tables(conn, names)
+
+    for name in names:
+        spec = ROLLUPS[name]
+        stage = f"rollup:{name}"
+        # Una transacción por agregado: días recalculados y marca se confirman juntos
+        with get_engine().begin() as conn:
+            check_migrations(conn, stage, [spec['source']])
+            wait_for_writes(conn, spec['source'])
+            last_id = get_watermark(conn, stage)
+            max_id = conn.execute(
+                text(f"SELECT MAX(id) FROM {spec['source']} WHERE id > :last_id"),
+                {"last_id": last_id}
+            ).scalar()
+            if max_id is None:
+                refreshed[name] = 0
+                continue
+            days = [row[0] for row in conn.execute(
+                text(f"""
+                    SELECT DISTINCT {spec['day_expression']} FROM {spec['source']}
+                    WHERE id > :last_id AND id <= :max_id
+                """),
+                {"last_id": last_id, "max_id": max_id}
+            )]
+            rebuild_days(conn, name, [day for day in days if day is not None])
+            set_watermark(conn, stage, max_id)
+            refreshed[name] = len(days)
+    return refreshed
+
+def refresh_rollups_after_write(tables):
+    """
+    Actualiza los agregados de las tablas base que acaba de escribir una etapa
+
+    Lo llaman transform, load, el pipeline y el runner (para etl_metrics) al
+    terminar. No hace nada con ETL_ROLLUPS_ENABLED=false, y un error no se
+    propaga: los datos ya están confirmados y los agregados se ponen al día en
+    el siguiente refresco (o con rollups.py).
+
+    Args:
+        tables (list): Tablas base escritas
+    """
+    if not ROLLUPS_ENABLED:
+        return
+    try:
+        refresh_rollups(sources=tables)
+    except Exception as e:
+        print(f"Error al actualizar los agregados diarios: {e}")
+
+def backfill_rollups(names=None, since=None, until=None):
+    """
+    Reconstruye los agregados y reinicia sus marcas de agua
+
+    Args:
+        names (list, optional): Agregados a reconstruir. Por defecto, todos los disponibles.
+        since (date, optional): Primer día a reconstruir (por defecto, todo el histórico)
+        until (date, optional): Último día a reconstruir
+
+    Returns:
+        dict: Número de filas escritas por agregado
+    """
+    written = {}
+    with get_engine().begin() as conn:
+        ensure_checkpoint_table(conn)
+        names = names or available_rollups(conn)
+        ensure_rollup_tables(conn, names)
+
+    for name in names:
+        spec = ROLLUPS[name]
+        with get_engine().begin() as conn:
+            check_migrations(conn, f"rollup:{name}", [spec['source']])
+            wait_for_writes(conn, spec['source'])
+            # La marca se toma antes de reconstruir: las filas que lleguen
+            # durante la reconstrucción se recalcularán en el siguiente refresco
+            max_id = conn.execute(text(f"SELECT COALESCE(MAX(id), 0) FROM {spec['source']}")).scalar()
+            written[name] = rebuild_rollup(conn, name, since, until)
+            if since is None and until is None:
+                set_watermark(conn, f"rollup:{name}", max_id)
+        print(f"{name}: {written[name]} filas reconstruidas")
+    return written
+
+def main():
+    parser = argparse.ArgumentParser(description='Actualiza o reconstruye los agregados diarios de los dashboards')
+    parser.add_argument('--rebuild', action='store_true', help='Reconstruir desde las tablas base en lugar de actualizar de forma incremental')
+    parser.add_argument('--desde', type=date.fromisoformat, help='Primer día a reconstruir (AAAA-MM-DD)')
+    parser.add_argument('--hasta', type=date.fromisoformat, help='Último día a reconstruir (AAAA-MM-DD)')
+    parser.add_argument('--rollup', action='append', choices=list(ROLLUPS), help='Agregado a procesar (se puede repetir)')
+    args = parser.parse_args()
+
+    if args.rebuild or args.desde or args.hasta:
+        backfill_rollups(args.rollup, args.desde, args.hasta)
+    else:
+        for name, days in refresh_rollups(args.rollup).items():
+            print(f"{name}: {days} días recalculados")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,290 @@
+import argparse
+import json
+import sys
+from datetime import date
+from sqlalchemy import text
+from ..utils.database import get_engine
+from .checkpoint import (DEFAULT_BATCH_SIZE, ensure_checkpoint_table, ensure_dead_letter_table, get_watermark,
+                         set_watermark)
+from .chunks import STORAGE_MODES, has_chunk_table
+from .export import export_to_parquet
+from .extract import DEFAULT_CHUNK_SIZE, extract_from_api, extract_from_csv, extract_from_directory
+from .instrumentation import flush_metrics, record_error, track_stage
+from .load import load_to_final_table
+from .partitions import maintain_partitions
+from .profiling import DEFAULT_SAMPLING_INTERVAL, PROFILE_MODES, profile_run
+from .rollups import backfill_rollups, refresh_rollups, refresh_rollups_after_write
+from .transform import transform_raw_data
+
+# Modos de ejecución
+MODES = ('full', 'incremental', 'stage', 'backfill')
+
+# Etapas en orden de ejecución
+STAGES = ('extract', 'transform', 'load', 'export', 'rollups')
+
+# Etapas de cada modo; 'stage' ejecuta solo las indicadas con --etapa
+MODE_STAGES = {
+    'full': STAGES,
+    'incremental': ('extract', 'transform', 'load'),
+    'backfill': ('transform', 'load', 'rollups'),
+}
+
+# Marca de agua de transform y load justo antes de los datos de una fecha
+BACKFILL_WATERMARKS = {
+    'transform': "SELECT MIN(id) - 1 FROM raw_data WHERE timestamp >= :since",
+    'load': """
+        SELECT MIN(p.id) - 1 FROM processed_data p
+        JOIN raw_data r ON r.id = p.raw_data_id
+        WHERE r.timestamp >= :since
+    """,
+}
+
+# Registros en cuarentena que ya tienen resultado en la etapa siguiente
+RELEASE_PROCESSED_DEAD_LETTERS = {
+    'transform': """
+        DELETE FROM etl_dead_letters d WHERE d.stage = 'transform'
+          AND EXISTS (SELECT 1 FROM processed_data p WHERE p.raw_data_id = d.record_id)
+    """,
+    'load': """
+        DELETE FROM etl_dead_letters d WHERE d.stage = 'load'
+          AND EXISTS (SELECT 1 FROM final_data f WHERE f.processed_data_id = d.record_id)
+    """,
+}
+
+# Variantes que tienen en cuenta los CSV guardados por bloques; solo se usan
+# si existe raw_data_chunks (ver chunks.py)
+CHUNK_BACKFILL_WATERMARKS = {
+    'transform_chunks': "SELECT MIN(id) - 1 FROM raw_data_chunks WHERE timestamp >= :since",
+    'load': """
+        SELECT MIN(p.id) - 1 FROM processed_data p
+        LEFT JOIN raw_data r ON r.id = p.raw_data_id
+        LEFT JOIN raw_data_chunks c ON c.id = p.raw_chunk_id
+        WHERE COALESCE(r.timestamp, c.timestamp) >= :since
+    """,
+}
+
+CHUNK_RELEASE_PROCESSED_DEAD_LETTERS = {
+    'transform': """
+        DELETE FROM etl_dead_letters d WHERE d.stage = 'transform'
+          AND EXISTS (SELECT 1 FROM processed_data p
+                      WHERE p.raw_data_id = d.record_id OR p.chunk_row_id = d.record_id)
+    """,
+}
+
+def run(mode, stages=None, csv_files=None, directory=None, pattern='*.csv', source_name='csv',
+        api_urls=None, api_source='api', since=None, until=None, batch_size=DEFAULT_BATCH_SIZE,
+        workers=1, memory_limit_mb=None, chunksize=DEFAULT_CHUNK_SIZE, storage=None):
+    """
+    Ejecuta las etapas del ETL según el modo
+
+    Modos:
+        - 'incremental': extrae los archivos nuevos (manifiesto de ingesta) y
+          transforma y carga los registros pendientes desde las marcas de agua.
+          Si no hay nada pendiente termina sin tocar pandas ni NumPy.
+        - 'full': como 'incremental', pero vuelve a leer los archivos indicados
+          (las filas ya presentes se descartan por su hash), exporta a Parquet y
+          reconstruye los agregados diarios completos.
+        - 'stage': solo las etapas de `stages`, con la semántica incremental.
+        - 'backfill': retrocede las marcas de agua de transform y load hasta
+          `since`, de modo que se procesan los registros de ese periodo que
+          falten (incluidos los que estaban en cuarentena), y reconstruye los
+          agregados de [since, until]. Los registros ya procesados no se duplican.
+
+    Antes de las etapas se crean las particiones futuras de las tablas
+    particionadas y se aplica la retención configurada (ver partitions.py).
+
+    Args:
+        mode (str): Uno de MODES
+        stages (list, optional): Etapas a ejecutar en modo 'stage'
+        csv_files (list, optional): Archivos CSV a extraer
+        directory (str, optional): Directorio del que extraer los CSV nuevos o modificados
+        pattern (str): Patrón de los archivos del directorio
+        source_name (str): Fuente de los CSV
+        api_urls (list, optional): URLs de API a extraer
+        api_source (str): Fuente de las respuestas de la API
+        since (date, optional): Primer día del backfill
+        until (date, optional): Último día del backfill
+        batch_size (int): Registros por lote confirmado en transform, load y export
+        workers (int): Procesos para transform
+        memory_limit_mb (float, optional): Si se indica, transform y load leen en modo
+            streaming con este techo de memoria residente
+        chunksize (int): Filas por bloque al leer los CSV
+        storage (str, optional): Almacenamiento de los CSV, 'rows' o 'chunks' (por defecto ETL_RAW_STORAGE)
+
+    Returns:
+        list: Resumen de cada etapa (dict con stage, rows, seconds, rows_per_second,
+        peak_memory_mb y error)
+    """
+    if mode == 'stage':
+        stages = [stage for stage in STAGES if stage in (stages or [])]
+        if not stages:
+            raise ValueError("El modo 'stage' necesita al menos una etapa (--etapa)")
+    else:
+        stages = MODE_STAGES[mode]
+    if mode == 'backfill':
+        if since is None:
+            raise ValueError("El modo 'backfill' necesita una fecha de inicio (--desde)")
+        rewind_watermarks(since)
+    maintain_partitions()
+
+    streaming = memory_limit_mb is not None
+    summary = []
+    for stage in stages:
+        if stage == 'extract':
+            if not (csv_files or directory or api_urls):
+                if mode == 'stage':
+                    print("No se indicaron archivos, directorio ni API: se omite extract")
+                continue
+            function = lambda: _extract(csv_files, directory, pattern, source_name, api_urls, api_source,
+                                        chunksize, force=(mode == 'full'), storage=storage)
+        elif stage == 'transform':
+            function = lambda: transform_raw_data(batch_size=batch_size, streaming=streaming,
+                                                  memory_limit_mb=memory_limit_mb, workers=workers)
+        elif stage == 'load':
+            function = lambda: load_to_final_table(batch_size=batch_size, streaming=streaming,
+                                                   memory_limit_mb=memory_limit_mb)
+        elif stage == 'export':
+            function = lambda: export_to_parquet(batch_size=batch_size)
+        else:
+            function = lambda: _rollups(mode, since, until)
+        summary.append(run_stage(stage, function))
+
+    if mode == 'backfill':
+        release_processed_dead_letters()
+    return summary
+
+def run_stage(stage, function):
+    """
+    Ejecuta una etapa y devuelve su resumen
+
+    La etapa se registra en etl_metrics con track_stage; las funciones
+    instrumentadas de la etapa se suman a esa ejecución, y los errores que
+    registran con record_error quedan en el resumen.
+    """
+    print(f"\n=== {stage} ===")
+    with track_stage(stage) as stage_run:
+        rows = function()
+        stage_run.rows_out = rows
+    return {
+        'stage': stage,
+        'rows': rows,
+        'seconds': round(stage_run.elapsed, 3),
+        'rows_per_second': round(rows / stage_run.elapsed, 1) if stage_run.elapsed else None,
+        'peak_memory_mb': round(stage_run.peak_memory_mb, 1),
+        'error': stage_run.error,
+    }
+
+def _extract(csv_files, directory, pattern, source_name, api_urls, api_source, chunksize, force, storage=None):
+    """Extrae los CSV, el directorio y las API indicados; devuelve los registros nuevos"""
+    total = 0
+    for path in csv_files or []:
+        total += extract_from_csv(path, source_name, chunksize=chunksize, force=force, storage=storage)
+    if directory:
+        total += extract_from_directory(directory, source_name, pattern, chunksize=chunksize, storage=storage)
+    for url in api_urls or []:
+        total += extract_from_api(url, source_name=api_source)
+    return total
+
+def _rollups(mode, since, until):
+    """Actualiza los agregados diarios (los reconstruye en full y backfill); devuelve los días o filas"""
+    try:
+        if mode == 'full':
+            return sum(backfill_rollups().values())
+        if mode == 'backfill':
+            return sum(backfill_rollups(since=since, until=until).values())
+        return sum(refresh_rollups().values())
+    except Exception as e:
+        print(f"Error al actualizar los agregados diarios: {e}")
+        record_error(e)
+        return 0
+
+def rewind_watermarks(since):
+    """Retrocede las marcas de agua de transform y load hasta los datos de la fecha since (nunca las adelanta)"""
+    with get_engine().begin() as conn:
+        ensure_checkpoint_table(conn)
+        queries = dict(BACKFILL_WATERMARKS)
+        if has_chunk_table(conn):
+            queries.update(CHUNK_BACKFILL_WATERMARKS)
+        for stage, query in queries.items():
+            current = get_watermark(conn, stage)
+            target = conn.execute(text(query), {"since": since}).scalar()
+            if target is not None and target < current:
+                set_watermark(conn, stage, target)
+                print(f"Marca de agua de {stage}: {current} -> {target}")
+
+def release_processed_dead_letters():
+    """Quita de la cuarentena los registros que el backfill ha podido procesar"""
+    with get_engine().begin() as conn:
+        ensure_dead_letter_table(conn)
+        queries = dict(RELEASE_PROCESSED_DEAD_LETTERS)
+        if has_chunk_table(conn):
+            queries.update(CHUNK_RELEASE_PROCESSED_DEAD_LETTERS)
+        for stage, query in queries.items():
+            released = conn.execute(text(query)).rowcount
+            if released:
+                print(f"{released} registros de {stage} procesados y retirados de la cuarentena")
+
+def print_summary(summary):
+    """Imprime la tabla de tiempos por etapa"""
+    print(f"\n{'Etapa':<10} {'Registros':>10} {'Segundos':>9} {'Filas/s':>10} {'Memoria MB':>11}  Estado")
+    for entry in summary:
+        rate = f"{entry['rows_per_second']:,.0f}" if entry['rows_per_second'] is not None else '-'
+        status = f"error: {entry['error']}" if entry['error'] else 'ok'
+        print(f"{entry['stage']:<10} {entry['rows']:>10} {entry['seconds']:>9.2f} {rate:>10} "
+              f"{entry['peak_memory_mb']:>11.0f}  {status}")
+    print(f"{'Total':<10} {sum(entry['rows'] for entry in summary):>10} "
+          f"{sum(entry['seconds'] for entry in summary):>9.2f}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m src.etl', description='Ejecuta el ETL')
+    parser.add_argument('modo', choices=MODES, help='Modo de ejecución')
+    parser.add_argument('--etapa', action='append', choices=STAGES, help="Etapa a ejecutar en modo 'stage' (se puede repetir)")
+    parser.add_argument('--csv', action='append', help='Archivo CSV a extraer (se puede repetir)')
+    parser.add_argument('--directorio', default=None, help='Directorio del que extraer los CSV nuevos o modificados')
+    parser.add_argument('--patron', default='*.csv', help='Patrón de los archivos del directorio')
+    parser.add_argument('--fuente', default='csv', help='Nombre de la fuente de los CSV')
+    parser.add_argument('--api', action='append', help='URL de API a extraer (se puede repetir)')
+    parser.add_argument('--api-fuente', default='api', help='Nombre de la fuente de la API')
+    parser.add_argument('--desde', type=date.fromisoformat, help='Primer día del backfill (AAAA-MM-DD)')
+    parser.add_argument('--hasta', type=date.fromisoformat, help='Último día del backfill (AAAA-MM-DD)')
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, help='Registros por lote confirmado')
+    parser.add_argument('--workers', type=int, default=1, help='Procesos para transform')
+    parser.add_argument('--memory-limit', type=float, default=None,
+                        help='Techo de memoria residente en MB (activa la lectura en streaming)')
+    parser.add_argument('--chunksize', type=int, default=DEFAULT_CHUNK_SIZE, help='Filas por bloque al leer los CSV')
+    parser.add_argument('--almacenamiento', choices=STORAGE_MODES, default=None,
+                        help='Guardar los CSV por fila (rows) o por bloques comprimidos (chunks)')
+    parser.add_argument('--profile', metavar='DIRECTORIO', default=None,
+                        help='Perfilar la ejecución y escribir el perfil y los tiempos por etapa en DIRECTORIO')
+    parser.add_argument('--profile-mode', choices=PROFILE_MODES, default='cprofile', help='Perfilador a usar')
+    parser.add_argument('--sampling-interval', type=float, default=DEFAULT_SAMPLING_INTERVAL,
+                        help='Segundos entre muestras del perfilador por muestreo')
+    args = parser.parse_args(argv)
+
+    options = dict(
+        stages=args.etapa, csv_files=args.csv, directory=args.directorio, pattern=args.patron,
+        source_name=args.fuente, api_urls=args.api, api_source=args.api_fuente, since=args.desde,
+        until=args.hasta, batch_size=args.batch_size, workers=args.workers,
+        memory_limit_mb=args.memory_limit, chunksize=args.chunksize, storage=args.almacenamiento,
+    )
+    try:
+        if args.profile:
+            with profile_run(args.profile, args.profile_mode, args.sampling_interval, f"etl_{args.modo}") as prefix:
+                summary = run(args.modo, **options)
+            with open(f"{prefix}_stages.json", 'w', encoding='utf-8') as f:
+                json.dump({'mode': args.modo, 'options': vars(args), 'stages': summary}, f, indent=2, default=str)
+        else:
+            summary = run(args.modo, **options)
+    except ValueError as e:
+        parser.error(str(e))
+    finally:
+        flush_metrics()
+
+    # Las métricas de esta ejecución ya están en etl_metrics
+    refresh_rollups_after_write(['etl_metrics'])
+    print_summary(summary)
+    if any(entry['error'] for entry in summary):
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
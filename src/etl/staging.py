@@ -0,0 +1,262 @@
+import os
+import re
+import threading
+from sqlalchemy import text
+from . import json_utils
+from .chunks import has_chunk_table
+from .partitions import is_partitioned
+
+# Con ETL_STAGING_ENABLED=true, transform escribe además cada registro en una
+# tabla con columnas tipadas por fuente (staging_<source>)
+STAGING_ENABLED = os.getenv("ETL_STAGING_ENABLED", "false").lower() in ("1", "true", "yes")
+
+# Registros de la muestra usada para crear la tabla de una fuente nueva
+SAMPLE_SIZE = 1000
+
+# Columnas propias de las tablas de staging
+RESERVED_COLUMNS = ('raw_data_id', 'processed_at')
+
+# Tipos de PostgreSQL por tipo de valor (en orden: bool es subclase de int);
+# los valores None no aportan tipo y los de NumPy se convierten antes a tipos nativos
+PG_TYPES = [
+    (bool, 'BOOLEAN'),
+    (int, 'BIGINT'),
+    (float, 'DOUBLE PRECISION'),
+    (str, 'TEXT'),
+    ((dict, list), 'JSONB'),
+]
+
+# Nombres de information_schema.columns.data_type
+INFORMATION_SCHEMA_TYPES = {
+    'boolean': 'BOOLEAN',
+    'bigint': 'BIGINT',
+    'integer': 'BIGINT',
+    'double precision': 'DOUBLE PRECISION',
+    'numeric': 'DOUBLE PRECISION',
+    'text': 'TEXT',
+    'character varying': 'TEXT',
+    'jsonb': 'JSONB',
+}
+
+# Esquema conocido de cada tabla de staging: {tabla: {columna: (tipo, nullable)}}
+_schema_cache = {}
+_schema_lock = threading.Lock()
+
+def pg_type_of(value):
+    """Tipo de PostgreSQL de un valor (TEXT si no tiene uno propio)"""
+    value = json_utils.numpy_to_python(value)
+    for python_types, pg_type in PG_TYPES:
+        if isinstance(value, python_types):
+            return pg_type
+    return 'TEXT'
+
+def merge_types(current, new):
+    """
+    Combina dos tipos de columna en el más general que admite ambos
+
+    BIGINT y DOUBLE PRECISION se combinan en DOUBLE PRECISION; cualquier otra
+    combinación distinta se guarda como TEXT.
+    """
+    if current is None or current == new:
+        return new
+    if new is None:
+        return current
+    if {current, new} == {'BIGINT', 'DOUBLE PRECISION'}:
+        return 'DOUBLE PRECISION'
+    return 'TEXT'
+
+def column_name(key):
+    """Convierte una clave del JSON en un nombre de columna válido"""
+    name = re.sub(r'[^a-z0-9_]', '_', str(key).lower())[:60] or '_'
+    if name[0].isdigit():
+        name = f"c_{name}"
+    if name in RESERVED_COLUMNS:
+        name = f"{name}_"
+    return name
+
+def staging_table_name(source):
+    """Nombre de la tabla de staging de una fuente"""
+    return f"staging_{column_name(source)}"[:63]
+
+def infer_schema(records, sample_size=None):
+    """
+    Infiere columnas, tipos y nulabilidad a partir de una muestra de registros
+
+    Args:
+        records (list): Registros como diccionarios
+        sample_size (int, optional): Número de registros a examinar (por defecto, todos)
+
+    Returns:
+        dict: {columna: (tipo, nullable)}; las columnas sin ningún valor no nulo
+        se omiten hasta que llegue un valor del que inferir el tipo
+    """
+    sample = records[:sample_size] if sample_size else records
+    types = {}
+    non_null = {}
+    for record in sample:
+        for key, value in record.items():
+            name = column_name(key)
+            value = json_utils.numpy_to_python(value)
+            if value is None:
+                types.setdefault(name, None)
+                continue
+            types[name] = merge_types(types.get(name), pg_type_of(value))
+            non_null[name] = non_null.get(name, 0) + 1
+    return {
+        name: (pg_type, non_null[name] < len(sample))
+        for name, pg_type in types.items()
+        if pg_type is not None
+    }
+
+def write_staging_rows(conn, sources, raw_ids, records):
+    """
+    Escribe registros transformados en las tablas de staging de sus fuentes
+
+    La tabla de cada fuente se crea con el esquema inferido de la primera
+    muestra. Si un lote trae columnas nuevas se añaden con ALTER TABLE ADD
+    COLUMN; si trae valores de otro tipo, la columna se amplía (BIGINT a DOUBLE
+    PRECISION, o a TEXT), y si trae nulos en una columna NOT NULL se quita la
+    restricción. Así la deriva de esquema no hace fallar el lote.
+
+    Args:
+        conn: Conexión activa de SQLAlchemy
+        sources (list): Fuente de cada registro
+        raw_ids (list): Id de raw_data de cada registro
+        records (list): Registros transformados (diccionarios)
+
+    Returns:
+        int: Número de registros escritos
+    """
+    by_source = {}
+    for source, raw_id, record in zip(sources, raw_ids, records):
+        by_source.setdefault(source, ([], []))
+        by_source[source][0].append(raw_id)
+        by_source[source][1].append(record)
+
+    written = 0
+    for source, (ids, source_records) in by_source.items():
+        table = staging_table_name(source)
+        schema = ensure_staging_table(conn, table, source_records)
+        columns = list(schema)
+        rows = []
+        for raw_id, record in zip(ids, source_records):
+            row = {'raw_data_id': raw_id}
+            values = {column_name(key): value for key, value in record.items()}
+            for index, column in enumerate(columns):
+                row[f"p{index}"] = _coerce(values.get(column), schema[column][0])
+            rows.append(row)
+
+        placeholders = ', '.join(f":p{index}" for index in range(len(columns)))
+        column_list = ', '.join(f'"{column}"' for column in columns)
+        conn.execute(
+            text(f"""
+                INSERT INTO {table} (raw_data_id{', ' + column_list if columns else ''})
+                VALUES (:raw_data_id{', ' + placeholders if columns else ''})
+                ON CONFLICT (raw_data_id) DO NOTHING
+            """),
+            rows
+        )
+        written += len(rows)
+    return written
+
+def ensure_staging_table(conn, table, records):
+    """
+    Crea o adapta la tabla de staging para que admita un lote de registros
+
+    Returns:
+        dict: Esquema de la tabla tras aplicar los cambios
+    """
+    with _schema_lock:
+        known = _schema_cache.get(table)
+    if known is not None and not _schema_changes(known, infer_schema(records)):
+        return known
+
+    # Los cambios de esquema se serializan entre procesos con un bloqueo por tabla
+    conn.execute(text("SELECT pg_advisory_xact_lock(hashtext(:table))"), {"table": table})
+    existing = _read_table_schema(conn, table)
+    if existing is None:
+        existing = infer_schema(records, SAMPLE_SIZE)
+        definitions = ''.join(
+            f',\n    "{column}" {pg_type}{"" if nullable else " NOT NULL"}'
+            for column, (pg_type, nullable) in existing.items()
+        )
+        # Con raw_data particionada no hay un índice único solo sobre id al que
+        # referenciar, y las filas de raw_data_chunks no tienen fila en raw_data
+        reference = ('' if is_partitioned(conn, 'raw_data') or has_chunk_table(conn)
+                     else ' REFERENCES raw_data(id)')
+        conn.execute(text(f"""
+            CREATE TABLE IF NOT EXISTS {table} (
+                raw_data_id INTEGER PRIMARY KEY{reference},
+                processed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP{definitions}
+            )
+        """))
+        print(f"Tabla de staging {table} creada con {len(existing)} columnas")
+
+    # El resto del lote puede diferir de la muestra o del esquema existente
+    schema = dict(existing)
+    for column, change in _schema_changes(existing, infer_schema(records)).items():
+        if change[0] == 'add':
+            conn.execute(text(f'ALTER TABLE {table} ADD COLUMN IF NOT EXISTS "{column}" {change[1]}'))
+            schema[column] = (change[1], True)
+            print(f"Deriva de esquema en {table}: columna nueva {column} ({change[1]})")
+        elif change[0] == 'type':
+            conn.execute(text(f'ALTER TABLE {table} ALTER COLUMN "{column}" TYPE {change[1]} USING "{column}"::{change[1]}'))
+            schema[column] = (change[1], schema[column][1])
+            print(f"Deriva de esquema en {table}: {column} pasa a {change[1]}")
+        elif change[0] == 'nullable':
+            conn.execute(text(f'ALTER TABLE {table} ALTER COLUMN "{column}" DROP NOT NULL'))
+            schema[column] = (schema[column][0], True)
+
+    with _schema_lock:
+        _schema_cache[table] = schema
+    return schema
+
+def clear_schema_cache():
+    """Olvida los esquemas conocidos (p. ej. tras deshacer una transacción con cambios de esquema)"""
+    with _schema_lock:
+        _schema_cache.clear()
+
+def _schema_changes(existing, inferred):
+    """Cambios necesarios para que una tabla con esquema existing admita el esquema inferred"""
+    changes = {}
+    for column, (pg_type, nullable) in inferred.items():
+        if column not in existing:
+            changes[column] = ('add', pg_type)
+            continue
+        current_type, current_nullable = existing[column]
+        merged = merge_types(current_type, pg_type)
+        if merged != current_type:
+            changes[column] = ('type', merged)
+        elif nullable and not current_nullable:
+            changes[column] = ('nullable', None)
+    # Las columnas que faltan en el lote se insertan como NULL
+    for column, (_, current_nullable) in existing.items():
+        if column not in inferred and not current_nullable:
+            changes[column] = ('nullable', None)
+    return changes
+
+def _read_table_schema(conn, table):
+    """Lee el esquema de una tabla de staging desde information_schema (None si no existe)"""
+    rows = conn.execute(text("""
+        SELECT column_name, data_type, is_nullable FROM information_schema.columns
+        WHERE table_schema = current_schema() AND table_name = :table
+        ORDER BY ordinal_position
+    """), {"table": table}).fetchall()
+    if not rows:
+        return None
+    return {
+        name: (INFORMATION_SCHEMA_TYPES.get(data_type, 'TEXT'), is_nullable == 'YES')
+        for name, data_type, is_nullable in rows
+        if name not in RESERVED_COLUMNS
+    }
+
+def _coerce(value, pg_type):
+    """Adapta un valor al tipo de su columna"""
+    value = json_utils.numpy_to_python(value)
+    if value is None:
+        return None
+    if pg_type == 'JSONB' or (pg_type == 'TEXT' and not isinstance(value, str)):
+        return json_utils.dumps(value)
+    if pg_type == 'DOUBLE PRECISION':
+        return float(value)
+    return value
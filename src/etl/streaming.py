@@ -0,0 +1,87 @@
+import os
+import resource
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from ..utils.database import get_engine
+from .checkpoint import (DEFAULT_BATCH_SIZE, WATERMARK_TABLES, ensure_checkpoint_table, ensure_dead_letter_table,
+                         get_watermark, handle_batch, set_watermark, wait_for_writes, with_retries)
+from .partitions import pending_since
+
+# Lotes que pueden estar escribiéndose mientras se lee el siguiente
+MAX_IN_FLIGHT = 1
+
+def current_rss_mb():
+    """Devuelve la memoria residente actual del proceso en MB"""
+    try:
+        with open('/proc/self/statm') as f:
+            resident_pages = int(f.read().split()[1])
+        return resident_pages * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+    except (OSError, ValueError, IndexError):
+        # Sin /proc (p. ej. macOS) se usa el pico como aproximación
+        return peak_rss_mb()
+
+def peak_rss_mb():
+    """Devuelve el pico de memoria residente del proceso en MB"""
+    # ru_maxrss está en KB en Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def stream_pending_batches(stage, query, handler, batch_size=DEFAULT_BATCH_SIZE, memory_limit_mb=None):
+    """
+    Procesa los registros pendientes de una etapa con un cursor del lado del servidor
+
+    Las filas se leen con stream_results en lotes de batch_size y cada lote se
+    escribe en un hilo aparte mientras se lee el siguiente. Cada escritura se
+    confirma junto con la marca de agua de la etapa, con reintentos y
+    cuarentena de registros como en process_pending_batches. Si la memoria residente
+    supera memory_limit_mb, se esperan las escrituras pendientes antes de leer
+    más filas. La lectura bloquea las escrituras en la tabla de la etapa hasta
+    que termina (ver checkpoint.wait_for_writes).
+
+    Args:
+        stage (str): Nombre de la etapa ('transform', 'load', ...)
+        query: Consulta text() que acepta :last_id y :since y devuelve (id, data) ordenado por id
+        handler (callable): Función handler(conn, rows) que escribe un lote y devuelve el número de registros
+        batch_size (int): Número de registros por lote
+        memory_limit_mb (float, optional): Techo de memoria residente en MB
+
+    Returns:
+        int: Número de registros procesados
+    """
+    with get_engine().begin() as conn:
+        ensure_checkpoint_table(conn)
+        ensure_dead_letter_table(conn)
+        last_id = get_watermark(conn, stage)
+        since = pending_since(conn, stage, last_id)
+
+    total = 0
+    in_flight = deque()
+    with ThreadPoolExecutor(max_workers=1) as writer, get_engine().connect() as read_conn, read_conn.begin():
+        wait_for_writes(read_conn, WATERMARK_TABLES.get(stage))
+        result = read_conn.execution_options(stream_results=True).execute(query, {"last_id": last_id, "since": since})
+        for rows in result.partitions(batch_size):
+            in_flight.append(writer.submit(_write_batch, stage, handler, rows))
+            del rows
+
+            # Mantener como mucho MAX_IN_FLIGHT lotes en memoria, o ninguno si se supera el techo
+            limit = MAX_IN_FLIGHT
+            if memory_limit_mb and current_rss_mb() > memory_limit_mb:
+                limit = 0
+            while len(in_flight) > limit:
+                total += in_flight.popleft().result()
+
+        while in_flight:
+            total += in_flight.popleft().result()
+
+    print(f"Etapa {stage}: {total} registros procesados, pico de memoria {peak_rss_mb():.0f} MB")
+    return total
+
+def _write_batch(stage, handler, rows):
+    """Escribe un lote, con reintentos ante errores transitorios"""
+    return with_retries(stage, _commit_batch, stage, handler, rows)
+
+def _commit_batch(stage, handler, rows):
+    """Escribe un lote y avanza la marca de agua en la misma transacción"""
+    with get_engine().begin() as conn:
+        count = handle_batch(conn, stage, handler, rows)
+        set_watermark(conn, stage, rows[-1][0])
+    return count
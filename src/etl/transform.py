@@ -1,94 +1,258 @@
-import pandas as pd
-import json
+import functools
 from sqlalchemy import text
-from ..utils.database import engine
+from ..utils.database import get_engine
+from ..utils.query_cache import bump_table_versions
+from . import chunks, json_utils
+from .instrumentation import instrumented, record_error, record_progress
+from .checkpoint import (DEFAULT_BATCH_SIZE, RecordError, handle_batch, lock_writes, process_pending_batches,
+                         record_payload, release_dead_letters)
+from .parallel import transform_parallel
+from .rollups import refresh_rollups_after_write
+from .streaming import stream_pending_batches
+from .staging import STAGING_ENABLED, clear_schema_cache, staging_table_name, write_staging_rows
 
-def transform_raw_data(raw_data_id=None):
+# Registros pendientes por encima de la marca de agua (paginación por clave).
+# El NOT EXISTS se resuelve con idx_processed_data_raw_data_id y solo protege
+# frente a ids transformados de forma individual con raw_data_id. Con raw_data
+# particionada, :since descarta las particiones sin registros pendientes.
+PENDING_QUERY = text("""
+    SELECT r.id, r.data, r.source FROM raw_data r
+    WHERE r.id > :last_id
+      AND (:since IS NULL OR r.timestamp >= :since)
+      AND NOT EXISTS (SELECT 1 FROM processed_data p WHERE p.raw_data_id = r.id)
+    ORDER BY r.id
+    LIMIT :limit
+""")
+
+# Variante sin LIMIT para el modo streaming (cursor del lado del servidor)
+STREAM_QUERY = text("""
+    SELECT r.id, r.data, r.source FROM raw_data r
+    WHERE r.id > :last_id
+      AND (:since IS NULL OR r.timestamp >= :since)
+      AND NOT EXISTS (SELECT 1 FROM processed_data p WHERE p.raw_data_id = r.id)
+    ORDER BY r.id
+""")
+
+PENDING_BY_ID_QUERY = text("""
+    SELECT r.id, r.data, r.source FROM raw_data r
+    WHERE r.id = :raw_data_id
+      AND NOT EXISTS (SELECT 1 FROM processed_data p WHERE p.raw_data_id = r.id)
+""")
+
+@instrumented('transform')
+def transform_raw_data(raw_data_id=None, batch_size=DEFAULT_BATCH_SIZE, streaming=False, memory_limit_mb=None, workers=1):
     """
     Transforma los datos crudos y los guarda en la tabla processed_data
     
+    Sin raw_data_id, los registros pendientes se seleccionan de forma incremental
+    a partir de la marca de agua de la etapa 'transform' (ver checkpoint.py), por
+    páginas de batch_size registros. Cada lote se confirma por separado, los
+    lotes se reintentan ante errores transitorios y los registros que fallan se
+    guardan en etl_dead_letters; si la ejecución se interrumpe, la siguiente
+    continúa desde el último lote confirmado.
+    
+    Después se transforman los bloques pendientes de raw_data_chunks (modo de
+    almacenamiento compacto, ver chunks.py), uno por transacción, con su propia
+    marca de agua ('transform_chunks').
+    
+    Si se transforman registros, se actualizan los agregados diarios de
+    processed_data (ver rollups.py).
+    
     Args:
         raw_data_id (int, optional): ID del registro a transformar. Si es None, procesa todos los registros no procesados.
+        batch_size (int): Número de registros por lote en el modo incremental
+        streaming (bool): Si es True, lee con un cursor del lado del servidor y escribe
+            cada lote mientras se lee el siguiente (ver streaming.py)
+        memory_limit_mb (float, optional): Techo de memoria residente en MB para el modo streaming
+        workers (int): Si es mayor que 1, reparte el trabajo entre varios procesos
+            (ver parallel.py)
     
     Returns:
-        int: Número de registros transformados
+        int: Número de registros transformados (en caso de error, los de los lotes ya confirmados)
     """
+    total = 0
     try:
-        # Construir la consulta SQL
         if raw_data_id:
-            query = text("""
-                SELECT id, data FROM raw_data 
-                WHERE id = :raw_data_id AND id NOT IN (SELECT raw_data_id FROM processed_data WHERE raw_data_id IS NOT NULL)
-            """)
-            params = {"raw_data_id": raw_data_id}
+            with get_engine().begin() as conn:
+                results = conn.execute(PENDING_BY_ID_QUERY, {"raw_data_id": raw_data_id}).fetchall()
+                chunk_id = None
+                if not results and chunks.has_chunk_table(conn):
+                    results = _pending_chunk_row(conn, raw_data_id)
+                    chunk_id = results[0][3] if results else None
+                if not results:
+                    print("No hay nuevos datos para transformar")
+                    return 0
+                total = _transform_rows(conn, results, chunk_id)
+                # Un registro en cuarentena se puede reprocesar por su id
+                release_dead_letters(conn, 'transform', [raw_data_id])
+            refresh_rollups_after_write(['processed_data'])
+            return total
+        
+        if workers > 1:
+            total = transform_parallel(workers, batch_size)
+        elif streaming:
+            total = stream_pending_batches('transform', STREAM_QUERY, _transform_rows, batch_size, memory_limit_mb)
         else:
-            query = text("""
-                SELECT id, data FROM raw_data 
-                WHERE id NOT IN (SELECT raw_data_id FROM processed_data WHERE raw_data_id IS NOT NULL)
-            """)
-            params = {}
+            for count in process_pending_batches('transform', PENDING_QUERY, _transform_rows, batch_size):
+                total += count
+        
+        with get_engine().begin() as conn:
+            has_chunks = chunks.has_chunk_table(conn)
+        if has_chunks:
+            for count in process_pending_batches(chunks.TRANSFORM_STAGE, chunks.PENDING_CHUNKS_QUERY,
+                                                 _transform_chunks, chunks.CHUNKS_PER_BATCH):
+                total += count
         
-        # Ejecutar la consulta
-        with engine.connect() as conn:
-            results = conn.execute(query, params).fetchall()
-            
-            if not results:
-                print("No hay nuevos datos para transformar")
-                return 0
-            
-            # Transformar cada registro
-            processed_records = []
-            for row in results:
-                raw_id = row[0]
-                data = json.loads(row[1])
-                
-                # Aplicar transformaciones (ejemplo)
-                processed_data = clean_and_transform(data)
-                
-                # Preparar registro para inserciu00f3n
-                processed_record = {
-                    'raw_data_id': raw_id,
-                    'data': json.dumps(processed_data)
-                }
-                processed_records.append(processed_record)
-            
-            # Insertar registros procesados
-            if processed_records:
-                conn.execute(
-                    text("INSERT INTO processed_data (raw_data_id, data) VALUES (:raw_data_id, :data)"),
-                    processed_records
-                )
-            
-            return len(processed_records)
+        if not total:
+            print("No hay nuevos datos para transformar")
+        else:
+            refresh_rollups_after_write(['processed_data'])
+        return total
     
     except Exception as e:
         print(f"Error al transformar datos: {e}")
-        return 0
+        if total:
+            print(f"{total} registros ya confirmados; la próxima ejecución continúa desde el último lote")
+        record_error(e)
+        return total
+
+def _transform_rows(conn, results, chunk_id=None):
+    """
+    Transforma un lote de filas (id, data, source) de raw_data y lo inserta en processed_data
+    
+    Con ETL_STAGING_ENABLED=true, los registros transformados se escriben también
+    en columnas tipadas en la tabla de staging de su fuente (ver staging.py).
+    Las filas de un bloque de raw_data_chunks (chunk_id) no tienen fila en
+    raw_data: su id se guarda en chunk_row_id y raw_data_id queda nulo. La
+    versión de las tablas escritas se incrementa en la misma transacción (ver
+    query_cache.py).
+    """
+    # Transformar todos los registros en un único lote
+    raw_ids = [row[0] for row in results]
+    transformed = clean_and_transform_batch([record_payload(row) for row in results])
+    
+    # Preparar registros para inserción
+    processed_records = [
+        {'raw_data_id': raw_id, 'data': json_utils.dumps(processed_data)}
+        for raw_id, processed_data in zip(raw_ids, transformed)
+    ]
+    
+    record_progress(rows_in=len(results), bytes=sum(len(record['data']) for record in processed_records))
+    
+    # Insertar registros procesados
+    if processed_records:
+        lock_writes(conn, ['processed_data'])
+        if chunk_id is None:
+            insert = "INSERT INTO processed_data (raw_data_id, data) VALUES (:raw_data_id, :data)"
+            conn.execute(text(insert), processed_records)
+        else:
+            insert = ("INSERT INTO processed_data (data, raw_chunk_id, chunk_row_id) "
+                      "VALUES (:data, :raw_chunk_id, :raw_data_id)")
+            conn.execute(text(insert), [dict(record, raw_chunk_id=chunk_id) for record in processed_records])
+        written = ['processed_data']
+        if STAGING_ENABLED:
+            try:
+                write_staging_rows(conn, [row[2] for row in results], raw_ids, transformed)
+            except Exception:
+                # Los cambios de esquema se deshacen con el lote
+                clear_schema_cache()
+                raise
+            written += [staging_table_name(row[2]) for row in results]
+        bump_table_versions(conn, written)
+    
+    return len(processed_records)
+
+def _transform_chunks(conn, rows):
+    """
+    Transforma bloques de raw_data_chunks (id, descripción, source, format, payload)
+
+    Las filas ya transformadas (p. ej. tras retroceder la marca de agua en un
+    backfill) se omiten, y las que fallan se ponen en cuarentena una a una en
+    la etapa 'transform', como las de raw_data.
+    """
+    total = 0
+    for chunk_id, _, source, chunk_format, payload in rows:
+        try:
+            decoded = chunks.decode_chunk(payload, chunk_format)
+        except Exception as e:
+            # Un bloque ilegible se pone en cuarentena en la etapa 'transform_chunks'
+            raise RecordError(f"No se puede leer el bloque {chunk_id}: {e}") from e
+        chunk_rows = [(raw_id, line, source) for raw_id, line in decoded]
+        done = {row[0] for row in conn.execute(chunks.PROCESSED_CHUNK_ROWS_QUERY,
+                                               {"ids": [row[0] for row in chunk_rows]})}
+        pending = [row for row in chunk_rows if row[0] not in done]
+        if pending:
+            total += handle_batch(conn, 'transform', functools.partial(_transform_rows, chunk_id=chunk_id), pending)
+    return total
+
+def _pending_chunk_row(conn, raw_data_id):
+    """Fila de un bloque con ese id si no se ha transformado: [(id, data, source, id del bloque)] o []"""
+    chunk_id, row = chunks.find_row(conn, raw_data_id)
+    if row is None or conn.execute(chunks.PROCESSED_CHUNK_ROWS_QUERY, {"ids": [raw_data_id]}).fetchone():
+        return []
+    return [(*row, chunk_id)]
 
 def clean_and_transform(data):
     """
     Aplica limpieza y transformaciones a los datos
     
+    Envoltorio de clean_and_transform_batch para un único registro, se mantiene
+    por compatibilidad.
+    
     Args:
         data (dict): Datos a transformar
     
     Returns:
         dict: Datos transformados
     """
-    # Convertir a DataFrame para facilitar las transformaciones
-    df = pd.DataFrame([data])
-    
-    # Ejemplo de transformaciones:
-    # 1. Convertir columnas a minu00fasculas
-    df.columns = [col.lower() for col in df.columns]
+    return clean_and_transform_batch([data])[0]
+
+def clean_and_transform_batch(records):
+    """
+    Aplica limpieza y transformaciones a un lote de registros en una sola pasada
     
-    # 2. Rellenar valores nulos
-    df = df.fillna(0)
+    Los registros se agrupan por su conjunto de claves y cada grupo se convierte
+    en un único DataFrame, de modo que las reglas se aplican una vez por grupo y
+    no una vez por registro. Las columnas usan dtype object para conservar los
+    tipos nativos de Python y no rellenar claves ausentes en otros registros.
     
-    # 3. Eliminar columnas no necesarias (ejemplo)
-    columns_to_drop = [col for col in df.columns if col.startswith('temp_')]
-    if columns_to_drop:
-        df = df.drop(columns=columns_to_drop)
+    Args:
+        records (list): Lista de diccionarios a transformar
     
-    # Convertir de nuevo a diccionario
-    return df.iloc[0].to_dict()
+    Returns:
+        list: Diccionarios transformados, en el mismo orden que la entrada
+    """
+    import pandas as pd
+
+    results = [None] * len(records)
+
+    # Agrupar por conjunto de claves; en un lote de un mismo origen suele haber uno solo
+    groups = {}
+    for position, data in enumerate(records):
+        groups.setdefault(tuple(data), []).append(position)
+
+    for keys, positions in groups.items():
+        if not keys:
+            # Un DataFrame sin columnas no devuelve filas en to_dict('records')
+            for position in positions:
+                results[position] = {}
+            continue
+        df = pd.DataFrame([records[p] for p in positions], columns=list(keys), dtype=object)
+
+        # Ejemplo de transformaciones:
+        # 1. Convertir columnas a minúsculas
+        df.columns = [str(col).lower() for col in df.columns]
+
+        # 2. Rellenar valores nulos
+        df = df.fillna(0)
+
+        # 3. Eliminar columnas no necesarias (ejemplo)
+        columns_to_drop = [col for col in df.columns if col.startswith('temp_')]
+        if columns_to_drop:
+            df = df.drop(columns=columns_to_drop)
+
+        # Convertir de nuevo a diccionarios
+        for position, record in zip(positions, df.to_dict('records')):
+            results[position] = record
+
+    return results
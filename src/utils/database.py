@@ -1,30 +1,205 @@
 import os
-from sqlalchemy import create_engine
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
-from dotenv import load_dotenv
+import threading
+import time
+from sqlalchemy.pool import QueuePool
 
-# Cargar variables de entorno
-load_dotenv()
+# URL de conexiu00f3n por defecto si no se define DATABASE_URL
+DEFAULT_DATABASE_URL = "postgresql://postgres:postgres@db:5432/dataengineering"
 
-# Obtener URL de conexiu00f3n a la base de datos
-DATABASE_URL = os.getenv("DATABASE_URL", "postgresql://postgres:postgres@db:5432/dataengineering")
+def load_settings():
+    """
+    Lee la configuración de la conexión (URL, pool y statement_timeout)
 
-# Crear motor de SQLAlchemy
-engine = create_engine(DATABASE_URL)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-Base = declarative_base()
+    El archivo .env se carga aquí y no al importar el módulo, de modo que
+    importar el paquete no lee archivos ni crea el motor hasta que se usa.
+
+    Returns:
+        dict: database_url, pool_settings y statement_timeout_ms
+    """
+    from dotenv import load_dotenv
+
+    # Cargar variables de entorno
+    load_dotenv()
+    return {
+        'database_url': os.getenv("DATABASE_URL", DEFAULT_DATABASE_URL),
+        # Configuración del pool de conexiones (valores por defecto de SQLAlchemy)
+        'pool_settings': {
+            'pool_size': int(os.getenv("DB_POOL_SIZE", "5")),
+            'max_overflow': int(os.getenv("DB_MAX_OVERFLOW", "10")),
+            'pool_timeout': float(os.getenv("DB_POOL_TIMEOUT", "30")),
+            'pool_recycle': int(os.getenv("DB_POOL_RECYCLE", "-1")),
+            'pool_pre_ping': os.getenv("DB_POOL_PRE_PING", "false").lower() in ("1", "true", "yes"),
+        },
+        # Tiempo máximo por sentencia en milisegundos (0 = sin límite)
+        'statement_timeout_ms': int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "0")),
+    }
+
+class InstrumentedQueuePool(QueuePool):
+    """QueuePool que registra el tiempo de espera y los desbordamientos de cada checkout"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stats_lock = threading.Lock()
+        self.checkouts = 0
+        self.overflow_hits = 0
+        self.wait_time_total = 0.0
+        self.wait_time_max = 0.0
+
+    def _do_get(self):
+        overflow_before = self._overflow
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            wait = time.perf_counter() - start
+            with self.stats_lock:
+                self.checkouts += 1
+                self.wait_time_total += wait
+                self.wait_time_max = max(self.wait_time_max, wait)
+                # _overflow > 0 significa conexiones abiertas por encima de pool_size
+                if self._overflow > overflow_before and self._overflow > 0:
+                    self.overflow_hits += 1
+
+_engine = None
+_engine_pid = None
+_engine_lock = threading.Lock()
+
+def get_engine():
+    """
+    Devuelve el motor de SQLAlchemy del proceso actual
+
+    El motor se crea en la primera llamada con la configuración de
+    load_settings(). Si el proceso
+    se ha bifurcado (fork), el proceso hijo descarta el pool heredado sin cerrar
+    las conexiones del padre y crea su propio motor.
+
+    Returns:
+        Engine: Motor de SQLAlchemy
+    """
+    global _engine, _engine_pid
+    pid = os.getpid()
+    if _engine is not None and _engine_pid == pid:
+        return _engine
+
+    with _engine_lock:
+        if _engine is not None and _engine_pid != pid:
+            # Conexiones heredadas del padre: no se cierran, solo se abandonan
+            _engine.dispose(close=False)
+            _engine = None
+        if _engine is None:
+            _engine = _create_engine()
+            _engine_pid = pid
+    return _engine
+
+def _create_engine():
+    """Crea el motor con el pool instrumentado y el statement_timeout configurado"""
+    from sqlalchemy import create_engine
+
+    settings = load_settings()
+    connect_args = {}
+    if settings['statement_timeout_ms']:
+        connect_args['options'] = f"-c statement_timeout={settings['statement_timeout_ms']}"
+    return create_engine(
+        settings['database_url'],
+        poolclass=InstrumentedQueuePool,
+        connect_args=connect_args,
+        **settings['pool_settings']
+    )
+
+def get_pool_stats():
+    """
+    Devuelve estadísticas de uso del pool de conexiones del proceso actual
+
+    Returns:
+        dict: Tamaño del pool, conexiones en uso, desbordamientos y tiempos de espera
+    """
+    pool = get_engine().pool
+    with pool.stats_lock:
+        checkouts = pool.checkouts
+        return {
+            'pool_size': pool.size(),
+            'checked_out': pool.checkedout(),
+            'checked_in': pool.checkedin(),
+            'overflow': max(pool.overflow(), 0),
+            'checkouts': checkouts,
+            'overflow_hits': pool.overflow_hits,
+            'wait_time_total': pool.wait_time_total,
+            'wait_time_max': pool.wait_time_max,
+            'wait_time_avg': pool.wait_time_total / checkouts if checkouts else 0.0,
+        }
+
+_lazy = {}
+_session_factory = None
+_session_engine = None
+
+def get_session_factory():
+    """
+    Devuelve el sessionmaker del proceso actual, ligado a get_engine()
+
+    Se crea en la primera llamada y de nuevo si el motor cambia (p. ej. en un
+    proceso hijo tras un fork), igual que el motor.
+    """
+    global _session_factory, _session_engine
+    engine = get_engine()
+    if _session_factory is None or _session_engine is not engine:
+        from sqlalchemy.orm import sessionmaker
+
+        with _engine_lock:
+            if _session_factory is None or _session_engine is not engine:
+                _session_factory = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+                _session_engine = engine
+    return _session_factory
+
+def __getattr__(name):
+    """
+    Atributos del módulo que se crean en el primer acceso
+
+    engine, SessionLocal y Base se siguen pudiendo importar
+    (from src.utils.database import engine), pero ni el motor ni el ORM se
+    crean al importar el módulo.
+    """
+    if name == 'engine':
+        return get_engine()
+    if name == 'SessionLocal':
+        return get_session_factory()
+    if name == 'Base':
+        if name not in _lazy:
+            from sqlalchemy.ext.declarative import declarative_base
+            _lazy[name] = declarative_base()
+        return _lazy[name]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 def get_db():
     """Funciu00f3n para obtener una sesiu00f3n de base de datos"""
-    db = SessionLocal()
+    db = get_session_factory()()
     try:
         yield db
     finally:
         db.close()
 
-def execute_query(query, params=None):
-    """Ejecuta una consulta SQL y devuelve los resultados"""
-    with engine.connect() as connection:
+def execute_query(query, params=None, cache=None, tables=None):
+    """
+    Ejecuta una consulta SQL y devuelve los resultados
+
+    Con cache=True (o DB_QUERY_CACHE_ENABLED=true si no se indica) el resultado
+    se sirve desde la caché mientras no cambien las tablas que lee la consulta
+    (ver query_cache.py).
+
+    Args:
+        query (str o TextClause): Consulta SQL
+        params (dict, optional): Parámetros de la consulta
+        cache (bool, optional): Usar la caché de resultados
+        tables (list, optional): Tablas que lee la consulta, si no se pueden
+            deducir de su texto
+
+    Returns:
+        list: Filas del resultado
+    """
+    # Importación diferida: query_cache importa este módulo
+    from .query_cache import QUERY_CACHE_ENABLED, cached_query
+
+    if cache or (cache is None and QUERY_CACHE_ENABLED):
+        return cached_query(query, params, tables)
+    with get_engine().connect() as connection:
         result = connection.execute(query, params or {})
         return result.fetchall()
@@ -0,0 +1,426 @@
+import hashlib
+import os
+import pickle
+import re
+import threading
+import time
+from collections import OrderedDict
+from sqlalchemy import text
+from .database import get_engine
+
+# Caché de resultados de execute_query (desactivada por defecto; también se
+# puede activar por consulta con execute_query(..., cache=True)). Los procesos
+# del ETL solo incrementan la versión de las tablas que escriben si está
+# activada (ver bump_table_versions)
+QUERY_CACHE_ENABLED = os.getenv("DB_QUERY_CACHE_ENABLED", "false").lower() in ("1", "true", "yes")
+
+# Límites de la caché en memoria: número de resultados y megabytes (tamaño serializado)
+QUERY_CACHE_MAX_ENTRIES = int(os.getenv("DB_QUERY_CACHE_MAX_ENTRIES", "256"))
+QUERY_CACHE_MAX_MB = float(os.getenv("DB_QUERY_CACHE_MAX_MB", "256"))
+
+# Segundos que un resultado sigue siendo válido aunque no cambien sus tablas
+# (cubre las escrituras que no pasan por el ETL, p. ej. desde psql)
+QUERY_CACHE_TTL = float(os.getenv("DB_QUERY_CACHE_TTL", "300"))
+
+# Directorio opcional donde se guardan también los resultados, para que
+# sobrevivan a un reinicio del kernel del notebook
+QUERY_CACHE_DIR = os.getenv("DB_QUERY_CACHE_DIR")
+
+# Versión de cada tabla: extract, transform, load, los agregados, las métricas
+# y el particionado la incrementan en la misma transacción en la que escriben
+TABLE_VERSIONS_EXISTS_QUERY = "SELECT to_regclass('etl_table_versions') IS NOT NULL"
+
+TABLE_VERSIONS_DDL = """
+    DO $$
+    BEGIN
+        PERFORM pg_advisory_xact_lock(hashtext('etl_table_versions'));
+        CREATE TABLE IF NOT EXISTS etl_table_versions (
+            table_name VARCHAR(100) PRIMARY KEY,
+            version BIGINT NOT NULL,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+    END $$
+"""
+
+# Las tablas se actualizan en orden para que dos escritores concurrentes no se
+# bloqueen mutuamente; se ejecuta con el paramstyle de psycopg2 (cursor o
+# exec_driver_sql)
+BUMP_VERSIONS_SQL = """
+    INSERT INTO etl_table_versions (table_name, version, updated_at)
+    SELECT t, 1, CURRENT_TIMESTAMP FROM unnest(%(tables)s::text[]) AS t ORDER BY t
+    ON CONFLICT (table_name) DO UPDATE
+    SET version = etl_table_versions.version + 1, updated_at = EXCLUDED.updated_at
+"""
+
+TABLE_VERSIONS_QUERY = text("""
+    SELECT table_name, version FROM etl_table_versions WHERE table_name = ANY(:tables)
+""")
+
+# Tablas y vistas de las que depende directamente cada vista (o vista materializada)
+VIEW_DEPENDENCIES_QUERY = text("""
+    SELECT DISTINCT v.relname, t.relname
+    FROM pg_class v
+    JOIN pg_rewrite r ON r.ev_class = v.oid
+    JOIN pg_depend d ON d.objid = r.oid AND d.classid = 'pg_rewrite'::regclass
+    JOIN pg_class t ON t.oid = d.refobjid
+    WHERE v.relname = ANY(:names) AND v.relkind IN ('v', 'm')
+      AND t.oid <> v.oid AND t.relkind IN ('r', 'p', 'v', 'm')
+      AND pg_table_is_visible(v.oid)
+""")
+
+# Tokens de una consulta: identificadores entre comillas, nombres (con esquema) o un símbolo
+TOKEN = re.compile(r'"[^"]+"|\w+(?:\.\w+)*|\S')
+
+# Palabras que pueden seguir al nombre de una tabla y que no son un alias
+CLAUSE_KEYWORDS = {
+    'WHERE', 'GROUP', 'ORDER', 'HAVING', 'LIMIT', 'OFFSET', 'UNION', 'INTERSECT', 'EXCEPT',
+    'JOIN', 'INNER', 'LEFT', 'RIGHT', 'FULL', 'CROSS', 'NATURAL', 'ON', 'USING', 'WINDOW',
+    'FOR', 'FETCH', 'TABLESAMPLE', 'RETURNING',
+}
+
+_versions_table_ready = False
+
+# Tablas base de cada vista ya consultada en el proceso
+_view_tables = {}
+_view_tables_lock = threading.Lock()
+
+class QueryCache:
+    """
+    Caché LRU de resultados de consultas con TTL y validación por versión de tabla
+
+    Cada resultado guarda la versión de las tablas que lee en el momento de
+    ejecutarse. Una entrada solo se sirve si esas versiones no han cambiado y
+    no ha superado el TTL; si no, se descarta. Cuando se superan max_entries o
+    max_bytes se eliminan las entradas usadas hace más tiempo.
+
+    Con directory, cada resultado se guarda también en <directory>/<clave>.pkl
+    y los fallos en memoria se buscan allí con la misma validación; los
+    archivos caducados o invalidados se borran al leerlos y con clear().
+    """
+
+    def __init__(self, max_entries=QUERY_CACHE_MAX_ENTRIES, max_bytes=int(QUERY_CACHE_MAX_MB * 1024 ** 2),
+                 ttl=QUERY_CACHE_TTL, directory=QUERY_CACHE_DIR):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.directory = directory
+        self.lock = threading.Lock()
+        # clave -> (versiones, creado, bytes, filas)
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def get(self, key, versions):
+        """Devuelve las filas guardadas para la clave si siguen siendo válidas, o None"""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                if self._is_valid(entry[0], entry[1], versions):
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return list(entry[3])
+                self._remove(key)
+        stored = self._read_disk(key, versions)
+        with self.lock:
+            if stored is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+            self._store(key, *stored)
+            return list(stored[3])
+
+    def put(self, key, versions, rows):
+        """Guarda el resultado de una consulta con las versiones de sus tablas"""
+        created = time.time()
+        payload = pickle.dumps((versions, created, rows), protocol=pickle.HIGHEST_PROTOCOL)
+        if len(payload) > self.max_bytes:
+            return
+        with self.lock:
+            self._store(key, versions, created, len(payload), list(rows))
+        if self.directory:
+            path = self._path(key)
+            # Escritura atómica: un lector nunca ve un archivo a medias
+            temporary = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(temporary, 'wb') as f:
+                f.write(payload)
+            os.replace(temporary, path)
+
+    def clear(self):
+        """Vacía la caché (y el directorio, si lo hay) sin reiniciar los contadores"""
+        with self.lock:
+            self.entries.clear()
+            self.bytes = 0
+        if self.directory:
+            for name in os.listdir(self.directory):
+                if name.endswith('.pkl'):
+                    _remove_file(os.path.join(self.directory, name))
+
+    def stats(self):
+        """Contadores de la caché y tasa de aciertos"""
+        with self.lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                'entries': len(self.entries),
+                'bytes': self.bytes,
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'invalidations': self.invalidations,
+                'hit_ratio': (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+            }
+
+    def _is_valid(self, stored_versions, created, versions):
+        if stored_versions != versions:
+            self.invalidations += 1
+            return False
+        if time.time() - created > self.ttl:
+            self.expirations += 1
+            return False
+        return True
+
+    def _store(self, key, versions, created, size, rows):
+        if key in self.entries:
+            self._remove(key)
+        self.entries[key] = (versions, created, size, rows)
+        self.bytes += size
+        while len(self.entries) > self.max_entries or self.bytes > self.max_bytes:
+            _, evicted = self.entries.popitem(last=False)
+            self.bytes -= evicted[2]
+            self.evictions += 1
+
+    def _remove(self, key):
+        self.bytes -= self.entries.pop(key)[2]
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.pkl")
+
+    def _read_disk(self, key, versions):
+        if not self.directory:
+            return None
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                payload = f.read()
+            stored_versions, created, rows = pickle.loads(payload)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            print(f"Resultado en caché ilegible ({path}): {e}")
+            _remove_file(path)
+            return None
+        with self.lock:
+            valid = self._is_valid(stored_versions, created, versions)
+        if not valid:
+            _remove_file(path)
+            return None
+        return stored_versions, created, len(payload), rows
+
+def _remove_file(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_cache():
+    """Devuelve la caché de resultados del proceso, creándola en la primera llamada"""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = QueryCache()
+    return _cache
+
+def get_cache_stats():
+    """
+    Devuelve los contadores de la caché de resultados del proceso actual
+
+    Returns:
+        dict: Entradas, bytes, aciertos (en memoria y en disco), fallos,
+        expulsiones por tamaño, caducadas por TTL, invalidadas por cambios
+        en sus tablas y tasa de aciertos
+    """
+    return get_cache().stats()
+
+def clear_cache():
+    """Vacía la caché de resultados del proceso actual y su directorio"""
+    get_cache().clear()
+
+def cache_key(query, params=None):
+    """Clave de un resultado: hash del texto SQL y de los parámetros"""
+    params = sorted((params or {}).items())
+    return hashlib.sha256(f"{query}\x00{params!r}".encode('utf-8')).hexdigest()
+
+def referenced_tables(query):
+    """
+    Tablas que lee una consulta (nombres tras FROM y JOIN, también en listas con comas)
+
+    Los nombres se devuelven en minúsculas y sin esquema. Las subconsultas se
+    recorren igual, ya que sus FROM aparecen en el texto; un nombre que no sea
+    una tabla (p. ej. la columna de EXTRACT(DAY FROM ...)) solo añade una
+    versión que nunca cambia.
+    """
+    tokens = TOKEN.findall(str(query))
+    tables = set()
+    position = 0
+    while position < len(tokens):
+        keyword = tokens[position].upper()
+        position += 1
+        if keyword not in ('FROM', 'JOIN'):
+            continue
+        while position < len(tokens) and tokens[position] != '(':
+            tables.add(tokens[position].strip('"').split('.')[-1].lower())
+            position += 1
+            if position < len(tokens) and tokens[position].upper() == 'AS':
+                position += 1
+            if (position < len(tokens) and tokens[position] not in (',', '(', ')', ';')
+                    and tokens[position].upper() not in CLAUSE_KEYWORDS):
+                position += 1
+            if position < len(tokens) and tokens[position] == ',':
+                position += 1
+                continue
+            break
+    return sorted(tables)
+
+def ensure_versions_table(conn):
+    """
+    Crea etl_table_versions si no existe, con la conexión (y la transacción) indicada
+
+    Cuando se ha visto la tabla ya creada no se vuelve a comprobar en el resto
+    del proceso. Si la crea esta transacción, se vuelve a comprobar en la
+    siguiente llamada, por si la transacción se deshace.
+
+    Args:
+        conn: Conexión de SQLAlchemy o cursor de psycopg2
+    """
+    global _versions_table_ready
+    if _versions_table_ready:
+        return
+    if _execute(conn, TABLE_VERSIONS_EXISTS_QUERY).fetchone()[0]:
+        _versions_table_ready = True
+    else:
+        _execute(conn, TABLE_VERSIONS_DDL)
+
+def bump_table_versions(conn, tables):
+    """
+    Incrementa la versión de las tablas escritas, invalidando los resultados en caché que las leen
+
+    Se llama dentro de la transacción que escribe en las tablas, de modo que la
+    versión nueva es visible exactamente cuando se confirman los datos (y se
+    deshace con ellos). La fila de cada tabla queda bloqueada hasta el commit,
+    por lo que conviene llamarla al final de la transacción.
+
+    Solo se hace con DB_QUERY_CACHE_ENABLED=true: sin caché nadie lee las
+    versiones, y así los escritores concurrentes no se esperan por esas filas.
+    Los procesos que consultan con cache=True dependen entonces del TTL.
+
+    Args:
+        conn: Conexión de SQLAlchemy o cursor de psycopg2
+        tables (list): Nombres de las tablas escritas
+    """
+    if not QUERY_CACHE_ENABLED:
+        return
+    ensure_versions_table(conn)
+    _execute(conn, BUMP_VERSIONS_SQL, {"tables": sorted(set(tables))})
+
+def _execute(conn, statement, params=None):
+    """Ejecuta SQL con el paramstyle de psycopg2 en una conexión de SQLAlchemy o en un cursor"""
+    if hasattr(conn, 'exec_driver_sql'):
+        return conn.exec_driver_sql(statement, params) if params else conn.exec_driver_sql(statement)
+    conn.execute(statement, params)
+    return conn
+
+def base_tables(conn, tables):
+    """
+    Añade a una lista de tablas las tablas base de las vistas que contiene
+
+    Las dependencias se obtienen del catálogo (pg_rewrite y pg_depend),
+    también las de vistas sobre otras vistas, y se guardan para el resto del
+    proceso. Los nombres que no son vistas se devuelven tal cual.
+
+    Args:
+        conn: Conexión activa de SQLAlchemy
+        tables (list): Nombres de tablas o vistas
+
+    Returns:
+        list: Nombres ordenados, sin repetir
+    """
+    with _view_tables_lock:
+        unknown = [table for table in tables if table not in _view_tables]
+    expanded = {}
+    pending = unknown
+    while pending:
+        rows = conn.execute(VIEW_DEPENDENCIES_QUERY, {"names": pending}).fetchall()
+        for name in pending:
+            expanded.setdefault(name, set())
+        for view, dependency in rows:
+            expanded[view].add(dependency)
+        pending = sorted({dependency for _, dependency in rows} - set(expanded))
+    with _view_tables_lock:
+        for name in unknown:
+            _view_tables[name] = _resolve(name, expanded)
+        result = set(tables)
+        for table in tables:
+            result |= _view_tables[table]
+    return sorted(result)
+
+def _resolve(name, expanded, seen=None):
+    """Todas las dependencias (directas e indirectas) de un nombre según expanded"""
+    seen = set() if seen is None else seen
+    for dependency in expanded.get(name, ()):
+        if dependency not in seen:
+            seen.add(dependency)
+            _resolve(dependency, expanded, seen)
+    return seen
+
+def table_versions(conn, tables):
+    """Versión actual de cada tabla ({tabla: versión}; 0 si nunca se ha escrito desde el ETL)"""
+    versions = dict.fromkeys(tables, 0)
+    if tables:
+        versions.update(conn.execute(TABLE_VERSIONS_QUERY, {"tables": list(tables)}).fetchall())
+    return versions
+
+def cached_query(query, params=None, tables=None):
+    """
+    Ejecuta una consulta a través de la caché de resultados
+
+    Las versiones de las tablas se leen antes de ejecutar la consulta y con la
+    misma conexión: si el ETL confirma entre las dos lecturas, el resultado
+    queda asociado a la versión anterior y la siguiente llamada lo descarta.
+    Las vistas se sustituyen por sus tablas base (ver base_tables), de modo que
+    una consulta sobre una vista se invalida cuando el ETL escribe en ellas.
+
+    Args:
+        query (str o TextClause): Consulta SQL
+        params (dict, optional): Parámetros de la consulta
+        tables (list, optional): Tablas o vistas que lee la consulta; por
+            defecto se obtienen del texto con referenced_tables. Sirve para
+            consultas cuyas dependencias no aparecen en el texto (p. ej.
+            funciones que leen tablas)
+
+    Returns:
+        list: Filas del resultado
+    """
+    cache = get_cache()
+    key = cache_key(query, params)
+    tables = sorted(set(tables)) if tables is not None else referenced_tables(query)
+    with get_engine().connect() as connection, connection.begin():
+        ensure_versions_table(connection)
+        versions = table_versions(connection, base_tables(connection, tables))
+        rows = cache.get(key, versions)
+        if rows is not None:
+            return rows
+        rows = connection.execute(query, params or {}).fetchall()
+    cache.put(key, versions, rows)
+    return rows
@@ -0,0 +1,41 @@
+import os
+import pytest
+
+# Las pruebas no registran métricas de ejecución en etl_metrics
+os.environ.setdefault("ETL_METRICS_ENABLED", "false")
+
+SCHEMA_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'sql', 'schema.sql')
+
+@pytest.fixture
+def database(monkeypatch):
+    """
+    Base de datos PostgreSQL de pruebas con el esquema de sql/schema.sql recién creado
+
+    Usa TEST_DATABASE_URL (las pruebas se omiten si no está definida). El
+    esquema public se elimina y se vuelve a crear: debe ser una base de datos
+    exclusiva para las pruebas.
+    """
+    url = os.getenv("TEST_DATABASE_URL")
+    if not url:
+        pytest.skip("TEST_DATABASE_URL no está definida")
+    from src.etl import dtypes, staging
+    from src.utils import database as db, query_cache
+
+    monkeypatch.setenv("DATABASE_URL", url)
+    monkeypatch.setattr(db, '_engine', None)
+    monkeypatch.setattr(query_cache, '_versions_table_ready', False)
+    monkeypatch.setattr(query_cache, '_view_tables', {})
+    dtypes.clear_plan_cache()
+    staging.clear_schema_cache()
+    engine = db.get_engine()
+    raw_conn = engine.raw_connection()
+    try:
+        cursor = raw_conn.cursor()
+        cursor.execute("DROP SCHEMA public CASCADE; CREATE SCHEMA public")
+        with open(SCHEMA_PATH, encoding='utf-8') as f:
+            cursor.execute(f.read())
+        raw_conn.commit()
+    finally:
+        raw_conn.close()
+    yield engine
+    engine.dispose()
@@ -0,0 +1,72 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+def _start_api(pages, slow_pages=()):
+    """API local paginada: pages[n] es la lista de elementos de la página n (1-indexada) o un código de error"""
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            page = int(parse_qs(urlparse(self.path).query)['page'][0])
+            if page in slow_pages:
+                time.sleep(0.3)
+            items = pages.get(page, [])
+            if isinstance(items, int):
+                self.send_response(items)
+                self.end_headers()
+                return
+            body = json.dumps({'page': page, 'items': items}).encode()
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/ventas"
+
+def test_pagination_stops_at_first_short_page():
+    """La paginación termina en la primera página incompleta aunque las siguientes lleguen antes"""
+    from src.etl.async_extract import extract_from_api_async
+
+    server, url = _start_api({1: [1, 2], 2: [3, 4], 3: [5], 4: [6, 7], 5: [8, 9]}, slow_pages={3})
+    batches = []
+    try:
+        count = extract_from_api_async(url, pagination='page', page_size=2, items_key='items',
+                                       concurrency=4, batch_size=2, sink=batches.append)
+    finally:
+        server.shutdown()
+    assert count == 3
+    assert sorted(json.loads(record['data'])['page'] for batch in batches for record in batch) == [1, 2, 3]
+
+def test_failed_page_reports_committed_records():
+    """Si una página falla, se esperan las inserciones en curso y se devuelven los registros confirmados"""
+    from src.etl.async_extract import extract_from_api_async
+
+    server, url = _start_api({**{page: [page, page] for page in range(1, 6)}, 6: 404})
+    batches = []
+
+    def slow_sink(batch):
+        time.sleep(0.2)
+        batches.append(batch)
+
+    try:
+        count = extract_from_api_async(url, pagination='page', page_size=2, items_key='items', concurrency=1,
+                                       batch_size=2, retries=0, sink=slow_sink)
+    finally:
+        server.shutdown()
+    assert len(batches) == 2
+    assert count == 4
+
+def test_percentile_uses_nearest_rank():
+    """El percentil es el valor de la lista en el rango más cercano"""
+    from src.etl.async_extract import _percentile
+
+    values = [0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1.0]
+    assert _percentile(values, 50) == 0.5
+    assert _percentile(values, 99) == 1.0
+    assert _percentile([], 50) == 0.0
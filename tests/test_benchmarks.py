@@ -0,0 +1,19 @@
+def test_compare_reports_only_regressions_over_threshold():
+    """compare marca las etapas más lentas y las consultas con más latencia que el umbral"""
+    from benchmarks.bench_etl import compare
+
+    baseline = {'results': {'10000': {
+        'transform': {'rows_per_second': 1000.0},
+        'load': {'rows_per_second': 1000.0},
+        'ventas_por_dia': {'latency_p50': 0.010},
+        'solo_en_linea_base': {'rows_per_second': 5.0},
+    }}}
+    results = {'results': {'10000': {
+        'transform': {'rows_per_second': 700.0},
+        'load': {'rows_per_second': 900.0},
+        'ventas_por_dia': {'latency_p50': 0.013},
+        'nueva': {'rows_per_second': 1.0},
+    }}}
+
+    regressions = compare(results, baseline, threshold=0.2)
+    assert [(size, name) for size, name, *_ in regressions] == [('10000', 'transform'), ('10000', 'ventas_por_dia')]
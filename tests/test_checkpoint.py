@@ -0,0 +1,137 @@
+from sqlalchemy import text
+
+def test_first_run_after_single_id_transform_keeps_older_rows(database):
+    """Transformar un id suelto antes de la primera ejecución incremental no salta los anteriores"""
+    from src.etl.transform import transform_raw_data
+
+    with database.begin() as conn:
+        ids = [row[0] for row in conn.execute(text("""
+            INSERT INTO raw_data (timestamp, source, data)
+            SELECT CURRENT_TIMESTAMP, 'api', jsonb_build_object('value', n) FROM generate_series(1, 3) n
+            RETURNING id
+        """))]
+
+    assert transform_raw_data(raw_data_id=max(ids)) == 1
+    assert transform_raw_data() == 2
+    with database.connect() as conn:
+        assert conn.execute(text("SELECT COUNT(DISTINCT raw_data_id) FROM processed_data")).scalar() == 3
+
+class FakeConnection:
+    """Conexión mínima para handle_rows: savepoints que no hacen nada y registro de sentencias"""
+
+    def __init__(self):
+        self.statements = []
+
+    def begin_nested(self):
+        import contextlib
+        return contextlib.nullcontext()
+
+    def execute(self, statement, params=None):
+        self.statements.append((str(statement), params))
+
+def _data_error():
+    from sqlalchemy.exc import DataError
+    return DataError('INSERT ...', {}, Exception('invalid input syntax'))
+
+def test_data_errors_quarantine_only_failing_rows(monkeypatch):
+    """Un error de los datos aísla y pone en cuarentena solo los registros que fallan"""
+    from src.etl import checkpoint
+
+    quarantined = []
+    monkeypatch.setattr(checkpoint, 'quarantine', lambda conn, stage, row, error: quarantined.append(row[0]))
+
+    def handler(conn, rows):
+        if any(row[0] == 3 for row in rows):
+            raise _data_error()
+        return len(rows)
+
+    rows = [(i, {}) for i in range(1, 9)]
+    assert checkpoint.handle_batch(FakeConnection(), 'transform', handler, rows) == 7
+    assert quarantined == [3]
+
+def test_stage_errors_are_not_quarantined(monkeypatch):
+    """ProgrammingError y los errores de Python detienen la etapa en lugar de ir a cuarentena"""
+    import pytest
+    from sqlalchemy.exc import ProgrammingError
+    from src.etl import checkpoint
+
+    monkeypatch.setattr(checkpoint, 'quarantine', lambda *args: pytest.fail("no debe ir a cuarentena"))
+    errors = [ProgrammingError('INSERT ...', {}, Exception('column "data" does not exist')), KeyError('data')]
+    for error in errors:
+        def handler(conn, rows, error=error):
+            raise error
+        with pytest.raises(type(error)):
+            checkpoint.handle_batch(FakeConnection(), 'transform', handler, [(1, {}), (2, {})])
+
+def test_quarantine_limit_stops_the_stage(monkeypatch):
+    """Si falla más de la mitad de un lote, la etapa se detiene en lugar de ponerlo en cuarentena"""
+    import pytest
+    from src.etl import checkpoint
+
+    monkeypatch.setattr(checkpoint, 'quarantine', lambda *args: None)
+
+    def handler(conn, rows):
+        raise _data_error()
+
+    with pytest.raises(checkpoint.QuarantineLimitError):
+        checkpoint.handle_batch(FakeConnection(), 'load', handler, [(i, {}) for i in range(20)])
+    # Con pocos registros no se aplica el límite
+    assert checkpoint.handle_batch(FakeConnection(), 'load', handler, [(1, {}), (2, {})]) == 0
+
+def test_non_object_records_are_record_errors():
+    """Un JSON que no es un objeto es un error del registro"""
+    import pytest
+    from src.etl.checkpoint import RecordError, record_payload
+
+    assert record_payload((1, '{"a": 1}')) == {'a': 1}
+    with pytest.raises(RecordError):
+        record_payload((2, '[1, 2]'))
+
+def test_schema_error_stops_transform_without_moving_watermark(database):
+    """Un error de esquema en processed_data detiene transform sin avanzar la marca ni poner registros en cuarentena"""
+    from src.etl.transform import transform_raw_data
+
+    with database.begin() as conn:
+        conn.execute(text("""
+            INSERT INTO raw_data (timestamp, source, data)
+            SELECT CURRENT_TIMESTAMP, 'api', jsonb_build_object('value', n) FROM generate_series(1, 3) n
+        """))
+        conn.execute(text("ALTER TABLE processed_data RENAME COLUMN data TO payload"))
+
+    assert transform_raw_data() == 0
+    with database.connect() as conn:
+        assert conn.execute(text("SELECT COUNT(*) FROM etl_dead_letters")).scalar() == 0
+        assert conn.execute(text(
+            "SELECT COALESCE(MAX(last_id), 0) FROM etl_checkpoints WHERE stage = 'transform'"
+        )).scalar() == 0
+
+def test_late_commit_with_lower_id_is_not_skipped(database):
+    """Una escritura que reservó un id menor y se confirma tarde no queda por debajo de la marca de transform"""
+    import threading
+    from src.etl.checkpoint import lock_writes
+    from src.etl.transform import transform_raw_data
+
+    insert = "INSERT INTO raw_data (timestamp, source, data) VALUES (CURRENT_TIMESTAMP, 'api', jsonb_build_object('value', %s))"
+    slow = database.raw_connection()
+    try:
+        cursor = slow.cursor()
+        lock_writes(cursor, ['raw_data'])
+        cursor.execute(insert, (1,))
+        with database.begin() as conn:
+            lock_writes(conn, ['raw_data'])
+            conn.exec_driver_sql(insert, (2,))
+
+        results = []
+        reader = threading.Thread(target=lambda: results.append(transform_raw_data()))
+        reader.start()
+        reader.join(1)
+        # transform espera a que termine la escritura en curso antes de leer
+        assert reader.is_alive()
+        slow.commit()
+        reader.join(30)
+    finally:
+        slow.close()
+
+    assert results == [2]
+    with database.connect() as conn:
+        assert conn.execute(text("SELECT COUNT(DISTINCT raw_data_id) FROM processed_data")).scalar() == 2
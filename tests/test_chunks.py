@@ -0,0 +1,26 @@
+from sqlalchemy import text
+
+def test_chunk_rows_are_transformed_with_schema(database, tmp_path, monkeypatch):
+    """Las filas guardadas en bloques se transforman (y pasan a staging) sin acabar en cuarentena"""
+    from src.etl import transform
+    from src.etl.extract import extract_from_csv
+
+    monkeypatch.setattr(transform, 'STAGING_ENABLED', True)
+    csv_path = tmp_path / 'ventas.csv'
+    csv_path.write_text("fecha,category,value\n2024-01-01,a,1.5\n2024-01-02,b,2\n2024-01-03,a,3\n")
+
+    assert extract_from_csv(str(csv_path), 'ventas', storage='chunks') == 3
+    assert transform.transform_raw_data() == 3
+    with database.connect() as conn:
+        assert conn.execute(text("SELECT COUNT(*) FROM raw_data")).scalar() == 0
+        assert conn.execute(text(
+            "SELECT COUNT(*) FROM processed_data WHERE raw_chunk_id IS NOT NULL AND chunk_row_id IS NOT NULL"
+            " AND raw_data_id IS NULL"
+        )).scalar() == 3
+        # processed_data.raw_data_id conserva su clave foránea hacia raw_data
+        assert conn.execute(text("""
+            SELECT COUNT(*) FROM pg_constraint
+            WHERE contype = 'f' AND conrelid = 'processed_data'::regclass AND confrelid = 'raw_data'::regclass
+        """)).scalar() == 1
+        assert conn.execute(text("SELECT COUNT(*) FROM staging_ventas")).scalar() == 3
+        assert conn.execute(text("SELECT COUNT(*) FROM etl_dead_letters")).scalar() == 0
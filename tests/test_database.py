@@ -0,0 +1,32 @@
+def test_load_settings_reads_environment(monkeypatch):
+    """load_settings toma la URL, el pool y el statement_timeout de las variables de entorno"""
+    from src.utils import database
+
+    monkeypatch.setenv("DATABASE_URL", "postgresql://usuario@localhost/pruebas")
+    monkeypatch.setenv("DB_POOL_SIZE", "2")
+    monkeypatch.setenv("DB_MAX_OVERFLOW", "0")
+    monkeypatch.setenv("DB_POOL_PRE_PING", "true")
+    monkeypatch.setenv("DB_STATEMENT_TIMEOUT_MS", "1500")
+
+    settings = database.load_settings()
+    assert settings['database_url'] == "postgresql://usuario@localhost/pruebas"
+    assert settings['pool_settings']['pool_size'] == 2
+    assert settings['pool_settings']['max_overflow'] == 0
+    assert settings['pool_settings']['pool_pre_ping'] is True
+    assert settings['statement_timeout_ms'] == 1500
+
+def test_load_settings_defaults(monkeypatch):
+    """Sin variables de entorno se usan la URL y los valores del pool por defecto"""
+    from src.utils import database
+
+    for name in ("DATABASE_URL", "DB_POOL_SIZE", "DB_MAX_OVERFLOW", "DB_POOL_TIMEOUT",
+                 "DB_POOL_RECYCLE", "DB_POOL_PRE_PING", "DB_STATEMENT_TIMEOUT_MS"):
+        monkeypatch.delenv(name, raising=False)
+    monkeypatch.setattr("dotenv.load_dotenv", lambda *args, **kwargs: False)
+
+    settings = database.load_settings()
+    assert settings['database_url'] == database.DEFAULT_DATABASE_URL
+    assert settings['pool_settings'] == {
+        'pool_size': 5, 'max_overflow': 10, 'pool_timeout': 30.0, 'pool_recycle': -1, 'pool_pre_ping': False,
+    }
+    assert settings['statement_timeout_ms'] == 0
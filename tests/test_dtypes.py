@@ -0,0 +1,55 @@
+def test_plan_keeps_payloads_when_category_column_turns_numeric(tmp_path):
+    """Una columna categórica en la muestra pero numérica en bloques posteriores no cambia el JSON"""
+    import pandas as pd
+    from src.etl import dtypes
+    from src.etl.extract import _chunk_payloads
+
+    csv_path = tmp_path / 'ventas.csv'
+    categories = [['x', 'y', 'z'][i % 3] for i in range(2000)] + [str(i % 10) for i in range(2000)]
+    pd.DataFrame({'cat': categories, 'value': range(4000)}).to_csv(csv_path, index=False)
+
+    plan = dtypes.infer_plan(str(csv_path), sample_rows=2000)
+    assert plan['category'] == ['cat']
+
+    def payloads(plan):
+        return [payload for chunk in dtypes.read_csv(str(csv_path), plan, chunksize=2000)
+                for payload in _chunk_payloads(chunk)]
+
+    assert payloads(plan) == payloads(None)
+
+def test_categories_are_read_as_categorical(tmp_path):
+    """Las columnas categóricas del plan se leen como categóricas y las fechas se quedan como texto"""
+    import pandas as pd
+    from src.etl import dtypes
+    from src.etl.extract import _chunk_payloads
+
+    csv_path = tmp_path / 'ventas.csv'
+    rows = ["fecha,category,ratio"] + [
+        f"2024-01-{i % 28 + 1:02d} 10:{i % 60:02d}:00,{['a', 'b', ''][i % 3]},{i / 7}" for i in range(300)
+    ]
+    csv_path.write_text("\n".join(rows) + "\n")
+
+    plan = dtypes.infer_plan(str(csv_path))
+    assert plan['category'] == ['category']
+    assert plan['dates'] == {'fecha': '%Y-%m-%d %H:%M:%S'}
+
+    frame = dtypes.read_csv(str(csv_path), plan)
+    assert isinstance(frame['category'].dtype, pd.CategoricalDtype)
+    assert not pd.api.types.is_datetime64_any_dtype(frame['fecha'])
+    assert _chunk_payloads(frame) == _chunk_payloads(dtypes.read_csv(str(csv_path)))
+
+def test_numeric_category_chunk_with_nulls_matches_default_types():
+    """Un bloque de una columna categórica con números y nulos toma el tipo que inferiría pandas"""
+    import io
+    import pandas as pd
+    from src.etl import dtypes
+
+    content = "cat\n1\n\n2\n1\n"
+    frame = pd.read_csv(io.StringIO(content), dtype={'cat': 'category'})
+    plan = {'category': ['cat'], 'integer': [], 'float': [], 'dates': {}}
+
+    restored = dtypes.apply_plan(frame, plan)['cat']
+    default = pd.read_csv(io.StringIO(content))['cat']
+    assert restored.dtype == default.dtype
+    assert restored.isna().tolist() == default.isna().tolist()
+    assert restored.dropna().tolist() == default.dropna().tolist()
@@ -0,0 +1,57 @@
+import json
+
+def test_sparse_keys_read_back_as_null(tmp_path):
+    """Una clave que falta en algunos JSON se escribe como nulo en Parquet, también en columnas mixtas"""
+    import pyarrow.parquet as pq
+    from src.etl.export import flatten_payloads
+
+    payloads = [
+        json.dumps({'value': 1, 'mixed': 'a'}),
+        json.dumps({'value': 2, 'mixed': [1, 2]}),
+        json.dumps({'other': True}),
+    ]
+    frame = flatten_payloads(payloads, 'data')
+    path = tmp_path / 'sparse.parquet'
+    frame.to_parquet(path, index=False)
+
+    columns = pq.read_table(path).to_pydict()
+    assert columns['data_mixed'][0] == 'a'
+    assert json.loads(columns['data_mixed'][1]) == [1, 2]
+    assert columns['data_mixed'][2] is None
+    assert columns['data_value'] == [1, 2, None]
+    assert columns['data_other'] == [None, None, True]
+
+def test_export_query_only_reads_chunks_when_they_exist():
+    """Sin raw_data_chunks la consulta de exportación no la referencia, y nunca descarta filas sin origen"""
+    from src.etl.export import EXPORTS, export_query
+
+    for table in EXPORTS:
+        assert 'raw_data_chunks' not in str(export_query(table, False))
+        assert 'raw_data_chunks' in str(export_query(table, True))
+        assert 'IS NOT NULL' not in str(export_query(table, True))
+
+def test_rows_without_raw_record_are_exported(database, tmp_path):
+    """Las filas cuyo registro de raw_data ya no existe se exportan con la fuente desconocida"""
+    import pyarrow.parquet as pq
+    from sqlalchemy import text
+    from src.etl.export import UNKNOWN_SOURCE, export_to_parquet
+    from src.etl.load import load_to_final_table
+    from src.etl.transform import transform_raw_data
+
+    with database.begin() as conn:
+        conn.execute(text("""
+            INSERT INTO raw_data (timestamp, source, data)
+            SELECT CURRENT_TIMESTAMP, 'api', jsonb_build_object('value', n) FROM generate_series(1, 2) n
+        """))
+    assert transform_raw_data() == 2
+    assert load_to_final_table() == 2
+    # Como al retirar una partición antigua de raw_data (las tablas particionadas no tienen claves foráneas)
+    with database.begin() as conn:
+        conn.execute(text("ALTER TABLE processed_data DROP CONSTRAINT processed_data_raw_data_id_fkey"))
+        conn.execute(text("DELETE FROM raw_data WHERE id = (SELECT MIN(id) FROM raw_data)"))
+
+    assert export_to_parquet(data_dir=str(tmp_path)) == 4
+    for table in ('processed', 'final'):
+        sources = sorted(path.name for path in (tmp_path / table).glob('fecha=*/source=*'))
+        assert sources == [f"source={UNKNOWN_SOURCE}", 'source=api']
+        assert pq.read_table(tmp_path / table).num_rows == 2
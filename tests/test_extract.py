@@ -0,0 +1,42 @@
+import json
+
+def test_payloads_keep_full_float_precision():
+    """Los decimales se guardan con todos sus dígitos y los enteros siguen siendo enteros"""
+    import pandas as pd
+    from src.etl.extract import _chunk_payloads
+
+    frame = pd.DataFrame({
+        'ratio': [0.3333333333333333, 0.1234567890123456, float('nan')],
+        'count': [1, 2, 3],
+        'name': ['a', 'b', None],
+    })
+    rows = [json.loads(payload) for payload in _chunk_payloads(frame)]
+
+    assert rows[0] == {'ratio': 0.3333333333333333, 'count': 1, 'name': 'a'}
+    assert rows[1]['ratio'] == 0.1234567890123456
+    assert rows[2] == {'ratio': None, 'count': 3, 'name': None}
+    assert all(isinstance(row['count'], int) for row in rows)
+
+def test_chunk_storage_round_trip_matches_row_payloads():
+    """Un bloque guardado en Parquet se lee con el mismo JSON que se habría guardado por fila"""
+    import pandas as pd
+    from src.etl import chunks
+    from src.etl.extract import _chunk_payloads
+
+    frame = pd.DataFrame({'ratio': [1 / 3, 2 / 3], 'count': [10, 20], 'name': ['x', 'y']})
+    frame['name'] = frame['name'].astype('category')
+
+    decoded = chunks.decode_chunk(chunks.encode_chunk(frame, [7, 8]), chunks.CHUNK_FORMAT)
+
+    assert decoded == list(zip([7, 8], _chunk_payloads(frame)))
+
+def test_numeric_rows_keep_integer_columns():
+    """En un bloque solo numérico las columnas enteras no pasan a float (el hash de la fila no cambia)"""
+    import pandas as pd
+    from src.etl.extract import _chunk_payloads
+
+    frame = pd.DataFrame({'a': [1, 2], 'ratio': [0.5, 1.25]})
+
+    assert [json.loads(payload) for payload in _chunk_payloads(frame)] == [
+        {'a': 1, 'ratio': 0.5}, {'a': 2, 'ratio': 1.25}
+    ]
@@ -0,0 +1,6 @@
+def test_etl_modules_do_not_import_heavy_packages():
+    """Importar el ETL no carga pandas, NumPy, pyarrow, el ORM, psycopg2 ni dotenv"""
+    from src.etl.importtime import heavy_imports, measure_imports
+
+    entries, _ = measure_imports(['src.etl.runner', 'src.utils.database', 'src.utils.query_cache'])
+    assert heavy_imports(entries) == {}
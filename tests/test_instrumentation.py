@@ -0,0 +1,62 @@
+def _child_progress():
+    """Función de un proceso hijo: progreso fuera y dentro de collect_progress"""
+    from src.etl.instrumentation import collect_progress, record_progress
+
+    record_progress(rows_in=100, bytes=100)
+    with collect_progress() as progress:
+        record_progress(rows_in=3, bytes=30)
+    return {'rows_in': progress.rows_in, 'bytes': progress.bytes}
+
+def test_worker_progress_is_added_in_the_parent():
+    """El progreso de un worker se devuelve al padre en lugar de sumarse a una copia de su etapa"""
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+    from src.etl.instrumentation import record_progress, track_stage
+
+    with track_stage('transform') as run:
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('fork')) as pool:
+            progress = pool.submit(_child_progress).result()
+        assert (run.rows_in, run.bytes) == (0, 0)
+        record_progress(**progress)
+    assert (run.rows_in, run.bytes) == (3, 30)
+
+def test_stage_record():
+    """El registro de una etapa toma rows_out como registros procesados y calcula las filas por segundo"""
+    from src.etl.instrumentation import StageRun
+
+    run = StageRun('load')
+    run.add(rows_in=10, rows_out=8, bytes=100)
+    run.error = 'fallo'
+    run.finish()
+
+    record = run.as_record()
+    assert record['records_processed'] == 8
+    assert (record['rows_in'], record['rows_out'], record['bytes']) == (10, 8, 100)
+    assert record['success'] is False
+    assert record['error_message'] == 'fallo'
+    assert record['rows_per_second'] == 8 / run.elapsed
+    assert record['peak_memory_mb'] > 0
+
+def test_nested_stage_calls_are_counted_once(monkeypatch):
+    """Una función instrumentada que llama a otra del mismo proceso registra una sola ejecución"""
+    from src.etl import instrumentation
+
+    @instrumentation.instrumented('extract')
+    def inner():
+        instrumentation.record_progress(rows_in=2)
+        return 2
+
+    @instrumentation.instrumented('extract')
+    def outer():
+        return inner() + 1
+
+    runs = []
+    original = instrumentation.StageRun.finish
+
+    def finish(run):
+        original(run)
+        runs.append(run)
+
+    monkeypatch.setattr(instrumentation.StageRun, 'finish', finish)
+    assert outer() == 3
+    assert [(run.rows_in, run.rows_out) for run in runs] == [(2, 3)]
@@ -0,0 +1,63 @@
+import pytest
+
+def test_backends_serialize_numpy_and_pandas_values_alike():
+    """Todos los backends serializan igual los tipos de NumPy y pandas y escriben NaN como null"""
+    import numpy as np
+    import pandas as pd
+    from src.etl import json_utils
+
+    value = {
+        'entero': np.int64(3),
+        'decimal': np.float64(0.5),
+        'nan': float('nan'),
+        'nan_numpy': np.float64('nan'),
+        'bool': np.bool_(True),
+        'array': np.array([1, 2]),
+        'fecha': pd.Timestamp('2024-01-02 03:04:05'),
+        'nat': pd.NaT,
+        'lista': [1.5, float('inf')],
+    }
+    expected = {
+        'entero': 3, 'decimal': 0.5, 'nan': None, 'nan_numpy': None, 'bool': True,
+        'array': [1, 2], 'fecha': '2024-01-02T03:04:05', 'nat': None, 'lista': [1.5, None],
+    }
+    for name in json_utils.BACKENDS:
+        dumps, loads = json_utils.BACKENDS[name]
+        assert loads(dumps(value)) == expected, name
+
+def test_set_backend(monkeypatch):
+    """set_backend activa el backend pedido y rechaza los que no están disponibles"""
+    from src.etl import json_utils
+
+    active = json_utils.get_backend()
+    try:
+        assert json_utils.set_backend('stdlib') == 'stdlib'
+        assert json_utils.get_backend() == 'stdlib'
+        assert json_utils.loads(json_utils.dumps({'a': [1, None]})) == {'a': [1, None]}
+
+        monkeypatch.setenv("ETL_JSON_BACKEND", "stdlib")
+        assert json_utils.set_backend() == 'stdlib'
+
+        with pytest.raises(ValueError):
+            json_utils.set_backend('inexistente')
+    finally:
+        json_utils.set_backend(active)
+
+def test_loads_returns_decoded_values_unchanged():
+    """loads devuelve tal cual los valores que psycopg2 ya decodificó"""
+    from src.etl import json_utils
+
+    value = {'a': 1}
+    assert json_utils.loads(value) is value
+    assert json_utils.loads(b'{"a": 1}') == value
+
+def test_dumps_rows_keeps_integers_and_decimals():
+    """dumps_rows no convierte los enteros en float ni redondea los decimales"""
+    import pandas as pd
+    from src.etl import json_utils
+
+    frame = pd.DataFrame({'id': [1, 2], 'ratio': [0.1234567890123456, 2.5]})
+    assert [json_utils.loads(row) for row in json_utils.dumps_rows(frame)] == [
+        {'id': 1, 'ratio': 0.1234567890123456},
+        {'id': 2, 'ratio': 2.5},
+    ]
@@ -0,0 +1,26 @@
+def test_batch_metrics_match_per_record_metrics():
+    """La versión por lotes de las métricas devuelve lo mismo que la versión por registro"""
+    import random
+    from src.etl.load import calculate_metrics_and_insights, calculate_metrics_and_insights_batch
+
+    rng = random.Random(7)
+    records = [
+        {'a': rng.randint(-500, 500), 'b': rng.random() * 1000, 'c': 'texto'}
+        for _ in range(50)
+    ] + [
+        {'a': True, 'b': None},
+        {'a': 1, 'b': 'no numérico'},
+        {'x': 'sin números'},
+        {'a': 1e308, 'b': 1e308},
+        {'b': 2.5, 'a': 3},
+        {},
+    ]
+
+    expected = [calculate_metrics_and_insights(record) for record in records]
+    assert calculate_metrics_and_insights_batch(records) == expected
+
+def test_batch_metrics_of_empty_batch():
+    """Un lote vacío no produce métricas"""
+    from src.etl.load import calculate_metrics_and_insights_batch
+
+    assert calculate_metrics_and_insights_batch([]) == []
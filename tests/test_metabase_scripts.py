@@ -0,0 +1,63 @@
+import importlib.util
+import os
+import pytest
+
+SCRIPTS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'metabase', 'scripts')
+
+def load_script(name):
+    """Importa un script de metabase/scripts como módulo"""
+    spec = importlib.util.spec_from_file_location(name, os.path.join(SCRIPTS_DIR, f"{name}.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def test_skewed_choice_follows_zipf_weights():
+    """Con skew=0 la elección es uniforme y con skew>0 los primeros valores son más frecuentes"""
+    pytest.importorskip('faker')
+    import numpy as np
+    script = load_script('cargar_datos_ejemplo')
+
+    options = ['a', 'b', 'c', 'd']
+    uniform = script.skewed_choice(np.random.default_rng(1), options, 40000, skew=0)
+    skewed = script.skewed_choice(np.random.default_rng(1), options, 40000, skew=2)
+
+    assert set(uniform) == set(options)
+    uniform_counts = [np.count_nonzero(uniform == option) for option in options]
+    assert max(uniform_counts) / min(uniform_counts) < 1.1
+    skewed_counts = [np.count_nonzero(skewed == option) for option in options]
+    assert skewed_counts == sorted(skewed_counts, reverse=True)
+    # Pesos 1, 1/4, 1/9, 1/16: el primer valor ronda el 70 %
+    assert 0.67 < skewed_counts[0] / 40000 < 0.73
+
+def test_backup_objects_are_stored_once(tmp_path):
+    """Un objeto sin cambios se guarda una sola vez y se lee igual que se guardó"""
+    script = load_script('respaldar_metabase')
+
+    data = {'id': 1, 'name': 'Ventas', 'cards': [1, 2]}
+    digest = script.store_object(str(tmp_path), data)
+    assert script.store_object(str(tmp_path), dict(reversed(list(data.items())))) == digest
+    assert script.load_object(str(tmp_path), digest) == data
+    assert len(list((tmp_path / 'objects').rglob('*.json.gz'))) == 1
+
+def test_incremental_backup_reuses_unchanged_items(tmp_path):
+    """En modo incremental solo se descargan los elementos cuyo updated_at cambió"""
+    script = load_script('respaldar_metabase')
+
+    output_dir = str(tmp_path)
+    fetched = []
+
+    def fetch(url, session_token, item_id, session=None):
+        fetched.append(item_id)
+        return {'id': item_id, 'version': len(fetched)}
+
+    items = [{'id': 1, 'name': 'a', 'updated_at': 't1'}, {'id': 2, 'name': 'b', 'updated_at': 't1'}]
+    previous, _, _ = script.export_items('url', 'token', output_dir, 'dashboard', items, fetch, None, None, 2)
+
+    items[1] = dict(items[1], updated_at='t2')
+    fetched.clear()
+    entries, downloaded, reused = script.export_items('url', 'token', output_dir, 'dashboard', items, fetch,
+                                                      previous, None, 2)
+    assert fetched == [2]
+    assert (downloaded, reused) == (1, 1)
+    assert entries['1'] == previous['1']
+    assert entries['2']['updated_at'] == 't2'
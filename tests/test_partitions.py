@@ -0,0 +1,28 @@
+import pytest
+from sqlalchemy import text
+
+def test_stages_refuse_to_run_during_migration(database):
+    """Con filas sin copiar en <tabla>_legacy, transform no avanza su marca de agua"""
+    from src.etl.checkpoint import ensure_checkpoint_table, get_watermark
+    from src.etl.partitions import check_migrations
+    from src.etl.transform import transform_raw_data
+
+    with database.begin() as conn:
+        ensure_checkpoint_table(conn)
+        conn.execute(text("""
+            INSERT INTO raw_data (timestamp, source, data) VALUES (CURRENT_TIMESTAMP, 'api', '{"value": 1}')
+        """))
+        conn.execute(text("CREATE TABLE raw_data_legacy (LIKE raw_data)"))
+        conn.execute(text("INSERT INTO raw_data_legacy SELECT * FROM raw_data"))
+
+    assert transform_raw_data() == 0
+    with database.begin() as conn:
+        assert get_watermark(conn, 'transform') == 0
+        with pytest.raises(RuntimeError):
+            check_migrations(conn, 'export_final')
+        # Terminada la copia, la tabla original conservada no bloquea las etapas
+        conn.execute(text("""
+            INSERT INTO etl_checkpoints (stage, last_id) SELECT 'partition_migration:raw_data', MAX(id)
+            FROM raw_data_legacy
+        """))
+        check_migrations(conn, 'transform')
@@ -0,0 +1,67 @@
+from sqlalchemy import text
+
+def test_pipeline_reingestion_is_idempotent(database, tmp_path):
+    """Volver a cargar un archivo con el pipeline o con extract no duplica filas"""
+    from src.etl.extract import extract_from_csv
+    from src.etl.pipeline import run_csv_pipeline
+
+    csv_path = tmp_path / 'ventas.csv'
+    csv_path.write_text("category,value\na,1\nb,2\na,1\n")
+
+    assert run_csv_pipeline(str(csv_path), 'ventas') == 2
+    assert run_csv_pipeline(str(csv_path), 'ventas') == 0
+    assert run_csv_pipeline(str(csv_path), 'ventas', force=True) == 0
+    assert extract_from_csv(str(csv_path), 'ventas', force=True) == 0
+    with database.connect() as conn:
+        for table in ('raw_data', 'processed_data', 'final_data'):
+            assert conn.execute(text(f"SELECT COUNT(*) FROM {table}")).scalar() == 2
+
+def test_rows_are_deduplicated_across_load_modes(database, tmp_path):
+    """Una fila cargada por un modo se reconoce como duplicada en los demás (columnas enteras y decimales)"""
+    from src.etl.extract import extract_from_csv
+    from src.etl.pipeline import run_csv_pipeline
+
+    csv_path = tmp_path / 'medidas.csv'
+    csv_path.write_text("a,b,ratio\n1,2,0.3333333333333333\n3,4,0.5\n")
+
+    assert extract_from_csv(str(csv_path), 'medidas') == 2
+    assert extract_from_csv(str(csv_path), 'medidas', chunksize=1, force=True) == 0
+    assert extract_from_csv(str(csv_path), 'medidas', storage='chunks', force=True) == 0
+    assert run_csv_pipeline(str(csv_path), 'medidas', force=True) == 0
+    with database.connect() as conn:
+        assert conn.execute(text("SELECT COUNT(*) FROM raw_data")).scalar() == 2
+        assert conn.execute(text(
+            "SELECT data FROM raw_data ORDER BY id LIMIT 1"
+        )).scalar() == {'a': 1, 'b': 2, 'ratio': 0.3333333333333333}
+
+def test_processed_rows_come_from_stored_payloads():
+    """El pipeline transforma el JSON que guarda en raw_data, como haría transform al leerlo"""
+    import pandas as pd
+    from src.etl import json_utils
+    from src.etl.pipeline import _compute_batch
+    from src.etl.transform import clean_and_transform_batch
+
+    chunk = pd.DataFrame({'Category': ['a', None], 'Value': [1.5, float('nan')], 'Units': [1, 2]})
+    batch = _compute_batch(chunk)
+    expected = clean_and_transform_batch([json_utils.loads(payload) for payload in batch['raw']])
+    assert [json_utils.loads(payload) for payload in batch['processed']] == expected
+
+def test_pipeline_writes_staging_and_rollups(database, tmp_path, monkeypatch):
+    """El pipeline escribe staging y actualiza los agregados como extract, transform y load"""
+    from src.etl import pipeline
+    from src.etl.transform import clean_and_transform_batch
+
+    monkeypatch.setattr(pipeline, 'STAGING_ENABLED', True)
+    calls = []
+    monkeypatch.setattr(pipeline, 'refresh_rollups_after_write', calls.append)
+    csv_path = tmp_path / 'ventas.csv'
+    csv_path.write_text("category,value\na,1\nb,\n")
+
+    assert pipeline.run_csv_pipeline(str(csv_path), 'ventas') == 2
+    assert calls == [['processed_data', 'final_data']]
+    with database.connect() as conn:
+        assert conn.execute(text("SELECT COUNT(*) FROM staging_ventas")).scalar() == 2
+        rows = conn.execute(text(
+            "SELECT r.data, p.data FROM raw_data r JOIN processed_data p ON p.raw_data_id = r.id ORDER BY r.id"
+        )).fetchall()
+    assert [row[1] for row in rows] == clean_and_transform_batch([row[0] for row in rows])
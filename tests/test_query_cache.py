@@ -0,0 +1,95 @@
+from sqlalchemy import text
+
+class FakeCursor:
+    """Cursor de psycopg2 mínimo: registra las sentencias y responde que etl_table_versions existe"""
+
+    def __init__(self):
+        self.statements = []
+
+    def execute(self, statement, params=None):
+        self.statements.append(statement)
+
+    def fetchone(self):
+        return (True,)
+
+def test_referenced_tables_reads_from_and_join_lists():
+    """Las tablas se obtienen de FROM, JOIN, listas con comas y subconsultas, sin alias ni esquema"""
+    from src.utils.query_cache import referenced_tables
+
+    query = """
+        SELECT * FROM public.raw_data r, processed_data AS p
+        JOIN final_data f ON f.processed_data_id = p.id
+        WHERE r.id IN (SELECT raw_data_id FROM "Staging_Ventas")
+    """
+    assert referenced_tables(query) == ['final_data', 'processed_data', 'raw_data', 'staging_ventas']
+
+def test_entries_are_invalidated_by_version_and_ttl():
+    """Un resultado deja de servirse si cambia la versión de una de sus tablas o si supera el TTL"""
+    from src.utils.query_cache import QueryCache
+
+    cache = QueryCache(ttl=60, directory=None)
+    cache.put('k', {'raw_data': 1}, [(1,)])
+    assert cache.get('k', {'raw_data': 1}) == [(1,)]
+    assert cache.get('k', {'raw_data': 2}) is None
+    assert cache.stats()['invalidations'] == 1
+
+    expired = QueryCache(ttl=-1, directory=None)
+    expired.put('k', {'raw_data': 1}, [(1,)])
+    assert expired.get('k', {'raw_data': 1}) is None
+    assert expired.stats()['expirations'] == 1
+
+def test_versions_are_only_bumped_with_the_cache_enabled(monkeypatch):
+    """Sin caché no se toca etl_table_versions; con caché se comprueba la tabla una vez por proceso"""
+    from src.utils import query_cache
+
+    monkeypatch.setattr(query_cache, '_versions_table_ready', False)
+    cursor = FakeCursor()
+    monkeypatch.setattr(query_cache, 'QUERY_CACHE_ENABLED', False)
+    query_cache.bump_table_versions(cursor, ['raw_data'])
+    assert cursor.statements == []
+
+    monkeypatch.setattr(query_cache, 'QUERY_CACHE_ENABLED', True)
+    query_cache.bump_table_versions(cursor, ['raw_data'])
+    query_cache.bump_table_versions(cursor, ['processed_data'])
+    assert cursor.statements == [query_cache.TABLE_VERSIONS_EXISTS_QUERY,
+                                 query_cache.BUMP_VERSIONS_SQL, query_cache.BUMP_VERSIONS_SQL]
+
+def test_views_are_replaced_by_their_base_tables(monkeypatch):
+    """Una vista (también sobre otra vista) depende de las versiones de sus tablas base"""
+    from src.utils import query_cache
+
+    dependencies = {'resumen': ['ventas_recientes'], 'ventas_recientes': ['raw_data', 'processed_data']}
+    lookups = []
+
+    class Connection:
+        def execute(self, query, params):
+            lookups.append(sorted(params['names']))
+            rows = [(name, dependency) for name in params['names'] for dependency in dependencies.get(name, [])]
+            return type('Result', (), {'fetchall': lambda self: rows})()
+
+    monkeypatch.setattr(query_cache, '_view_tables', {})
+    expected = ['processed_data', 'raw_data', 'resumen', 'ventas_recientes']
+    assert query_cache.base_tables(Connection(), ['resumen']) == expected
+    # Las dependencias ya resueltas no se vuelven a consultar
+    assert query_cache.base_tables(Connection(), ['resumen']) == expected
+    assert len(lookups) == 3
+
+def test_cached_results_are_invalidated_by_etl_writes(database, monkeypatch):
+    """Un resultado en caché sobre una tabla o una vista deja de servirse cuando transform escribe"""
+    from src.etl.transform import transform_raw_data
+    from src.utils import query_cache
+    from src.utils.database import execute_query
+
+    monkeypatch.setattr(query_cache, 'QUERY_CACHE_ENABLED', True)
+    monkeypatch.setattr(query_cache, '_view_tables', {})
+    monkeypatch.setattr(query_cache, '_cache', query_cache.QueryCache(directory=None))
+    with database.begin() as conn:
+        conn.execute(text("CREATE VIEW procesados AS SELECT id FROM processed_data"))
+        conn.execute(text("""
+            INSERT INTO raw_data (timestamp, source, data) VALUES (CURRENT_TIMESTAMP, 'api', '{"value": 1}')
+        """))
+
+    queries = [text("SELECT COUNT(*) FROM processed_data"), text("SELECT COUNT(*) FROM procesados")]
+    assert [execute_query(query, cache=True)[0][0] for query in queries] == [0, 0]
+    assert transform_raw_data() == 1
+    assert [execute_query(query, cache=True)[0][0] for query in queries] == [1, 1]
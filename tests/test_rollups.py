@@ -0,0 +1,57 @@
+from sqlalchemy import text
+
+def test_refresh_after_write_only_touches_written_sources(monkeypatch):
+    """Cada etapa actualiza solo los agregados de las tablas que escribe, y nunca propaga sus errores"""
+    from src.etl import rollups
+
+    calls = []
+    monkeypatch.setattr(rollups, 'refresh_rollups', lambda sources: calls.append(sources))
+    rollups.refresh_rollups_after_write(['final_data'])
+    assert calls == [['final_data']]
+
+    def failing(sources):
+        raise RuntimeError('sin conexión')
+    monkeypatch.setattr(rollups, 'refresh_rollups', failing)
+    rollups.refresh_rollups_after_write(['final_data'])
+
+    monkeypatch.setattr(rollups, 'ROLLUPS_ENABLED', False)
+    monkeypatch.setattr(rollups, 'refresh_rollups', lambda sources: calls.append(sources))
+    rollups.refresh_rollups_after_write(['processed_data'])
+    assert calls == [['final_data']]
+
+def test_rollups_define_their_own_tables():
+    """Cada agregado crea solo su tabla, con la columna dia que usan rebuild_days y las consultas"""
+    from src.etl.rollups import ROLLUPS
+
+    for name, spec in ROLLUPS.items():
+        created = [statement for statement in spec['ddl'] if 'CREATE TABLE' in statement]
+        assert len(created) == 1 and f"EXISTS {name} (" in created[0]
+        assert 'dia ' in created[0]
+
+def test_etl_schema_only_gets_the_etl_metrics_rollup(database):
+    """Con el esquema del ETL, el refresco tras transform y load no falla y solo crea rollup_etl_diaria"""
+    from src.etl.load import load_to_final_table
+    from src.etl.rollups import available_rollups, refresh_rollups
+    from src.etl.transform import transform_raw_data
+
+    with database.begin() as conn:
+        conn.execute(text("""
+            INSERT INTO raw_data (timestamp, source, data)
+            SELECT CURRENT_TIMESTAMP, 'api', jsonb_build_object('value', n) FROM generate_series(1, 3) n
+        """))
+        assert available_rollups(conn) == ['rollup_etl_diaria']
+
+    assert transform_raw_data() == 3
+    assert load_to_final_table() == 3
+    with database.connect() as conn:
+        tables = {row[0] for row in conn.execute(text(
+            "SELECT table_name FROM information_schema.tables WHERE table_name LIKE 'rollup\\_%'"
+        ))}
+    assert tables == {'rollup_etl_diaria'}
+
+    with database.begin() as conn:
+        conn.execute(text("""
+            INSERT INTO etl_metrics (process_name, start_time, end_time, records_processed, success, execution_date)
+            VALUES ('transform', CURRENT_TIMESTAMP, CURRENT_TIMESTAMP, 3, true, CURRENT_DATE)
+        """))
+    assert refresh_rollups(sources=['etl_metrics']) == {'rollup_etl_diaria': 1}
@@ -0,0 +1,17 @@
+import pytest
+
+def test_stage_mode_needs_a_stage():
+    """El modo 'stage' sin etapas válidas falla antes de conectarse a la base de datos"""
+    from src.etl.runner import run
+
+    with pytest.raises(ValueError):
+        run('stage')
+    with pytest.raises(ValueError):
+        run('stage', stages=['inexistente'])
+
+def test_backfill_mode_needs_a_start_date():
+    """El modo 'backfill' sin fecha de inicio falla antes de conectarse a la base de datos"""
+    from src.etl.runner import run
+
+    with pytest.raises(ValueError):
+        run('backfill')
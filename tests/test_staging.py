@@ -0,0 +1,47 @@
+def test_infer_schema_merges_types_and_nullability():
+    """infer_schema combina los tipos de cada clave y marca como nullable las que faltan o son nulas"""
+    from src.etl import staging
+
+    records = [
+        {'Id': 1, 'Precio': 10, 'Nombre': 'a', 'Extra': None, 'raw_data_id': 5},
+        {'Id': 2, 'Precio': 2.5, 'Nombre': 3, 'Extra': None, 'raw_data_id': 6},
+        {'Id': 3, 'Precio': 1, 'raw_data_id': 7},
+    ]
+    assert staging.infer_schema(records) == {
+        'id': ('BIGINT', False),
+        'precio': ('DOUBLE PRECISION', False),
+        'nombre': ('TEXT', True),
+        'raw_data_id_': ('BIGINT', False),
+    }
+    assert staging.infer_schema(records, sample_size=1)['precio'] == ('BIGINT', False)
+
+def test_merge_types():
+    """Los enteros y decimales se combinan en DOUBLE PRECISION y el resto de mezclas en TEXT"""
+    from src.etl.staging import merge_types
+
+    assert merge_types(None, 'BIGINT') == 'BIGINT'
+    assert merge_types('BIGINT', None) == 'BIGINT'
+    assert merge_types('BIGINT', 'DOUBLE PRECISION') == 'DOUBLE PRECISION'
+    assert merge_types('BOOLEAN', 'BIGINT') == 'TEXT'
+
+def test_column_and_table_names():
+    """Las claves del JSON se convierten en identificadores válidos de PostgreSQL"""
+    from src.etl.staging import column_name, staging_table_name
+
+    assert column_name('Precio Unitario (€)') == 'precio_unitario____'
+    assert column_name('2024') == 'c_2024'
+    assert column_name('processed_at') == 'processed_at_'
+    assert column_name('') == '_'
+    assert staging_table_name('API Ventas') == 'staging_api_ventas'
+    assert len(staging_table_name('x' * 100)) == 63
+
+def test_coerce_values_to_column_type():
+    """Los valores se adaptan al tipo de su columna"""
+    from src.etl import json_utils
+    from src.etl.staging import _coerce
+
+    assert _coerce(None, 'BIGINT') is None
+    assert _coerce(3, 'DOUBLE PRECISION') == 3.0
+    assert json_utils.loads(_coerce({'a': 1}, 'JSONB')) == {'a': 1}
+    assert _coerce(5, 'TEXT') == '5'
+    assert _coerce('texto', 'TEXT') == 'texto'
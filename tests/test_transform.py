@@ -0,0 +1,30 @@
+def test_batch_matches_single_record_transform():
+    """clean_and_transform_batch da el mismo resultado que transformar cada registro por separado"""
+    from src.etl.transform import clean_and_transform, clean_and_transform_batch
+
+    records = [
+        {},
+        {'Value': 1, 'temp_debug': 'x', 'Name': None},
+        {'value': 2.5, 'nested': {'a': None, 'b': [1, None]}},
+        {'Value': 3, 'temp_debug': 'y', 'Name': 'b'},
+        {'Value': None, 'temp_debug': 'z', 'Name': 'c'},
+        {'other': True},
+        {},
+    ]
+
+    assert clean_and_transform_batch(records) == [clean_and_transform(record) for record in records]
+
+def test_empty_records_are_kept():
+    """Un registro sin claves se transforma en un diccionario vacío, no en None"""
+    from src.etl.transform import clean_and_transform, clean_and_transform_batch
+
+    assert clean_and_transform({}) == {}
+    assert clean_and_transform_batch([{}, {'A': None}]) == [{}, {'a': 0}]
+
+def test_nested_values_are_not_altered():
+    """Los valores anidados se conservan tal cual (fillna solo rellena los nulos de primer nivel)"""
+    from src.etl.transform import clean_and_transform
+
+    assert clean_and_transform({'Nested': {'x': None}, 'List': [1, None], 'Missing': None}) == {
+        'nested': {'x': None}, 'list': [1, None], 'missing': 0
+    }